@@ -0,0 +1,157 @@
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+from sqlalchemy import Table
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+
+import qd_cyberpank_game.db as db
+from qd_cyberpank_game.budget import track_statements
+from qd_cyberpank_game.cache import SHARED_CACHE
+from qd_cyberpank_game.structures import InvestmentBid, SettlementPhase
+
+# asyncio DBAPI drivers per backend, installed separately (pip install aiosqlite / aiomysql / asyncpg)
+ASYNC_DRIVERS = {
+    'sqlite': 'aiosqlite',
+    'mysql': 'aiomysql',
+    'postgresql': 'asyncpg',
+}
+
+# keyed by the sync connection string, so cache namespaces stay the same as in db.py;
+# async pools belong to the event loop that created them, use one loop per process
+_async_engines: Dict[str, AsyncEngine] = {}
+
+
+def async_url(db_conn_str: str) -> str:
+    url = make_url(db_conn_str)
+    backend = url.get_backend_name()
+    if url.get_driver_name() == ASYNC_DRIVERS.get(backend):
+        return db_conn_str
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'No asyncio driver is known for {backend}')
+    return str(url.set(drivername=f'{backend}+{ASYNC_DRIVERS[backend]}'))
+
+
+def _async_engine_options(db_conn_str: str) -> Dict[str, Any]:
+    # the same pool settings as the sync registry, with the asyncio flavour of the pool classes
+    options = db._engine_options(db_conn_str)
+    options.pop('connect_args', None)
+    if options.get('poolclass') is not StaticPool:
+        options['poolclass'] = AsyncAdaptedQueuePool
+    return options
+
+
+def get_async_engine(db_conn_str: str) -> AsyncEngine:
+    engine = _async_engines.get(db_conn_str)
+    if engine is None:
+        engine = create_async_engine(async_url(db_conn_str), **_async_engine_options(db_conn_str))
+        track_statements(engine.sync_engine)
+        _async_engines[db_conn_str] = engine
+    return engine
+
+
+async def dispose_async_engines() -> None:
+    engines = list(_async_engines.values())
+    _async_engines.clear()
+    for engine in engines:
+        await engine.dispose()
+
+
+async def get_users(db_conn_str: str, users_table: Table) -> pd.DataFrame:
+    engine = get_async_engine(db_conn_str)
+    async with engine.connect() as conn:
+        result = (await conn.execute(db.users_stmt(users_table))).fetchall()
+    return db.users_frame(result)
+
+
+async def get_markets(db_conn_str: str, markets_table: Table) -> pd.DataFrame:
+    engine = get_async_engine(db_conn_str)
+    async with engine.connect() as conn:
+        result = (await conn.execute(db.markets_stmt(markets_table))).fetchall()
+    return db.markets_frame(result)
+
+
+async def get_cycle_investments(db_conn_str: str, uid: str, cycle: int, investments_table: Table) -> pd.DataFrame:
+    engine = get_async_engine(db_conn_str)
+    stmt = db.cycle_investments_stmt(uid, cycle, investments_table)
+    async with engine.connect() as conn:
+        result = (await conn.execute(stmt)).fetchall()
+    return db.cycle_investments_frame(result, stmt)
+
+
+async def get_transactions(db_conn_str: str, uid: str, transactions_table: Table) -> pd.DataFrame:
+    engine = get_async_engine(db_conn_str)
+    async with engine.connect() as conn:
+        result = (await conn.execute(db.transactions_stmt(uid, transactions_table))).fetchall()
+    return db.transactions_frame(result)
+
+
+async def get_stocks(db_conn_str: str, stocks_table: Table) -> pd.DataFrame:
+    engine = get_async_engine(db_conn_str)
+    async with engine.connect() as conn:
+        result = (await conn.execute(db.stocks_stmt(stocks_table))).fetchall()
+    return db.stocks_frame(result, stocks_table)
+
+
+async def make_investment(db_conn_str: str, investments_table: Table, invest_bid: InvestmentBid) -> None:
+    engine = get_async_engine(db_conn_str)
+    async with engine.begin() as conn:
+        await conn.execute(db.investment_stmt(investments_table, invest_bid))
+
+
+async def finish_cycle(
+    db_conn_str: str,
+    investments_df: pd.DataFrame,
+    markets_df: pd.DataFrame,
+    stocks_df: pd.DataFrame,
+    users_df: pd.DataFrame,
+    fund_speed: float,
+    cycle: int,
+    investments_table: Table,
+    markets_table: Table,
+    market_links_table: Table,
+    transactions_table: Table,
+    stocks_table: Table,
+    balances_table: Table,
+    cycle_balances_table: Table,
+    balance_snapshots_table: Table,
+    market_snapshots_table: Table,
+    price_snapshots_table: Table,
+    unlock_snapshots_table: Table,
+    seed: Optional[int] = None,
+    now: Optional[datetime] = None,
+) -> List[SettlementPhase]:
+    # the calculation runs off the event loop, the writes reuse db.write_cycle inside one async transaction
+    engine = get_async_engine(db_conn_str)
+    async with engine.connect() as conn:
+        last_prices = await conn.run_sync(db.load_closing_prices, cycle - 1, price_snapshots_table)
+    market_incomes, market_capacities, new_stocks, closing_prices, calculation_phase = await asyncio.get_running_loop().run_in_executor(
+        None,
+        lambda: db.calculate_cycle(investments_df, markets_df, stocks_df, users_df, fund_speed, cycle, seed=seed, now=now, last_prices=last_prices),
+    )
+    async with engine.begin() as conn:
+        phases = await conn.run_sync(
+            db.write_cycle,
+            market_incomes,
+            market_capacities,
+            new_stocks,
+            closing_prices,
+            users_df,
+            cycle,
+            investments_table,
+            markets_table,
+            market_links_table,
+            transactions_table,
+            stocks_table,
+            balances_table,
+            cycle_balances_table,
+            balance_snapshots_table,
+            market_snapshots_table,
+            price_snapshots_table,
+            unlock_snapshots_table,
+        )
+    SHARED_CACHE.invalidate(db_conn_str)
+    return [calculation_phase] + phases
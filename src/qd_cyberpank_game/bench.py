@@ -0,0 +1,135 @@
+import json
+import platform
+import timeit
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from qd_cyberpank_game.engine import calculate_investments, calculate_market, cycle_rng, generate_stocks
+from qd_cyberpank_game.metrics import METRICS
+from qd_cyberpank_game.structures import BenchmarkResult
+
+CALCULATE_MARKET_SIZES = [10, 100, 1000, 10000]
+CALCULATE_INVESTMENTS_SIZES = [(100, 9), (1000, 90), (10000, 900)]
+GENERATE_STOCKS_SIZES = [(10, 30), (100, 100), (1000, 100)]
+QUICK_SIZES = 2  # --quick keeps only the smallest sizes of every function
+
+
+def make_investments(n_bids: int, n_markets: int, rng: np.random.Generator) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    markets_df = pd.DataFrame({
+        'name': [f'market{i}' for i in range(n_markets)],
+        'capacity': rng.uniform(2.5e8, 2.5e9, size=n_markets),
+        'min_capacity': 20000.0,
+    })
+    now = datetime.now()
+    investments_df = pd.DataFrame({
+        'id': np.arange(n_bids),
+        'uid': [f'uid{i % max(n_bids // 3, 1)}' for i in range(n_bids)],
+        'market': rng.choice(markets_df['name'].values, size=n_bids),
+        'amount': rng.uniform(1e6, 3e8, size=n_bids),
+        'timestamp_approved': now - pd.to_timedelta(rng.integers(60, 900, size=n_bids), unit='s'),
+        'status': 1,
+        'income': np.nan,
+        'multiplier': 1.0,
+    })
+    return investments_df, markets_df
+
+
+def make_stocks(n_tickets: int, n_cycles: int, rng: np.random.Generator) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    users_df = pd.DataFrame({'uid': [f'uid{i}' for i in range(n_tickets)], 'ticket': [f'T{i}' for i in range(n_tickets)]})
+    cycles = np.arange(n_cycles * 5) / 5
+    stocks_df = pd.DataFrame({
+        'cycle': np.tile(cycles, n_tickets),
+        'ticket': np.repeat(users_df['ticket'].values, len(cycles)),
+        'price': rng.uniform(50, 150, size=n_tickets * len(cycles)),
+    })
+    market_incomes = pd.DataFrame({
+        'uid': rng.choice(users_df['uid'].values, size=n_tickets * 3),
+        'income': rng.normal(0, 1e7, size=n_tickets * 3),
+    })
+    return stocks_df, users_df, market_incomes
+
+
+def time_call(func: Callable[[], object], repeat: int) -> float:
+    # best per-call time over several autoranged runs, the least noisy estimate on a shared machine
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def benchmark_cases(quick: bool = False) -> List[Tuple[str, str, Callable[[], object]]]:
+    rng = np.random.default_rng(0)
+    limit = QUICK_SIZES if quick else None
+    cases = []
+    for n_bids in CALCULATE_MARKET_SIZES[:limit]:
+        x = rng.uniform(1e6, 3e8, size=n_bids)
+        cases.append(('calculate_market', f'bids={n_bids}', lambda x=x: calculate_market(x.copy(), 2.5e8, 20000.0)))
+    for n_bids, n_markets in CALCULATE_INVESTMENTS_SIZES[:limit]:
+        investments_df, markets_df = make_investments(n_bids, n_markets, rng)
+        cases.append((
+            'calculate_investments',
+            f'bids={n_bids},markets={n_markets}',
+            lambda investments_df=investments_df, markets_df=markets_df: calculate_investments(
+                investments_df, markets_df, 50000000.0, now=datetime.now() + timedelta(minutes=10),
+            ),
+        ))
+    for n_tickets, n_cycles in GENERATE_STOCKS_SIZES[:limit]:
+        stocks_df, users_df, market_incomes = make_stocks(n_tickets, n_cycles, rng)
+        cases.append((
+            'generate_stocks',
+            f'tickets={n_tickets},cycles={n_cycles}',
+            lambda stocks_df=stocks_df, users_df=users_df, market_incomes=market_incomes: generate_stocks(
+                market_incomes, stocks_df, users_df, n_cycles, rng=cycle_rng(n_cycles, 0),
+            ),
+        ))
+    return cases
+
+
+def run_benchmarks(repeat: int = 5, quick: bool = False, baseline: Optional[Dict[str, float]] = None) -> List[BenchmarkResult]:
+    # the engine alone is timed, timing spans stay off so baselines compare across instrumented and plain builds
+    results = []
+    metrics_enabled, METRICS.enabled = METRICS.enabled, False
+    try:
+        for name, size, func in benchmark_cases(quick):
+            result = BenchmarkResult(name=name, size=size, seconds=time_call(func, repeat))
+            result.baseline = (baseline or {}).get(result.key)
+            results.append(result)
+    finally:
+        METRICS.enabled = metrics_enabled
+    return results
+
+
+def find_regressions(results: List[BenchmarkResult], threshold: float) -> List[BenchmarkResult]:
+    return [result for result in results if result.baseline is not None and result.seconds > result.baseline * (1 + threshold)]
+
+
+def save_baseline(path: str, results: List[BenchmarkResult]) -> None:
+    baseline = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+        },
+        'results': {result.key: result.seconds for result in results},
+    }
+    with open(path, 'w') as baseline_file:
+        json.dump(baseline, baseline_file, indent=2)
+
+
+def load_baseline(path: str) -> Dict[str, float]:
+    with open(path) as baseline_file:
+        return json.load(baseline_file)['results']
+
+
+def results_frame(results: List[BenchmarkResult]) -> pd.DataFrame:
+    results_df = pd.DataFrame({
+        'benchmark': [result.key for result in results],
+        'ms': [result.seconds * 1000 for result in results],
+        'baseline_ms': [result.baseline * 1000 if result.baseline is not None else np.nan for result in results],
+    })
+    results_df['ratio'] = results_df['ms'] / results_df['baseline_ms']
+    return results_df
@@ -0,0 +1,139 @@
+import logging
+import sys
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+import pandas as pd
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+PACKAGE = 'qd_cyberpank_game'
+# frames of these modules are wrappers, the call site is the first package frame below them
+WRAPPER_MODULES = (f'{PACKAGE}.budget', f'{PACKAGE}.metrics')
+# DBAPI round trips (execute or executemany calls) per scope: a rerun is a whole dashboard page, callbacks are named
+# after their functions; scopes without a budget are only counted
+STATEMENT_BUDGETS: Dict[str, int] = {
+    'rerun': 30,
+    'finish_cycle_callback': 80,
+    'markets_investment_callback': 30,
+    'bid_check_callback': 5,
+}
+# 'warn' logs scopes over budget, 'raise' fails them (e.g. benchmark runs)
+BUDGET_MODES = ('warn', 'raise')
+BUDGET_MODE = 'warn'
+
+
+class StatementBudgetExceeded(RuntimeError):
+    pass
+
+
+class StatementScope:
+    # statements, DBAPI round trips and affected rows of one rerun or callback, by call site;
+    # loader threads record into the scope of the rerun that submitted them
+    def __init__(self, name: str, budget: Optional[int], parent: Optional['StatementScope'] = None):
+        self.name = name
+        self.budget = budget
+        self.parent = parent
+        self.statements = 0
+        self.round_trips = 0
+        self.rows = 0
+        self.sites: Dict[str, List[int]] = defaultdict(lambda: [0, 0, 0])
+        self._lock = threading.Lock()
+
+    def record(self, site: str, statements: int, rows: int) -> None:
+        with self._lock:
+            self.statements += statements
+            self.round_trips += 1
+            self.rows += rows
+            counts = self.sites[site]
+            counts[0] += statements
+            counts[1] += 1
+            counts[2] += rows
+
+    @property
+    def exceeded(self) -> bool:
+        return self.budget is not None and self.round_trips > self.budget
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'scope': self.name,
+            'statements': self.statements,
+            'round_trips': self.round_trips,
+            'rows': self.rows,
+            'budget': self.budget,
+        }
+
+    def report(self) -> pd.DataFrame:
+        with self._lock:
+            rows = [
+                {'site': site, 'statements': statements, 'round_trips': round_trips, 'rows': rows}
+                for site, (statements, round_trips, rows) in self.sites.items()
+            ]
+        frame = pd.DataFrame(rows, columns=['site', 'statements', 'round_trips', 'rows'])
+        return frame.sort_values('round_trips', ascending=False).reset_index(drop=True)
+
+
+_current_scope: ContextVar[Optional[StatementScope]] = ContextVar('statement_scope', default=None)
+
+
+def configure_statement_budgets(mode: Optional[str] = None, **budgets: int) -> None:
+    # e.g. configure_statement_budgets(mode='raise', rerun=20), budgets of other scopes are kept
+    global BUDGET_MODE
+    if mode is not None:
+        if mode not in BUDGET_MODES:
+            raise ValueError(f"Unknown budget mode {mode}, expected one of {', '.join(BUDGET_MODES)}")
+        BUDGET_MODE = mode
+    STATEMENT_BUDGETS.update({name: int(budget) for name, budget in budgets.items()})
+
+
+def call_site() -> str:
+    # innermost frame of the package outside the wrappers, e.g. db.get_users
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith(f'{PACKAGE}.') and module not in WRAPPER_MODULES:
+            return f"{module[len(PACKAGE) + 1:]}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return 'unknown'
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    scope = _current_scope.get()
+    if scope is None:
+        return
+    # executemany is one round trip of many statements; DBAPIs report -1 rows for SELECT where they do not know
+    statements = len(parameters) if executemany else 1
+    rows = max(cursor.rowcount, 0)
+    site = call_site()
+    while scope is not None:
+        scope.record(site, statements, rows)
+        scope = scope.parent
+
+
+def track_statements(engine: Engine) -> None:
+    # counting costs a context variable lookup per statement when no scope is open
+    if not event.contains(engine, 'after_cursor_execute', _after_cursor_execute):
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+@contextmanager
+def statement_scope(name: str, budget: Optional[int] = None) -> Iterator[StatementScope]:
+    # counts every statement run inside the block, nested scopes also count into the enclosing ones;
+    # the budget defaults to STATEMENT_BUDGETS[name] and is checked when the block exits
+    scope = StatementScope(name, budget if budget is not None else STATEMENT_BUDGETS.get(name), _current_scope.get())
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+    if scope.exceeded:
+        top_sites = ', '.join(f'{site}={round_trips}' for site, round_trips in scope.report()[['site', 'round_trips']].head(5).values)
+        message = f'{name} made {scope.round_trips} SQL round trips ({scope.statements} statements), budget is {scope.budget}: {top_sites}'
+        if BUDGET_MODE == 'raise':
+            raise StatementBudgetExceeded(message)
+        logger.warning(message)
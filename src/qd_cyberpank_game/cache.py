@@ -0,0 +1,67 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class SharedCache:
+    # process-wide LRU cache shared by all streamlit sessions, values must be treated as read-only
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: 'OrderedDict[Tuple[Hashable, ...], Any]' = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, namespace: str, dataset: str, version: Hashable) -> Tuple[Hashable, ...]:
+        return namespace, self._generations.get(namespace, 0), dataset, version
+
+    def get_or_load(self, namespace: str, dataset: str, version: Hashable, loader: Callable[[], Any]) -> Any:
+        with self._lock:
+            key = self._key(namespace, dataset, version)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        # load outside the lock, concurrent misses of the same key just load twice
+        value = loader()
+        with self._lock:
+            if key[1] == self._generations.get(namespace, 0):
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, namespace: str) -> None:
+        # called by write paths, bumping the generation makes every older entry unreachable
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            for key in [key for key in self._entries if key[0] == namespace]:
+                del self._entries[key]
+
+    def generation(self, namespace: str) -> int:
+        # moves with every invalidate, i.e. with every write of this process to the namespace
+        with self._lock:
+            return self._generations.get(namespace, 0)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+
+# namespaces are db connection strings
+SHARED_CACHE = SharedCache()
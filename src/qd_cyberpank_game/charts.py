@@ -0,0 +1,52 @@
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# cycles shown by default, the full history is drawn on demand
+STOCK_WINDOW_CYCLES = 20
+# per ticket; longer series are decimated, so the browser payload stays bounded however long the game is
+MAX_CHART_POINTS = 300
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    # Largest-Triangle-Three-Buckets: indices of `threshold` points (first and last included) that keep the visual
+    # shape of the series; x must be sorted. Every bucket keeps the point forming the largest triangle with the point
+    # kept in the previous bucket and the mean of the next bucket
+    n_points = len(x)
+    if threshold >= n_points or threshold < 3:
+        return np.arange(n_points)
+    edges = np.floor(np.linspace(1, n_points - 1, threshold - 1)).astype(np.int64)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n_points - 1
+    prev = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n_points
+        next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+        # doubled triangle areas, the constant factor does not change the argmax
+        areas = np.abs((x[prev] - next_x) * (y[start:end] - y[prev]) - (x[prev] - x[start:end]) * (next_y - y[prev]))
+        prev = start + int(np.argmax(areas))
+        kept[bucket + 1] = prev
+    return kept
+
+
+def stocks_window(stocks_df: pd.DataFrame, cycle: int, window_cycles: Optional[int]) -> Tuple[pd.DataFrame, Tuple[float, float]]:
+    # quotes of the last window_cycles cycles (all of them for None) and the x domain of the chart
+    start = 0 if window_cycles is None else max(cycle - window_cycles, 0)
+    window_df = stocks_df[stocks_df['cycle'] >= start] if start else stocks_df
+    return window_df[['cycle', 'ticket', 'price']].sort_values(['ticket', 'cycle'], kind='stable'), (start, cycle)
+
+
+def downsample_stocks(stocks_df: pd.DataFrame, max_points: int = MAX_CHART_POINTS) -> pd.DataFrame:
+    # stocks_df sorted by ticket and cycle, as returned by stocks_window
+    parts = []
+    for _, ticket_df in stocks_df.groupby('ticket', sort=False):
+        if len(ticket_df) > max_points:
+            ticket_df = ticket_df.iloc[lttb(ticket_df['cycle'].to_numpy(), ticket_df['price'].to_numpy(), max_points)]
+        parts.append(ticket_df)
+    return pd.concat(parts, ignore_index=True) if parts else stocks_df.reset_index(drop=True)
+
+
+def stocks_pivot(stocks_df: pd.DataFrame) -> pd.DataFrame:
+    return stocks_df.pivot(index='cycle', columns='ticket', values='price')
@@ -0,0 +1,295 @@
+import argparse
+import json
+import sys
+from typing import List, Optional
+
+from qd_cyberpank_game.bench import find_regressions, load_baseline, results_frame, run_benchmarks, save_baseline
+from qd_cyberpank_game.budget import BUDGET_MODES, StatementBudgetExceeded, configure_statement_budgets
+from qd_cyberpank_game.db import check_balances, get_engine, read_db_schema
+from qd_cyberpank_game.metrics import METRICS
+from qd_cyberpank_game.migrations import explain_hot_queries, get_schema_version, migrate, missing_indexes
+from qd_cyberpank_game.replay import CHECKPOINT_EVERY, CHUNK_CYCLES, replay_game
+from qd_cyberpank_game.schema import create_db_schema, verify_db_schema
+from qd_cyberpank_game.seed import seed_game
+from qd_cyberpank_game.service import make_server
+from qd_cyberpank_game.simulator import STRATEGIES, run_simulation
+from qd_cyberpank_game.structures import SweepParams
+from qd_cyberpank_game.sweep import iter_sweep
+
+
+def check_balances_command(args: argparse.Namespace) -> int:
+    db_schema = read_db_schema(args.db)
+    diff = check_balances(
+        args.db,
+        db_schema['transactions'],
+        db_schema['balances'],
+        db_schema['cycle_balances'],
+        fix=args.fix,
+    )
+    if diff.empty:
+        print('Ledger is consistent with transactions')
+        return 0
+    print(diff.to_string(index=False))
+    if args.fix:
+        print(f'Rebuilt ledger from transactions, {len(diff)} rows were off')
+        return 0
+    print(f'{len(diff)} ledger rows differ from transactions, rerun with --fix to rebuild')
+    return 1
+
+
+def create_schema_command(args: argparse.Namespace) -> int:
+    create_db_schema(get_engine(args.db))
+    print('Missing tables were created')
+    return 0
+
+
+def verify_schema_command(args: argparse.Namespace) -> int:
+    problems = verify_db_schema(get_engine(args.db))
+    for problem in problems:
+        print(problem)
+    if problems:
+        return 1
+    print('Database matches the declared schema')
+    return 0
+
+
+def migrate_command(args: argparse.Namespace) -> int:
+    engine = get_engine(args.db)
+    for migration in migrate(engine, target_version=args.target):
+        print(f'Applied {migration.version}: {migration.description}')
+    print(f'Schema version: {get_schema_version(engine)}')
+    missing = missing_indexes(engine)
+    for index in missing:
+        print(f'missing index {index}')
+    return 1 if missing else 0
+
+
+def explain_check_command(args: argparse.Namespace) -> int:
+    engine = get_engine(args.db)
+    if args.seed:
+        create_db_schema(engine)
+        with engine.begin() as conn:
+            seed_game(conn, n_users=args.users, n_markets=args.markets, n_cycles=args.cycles, seed=0)
+        migrate(engine)
+    failed = 0
+    for query_plan in explain_hot_queries(engine):
+        status = 'FULL SCAN' if query_plan.full_scans else 'ok'
+        print(f"{query_plan.name}: {status} | {' / '.join(query_plan.plan)}")
+        failed += bool(query_plan.full_scans)
+    if failed:
+        print(f'{failed} queries fall back to full table scans')
+    return 1 if failed else 0
+
+
+def simulate_command(args: argparse.Namespace) -> int:
+    budgets = dict(budget.split('=', 1) for budget in args.statement_budget)
+    configure_statement_budgets(mode=args.statement_budget_mode, **budgets)
+    try:
+        result = run_simulation(
+            args.db,
+            n_users=args.users,
+            n_markets=args.markets,
+            n_cycles=args.cycles,
+            strategy=args.strategy,
+            approve_rate=args.approve_rate,
+            seed=args.seed,
+        )
+    except StatementBudgetExceeded as error:
+        print(f'FAILED {error}')
+        return 1
+    phases = result.pop('phases')
+    statements = result.pop('statements')
+    print(f"{result['cycles']} cycles, {result['bids']} bids in {result['elapsed_s']:.2f} s: "
+          f"{result['cycles_per_s']:.2f} cycles/s, {result['bids_per_s']:.1f} bids/s")
+    print(phases.to_string(index=False, float_format='{:.2f}'.format))
+    print(statements.to_string(index=False, float_format='{:.1f}'.format))
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({**result, 'phases': phases.to_dict('records'), 'statements': statements.to_dict('records')}, json_file, indent=2)
+    if args.slowest:
+        print(METRICS.slowest(limit=args.slowest).to_string(index=False, float_format='{:.3f}'.format))
+    if args.metrics_json:
+        METRICS.dump_json(args.metrics_json)
+    if args.metrics_prometheus:
+        with open(args.metrics_prometheus, 'w') as metrics_file:
+            metrics_file.write(METRICS.to_prometheus())
+    return 0
+
+
+def bench_command(args: argparse.Namespace) -> int:
+    baseline = load_baseline(args.compare) if args.compare else None
+    results = run_benchmarks(repeat=args.repeat, quick=args.quick, baseline=baseline)
+    print(results_frame(results).to_string(index=False, float_format='{:.3f}'.format))
+    if args.save:
+        save_baseline(args.save, results)
+        print(f'Baseline saved to {args.save}')
+    regressions = find_regressions(results, args.threshold)
+    for result in regressions:
+        print(f'REGRESSION {result.key}: {result.seconds * 1000:.3f} ms vs {result.baseline * 1000:.3f} ms baseline')
+    return 1 if regressions else 0
+
+
+def sweep_command(args: argparse.Namespace) -> int:
+    params = SweepParams(
+        capacity=args.capacity,
+        min_capacity=args.min_capacity,
+        jackpot_divisor=args.jackpot_divisor,
+        fund_speed=args.fund_speed,
+        cycle_minutes=args.cycle_minutes,
+        min_players=args.players[0],
+        max_players=args.players[1],
+        n_cycles=args.cycles,
+    )
+    try:
+        for aggregate in iter_sweep(params, args.scenarios, workers=args.workers, seed=args.seed, n_bins=args.bins):
+            print(f'\r{aggregate.scenarios}/{args.scenarios} scenarios', end='', file=sys.stderr, flush=True)
+    except ValueError as error:
+        print(f'sweep: {error}', file=sys.stderr)
+        return 2
+    print(file=sys.stderr)
+    profit_curve = aggregate.profit_curve()
+    capacity = aggregate.capacity_trajectory()
+    print(profit_curve.to_string(index=False, float_format='{:.4f}'.format))
+    print(capacity.to_string(index=False, float_format='{:.4g}'.format))
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({
+                'params': vars(params),
+                'profit_curve': profit_curve.to_dict('list'),
+                'capacity': capacity.to_dict('list'),
+            }, json_file, indent=2)
+    return 0
+
+
+def serve_command(args: argparse.Namespace) -> int:
+    server = make_server(args.db, host=args.host, port=args.port, version_ttl=args.version_ttl)
+    print(f'Serving game state of {args.db} on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+def replay_command(args: argparse.Namespace) -> int:
+    state, mismatches = replay_game(
+        args.db,
+        read_db_schema(args.db),
+        to_cycle=args.to,
+        checkpoint_every=args.checkpoint_every,
+        chunk_cycles=args.chunk_cycles,
+        tolerance=args.tolerance,
+        use_checkpoints=not args.fresh,
+    )
+    start = f'checkpoint {state.checkpoint}' if state.checkpoint is not None else 'the start of the game'
+    print(f'Replayed from {start} to cycle {state.cycle}')
+    if mismatches.empty:
+        print('Replay matches the stored results')
+        return 0
+    print(mismatches.to_string(index=False))
+    print(f'{len(mismatches)} replayed values differ from the stored results')
+    return 1
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='qd-game', description='Cyberpunk game maintenance tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    check_parser = subparsers.add_parser('check-balances', help='diff materialized balances against the transactions table')
+    check_parser.add_argument('--db', required=True, help='SQLAlchemy connection string')
+    check_parser.add_argument('--fix', action='store_true', help='rebuild balances from transactions')
+    check_parser.set_defaults(func=check_balances_command)
+
+    create_parser = subparsers.add_parser('create-schema', help='create missing tables of the declared schema')
+    create_parser.add_argument('--db', required=True, help='SQLAlchemy connection string')
+    create_parser.set_defaults(func=create_schema_command)
+
+    verify_parser = subparsers.add_parser('verify-schema', help='reflect the database and compare it with the declared schema')
+    verify_parser.add_argument('--db', required=True, help='SQLAlchemy connection string')
+    verify_parser.set_defaults(func=verify_schema_command)
+
+    migrate_parser = subparsers.add_parser('migrate', help='apply pending schema migrations and check hot path indexes')
+    migrate_parser.add_argument('--db', required=True, help='SQLAlchemy connection string')
+    migrate_parser.add_argument('--target', type=int, default=None, help='stop at this schema version')
+    migrate_parser.set_defaults(func=migrate_command)
+
+    explain_parser = subparsers.add_parser('explain-check', help='fail if a hot db.py query needs a full table scan')
+    explain_parser.add_argument('--db', required=True, help='SQLAlchemy connection string')
+    explain_parser.add_argument('--seed', action='store_true', help='WIPE the game tables and seed a large synthetic game first')
+    explain_parser.add_argument('--users', type=int, default=200)
+    explain_parser.add_argument('--markets', type=int, default=50)
+    explain_parser.add_argument('--cycles', type=int, default=50)
+    explain_parser.set_defaults(func=explain_check_command)
+
+    simulate_parser = subparsers.add_parser('simulate', help='play a headless game through the real db code paths')
+    simulate_parser.add_argument('--db', default='sqlite://', help='SQLAlchemy connection string, game tables are WIPED')
+    simulate_parser.add_argument('--users', type=int, default=10)
+    simulate_parser.add_argument('--markets', type=int, default=9)
+    simulate_parser.add_argument('--cycles', type=int, default=10)
+    simulate_parser.add_argument('--strategy', choices=sorted(STRATEGIES), default='random')
+    simulate_parser.add_argument('--approve-rate', type=float, default=0.9)
+    simulate_parser.add_argument('--seed', type=int, default=None)
+    simulate_parser.add_argument('--json', default=None, help='write the report to this file')
+    simulate_parser.add_argument('--statement-budget', action='append', default=[], metavar='SCOPE=N',
+                                 help='SQL statements allowed per scope, e.g. finish_cycle_callback=60')
+    simulate_parser.add_argument('--statement-budget-mode', choices=BUDGET_MODES, default='raise',
+                                 help='fail the run or only log scopes over budget')
+    simulate_parser.add_argument('--slowest', type=int, default=15, help='print this many slowest db.py / engine.py operations')
+    simulate_parser.add_argument('--metrics-json', default=None, help='dump the operation metrics as JSON')
+    simulate_parser.add_argument('--metrics-prometheus', default=None, help='write the operation metrics in Prometheus text format')
+    simulate_parser.set_defaults(func=simulate_command)
+
+    bench_parser = subparsers.add_parser('bench', help='time the engine functions over growing input sizes')
+    bench_parser.add_argument('--save', default=None, help='write results as a JSON baseline')
+    bench_parser.add_argument('--compare', default=None, help='JSON baseline to compare against')
+    bench_parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown, 0.25 means +25%%')
+    bench_parser.add_argument('--repeat', type=int, default=5)
+    bench_parser.add_argument('--quick', action='store_true', help='only the smallest sizes')
+    bench_parser.set_defaults(func=bench_command)
+
+    sweep_parser = subparsers.add_parser('sweep', help='Monte Carlo sweep of the market payout formula')
+    sweep_parser.add_argument('--scenarios', type=int, default=1000000, help='market cycles to simulate')
+    sweep_parser.add_argument('--cycles', type=int, default=SweepParams.n_cycles, help='cycles per capacity trajectory')
+    sweep_parser.add_argument('--players', type=int, nargs=2, default=[SweepParams.min_players, SweepParams.max_players])
+    sweep_parser.add_argument('--capacity', type=float, default=SweepParams.capacity, help='start capacity')
+    sweep_parser.add_argument('--min-capacity', type=float, default=SweepParams.min_capacity)
+    sweep_parser.add_argument('--jackpot-divisor', type=float, default=SweepParams.jackpot_divisor)
+    sweep_parser.add_argument('--fund-speed', type=float, default=SweepParams.fund_speed, help='funded amount per minute')
+    sweep_parser.add_argument('--cycle-minutes', type=float, default=SweepParams.cycle_minutes)
+    sweep_parser.add_argument('--workers', type=int, default=None, help='process pool size, 1 runs in-process')
+    sweep_parser.add_argument('--bins', type=int, default=20, help='max share bins of the profit curve')
+    sweep_parser.add_argument('--seed', type=int, default=None)
+    sweep_parser.add_argument('--json', default=None, help='write the aggregates as JSON')
+    sweep_parser.set_defaults(func=sweep_command)
+
+    serve_parser = subparsers.add_parser('serve', help='read-only HTTP/JSON service of the game state')
+    serve_parser.add_argument('--db', required=True, help='SQLAlchemy connection string')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8502)
+    serve_parser.add_argument('--version-ttl', type=float, default=1.0, help='seconds a version probe is reused')
+    serve_parser.set_defaults(func=serve_command)
+
+    replay_parser = subparsers.add_parser('replay', help='rebuild the game state from the logs and verify the stored results')
+    replay_parser.add_argument('--db', required=True, help='SQLAlchemy connection string')
+    replay_parser.add_argument('--to', type=int, default=None, help='last cycle to replay, the last settled one by default')
+    replay_parser.add_argument('--checkpoint-every', type=int, default=CHECKPOINT_EVERY, help='save the replayed state every N cycles, 0 disables')
+    replay_parser.add_argument('--chunk-cycles', type=int, default=CHUNK_CYCLES, help='cycles read per round of queries')
+    replay_parser.add_argument('--tolerance', type=float, default=0.01)
+    replay_parser.add_argument('--fresh', action='store_true', help='ignore saved checkpoints and replay from the start')
+    replay_parser.set_defaults(func=replay_command)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = make_parser().parse_args(argv)
+    return args.func(args)
+
+
+def run():
+    sys.exit(main())
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,40 @@
+import altair as alt
+import streamlit as st
+from qd_cyberpank_game.structures import ThemeColors
+
+
+def balance_history_block():
+    history_df = st.session_state.balance_history
+    with st.beta_expander('История по циклам'):
+        if history_df.empty:
+            st.markdown('<p style="text-align: center;"> Ещё ни один цикл не закрыт </p>', unsafe_allow_html=True)
+            return
+        history_df = history_df.copy()
+        history_df['balance'] /= 1000000
+        history_df['net'] /= 1000000
+        balance = alt.Chart(history_df).mark_line(point=True).encode(
+            x=alt.X('cycle:O', axis=alt.Axis(title='Цикл')),
+            y=alt.Y('balance:Q', axis=alt.Axis(title='Баланс, млн. $')),
+        )
+        net = alt.Chart(history_df).mark_bar().encode(
+            x=alt.X('cycle:O', axis=alt.Axis(title='Цикл')),
+            y=alt.Y('net:Q', axis=alt.Axis(title='Результат цикла, млн. $')),
+            color=alt.condition(alt.datum.net > 0, alt.value(ThemeColors.GREEN.value), alt.value(ThemeColors.RED.value)),
+        )
+        st.altair_chart(alt.hconcat(balance.properties(width=450, height=300), net.properties(width=450, height=300)))
+
+
+def market_history_block():
+    history_df = st.session_state.market_history
+    with st.beta_expander('История рынков'):
+        if history_df.empty:
+            st.markdown('<p style="text-align: center;"> Ещё ни один цикл не закрыт </p>', unsafe_allow_html=True)
+            return
+        history_df = history_df.copy()
+        history_df['capacity'] /= 1000000
+        st.altair_chart(alt.Chart(history_df).mark_line(point=True).encode(
+            x=alt.X('cycle:O', axis=alt.Axis(title='Цикл')),
+            y=alt.Y('capacity:Q', axis=alt.Axis(title='Ёмкость, млн. $')),
+            color='market:N',
+            tooltip=['market', 'cycle', 'capacity', 'invested', 'income', 'bids'],
+        ).properties(width=900, height=400))
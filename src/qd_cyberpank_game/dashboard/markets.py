@@ -1,16 +1,18 @@
 import math
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, Optional
 
 import altair as alt
-import numpy as np
 import pandas as pd
 import pyecharts.options as opts
 import streamlit as st
 from pyecharts.charts import Graph
 from pyecharts.commons.utils import JsCode
+from qd_cyberpank_game.cache import SHARED_CACHE
+from qd_cyberpank_game.dashboard.update_state import counted_callback, session_cached
 from qd_cyberpank_game.db import make_investment
-from qd_cyberpank_game.structures import InvestmentBid, ThemeColors
+from qd_cyberpank_game.graph import MarketGraph, get_green_markets
+from qd_cyberpank_game.structures import InvestmentBid, ThemeColors, User
 from streamlit_echarts import st_pyecharts
 
 TOOLTIP_JS_CODE = ''.join([
@@ -40,55 +42,61 @@ def get_node_color(investment: float, income: float) -> str:
         return ThemeColors.BLUE.value
 
 
-def make_markets_graph(markets_df: pd.DataFrame, investments_df: pd.DataFrame, home_market: Optional[str]) -> Graph:
-    approved_investments = investments_df[investments_df['status'] == 1]
+def make_markets_payload(
+    markets_df: pd.DataFrame,
+    market_graph: MarketGraph,
+    investments_df: pd.DataFrame,
+    home_market: Optional[str],
+) -> Dict[str, Any]:
+    # first approved bid of every market, looked up by name instead of filtering the frame per node
+    approved_investments = investments_df[investments_df['status'] == 1].drop_duplicates('market')
+    node_investments = approved_investments.set_index('market')[['amount', 'income']].to_dict('index')
     # absolute minimum capacity
     min_capacity = markets_df['min_capacity'].min()
-    graph = Graph()
-    graph_nodes = [{
-        'name': market['name'],
-        'symbolSize': get_node_size_px(market['capacity'], min_capacity),
-    } for market in markets_df.to_dict('records')]
-    graph_links = [{
-        'source': link['name'],
-        'target': link['value'],
-    } for link in markets_df.melt(id_vars='name', value_vars=['link1', 'link2']).dropna().to_dict('records')]
-    for node in graph_nodes:
-        node_investment = approved_investments[approved_investments['market'] == node['name']]
-        if not node_investment.empty:
-            node_investment = node_investment.to_dict('records')[0]
+    node_map: Dict[str, Dict[str, Any]] = {}
+    for market in markets_df.to_dict('records'):
+        node = {
+            'name': market['name'],
+            'symbolSize': get_node_size_px(market['capacity'], min_capacity),
+        }
+        node_investment = node_investments.get(market['name'])
+        if node_investment is not None:
             node['amount'] = node_investment['amount']
             node['amount_str'] = f"${(node['amount'] / 1000000):.2f} млн."
             node['income'] = node_investment['income']
             node['income_str'] = f"${(node['income'] / 1000000):.2f} млн. ({node['income'] / node['amount']:.2%})"
-            node['multiplier'] = 1
         else:
             node['amount'] = 0
             node['amount_str'] = f"{0:.2f} млн."
             node['income'] = 0
             node['income_str'] = f"${0:.2f} млн. ({0:.2%})"
-            node['multiplier'] = 1
+        node['multiplier'] = 1
         node['symbol'] = 'roundRect' if node['name'] == home_market else 'circle'
         node['itemStyle'] = {'color': get_node_color(node['amount'], node['income'])}
-    
-    unlocked_markets = [home_market]
-
-    for link in graph_links:
-        for node in graph_nodes:
-            if node['name'] == link['source']:
-                source_color = node['itemStyle']['color']
-            if node['name'] == link['target']:
-                target_color = node['itemStyle']['color']
-
-        if source_color == ThemeColors.GREEN.value or target_color == ThemeColors.GREEN.value:
-            link_color = ThemeColors.GREEN.value
-            unlocked_markets.append(link['source'])
-            unlocked_markets.append(link['target'])
-        else:
-            link_color = ThemeColors.GRAY.value
-        link['lineStyle'] = {'color': link_color}
+        node_map[node['name']] = node
+
+    green_markets = set(get_green_markets(investments_df))
+    graph_links = []
+    for source, target in market_graph.links():
+        link_color = ThemeColors.GREEN.value if source in green_markets or target in green_markets else ThemeColors.GRAY.value
+        graph_links.append({'source': source, 'target': target, 'lineStyle': {'color': link_color}})
+    unlocked_markets = market_graph.unlocked_markets(green_markets, home_market)
+    return {'nodes': list(node_map.values()), 'links': graph_links, 'unlocked_markets': unlocked_markets}
+
+
+def get_markets_payload(markets_df: pd.DataFrame, investments_df: pd.DataFrame, user: User) -> Dict[str, Any]:
+    # the graph only changes with the cycle or writes of this process (which move the cache generation),
+    # so reruns caused by the investment form reuse it
+    game_version = st.session_state.game_version
+    return session_cached(
+        'markets_payload',
+        (user.uid, game_version.cycle, game_version.cycle_timestamp, user.home_market, SHARED_CACHE.generation(st.session_state.db_conn_str)),
+        lambda: make_markets_payload(markets_df, st.session_state.market_graph, investments_df, user.home_market),
+    )
 
-    st.session_state.unlocked_markets = np.unique(unlocked_markets).tolist()
+
+def make_markets_graph(payload: Dict[str, Any]) -> Graph:
+    graph = Graph()
     graph.add(
         'Markets',
         repulsion=1800,
@@ -100,8 +108,8 @@ def make_markets_graph(markets_df: pd.DataFrame, investments_df: pd.DataFrame, h
             formatter=JsCode(TOOLTIP_JS_CODE),
             border_width=1,
         ),
-        nodes=graph_nodes,
-        links=graph_links,
+        nodes=payload['nodes'],
+        links=payload['links'],
         linestyle_opts=opts.LineStyleOpts(width=2, opacity=0.9, curve=0.2),
     )
     return graph
@@ -110,7 +118,9 @@ def make_markets_graph(markets_df: pd.DataFrame, investments_df: pd.DataFrame, h
 def markets_status():
     markets_df = st.session_state.markets
     prev_investments_df = st.session_state.prev_investments
-    graph = make_markets_graph(markets_df=markets_df, investments_df=prev_investments_df, home_market=st.session_state.user.home_market)
+    payload = get_markets_payload(markets_df=markets_df, investments_df=prev_investments_df, user=st.session_state.user)
+    st.session_state.unlocked_markets = payload['unlocked_markets']
+    graph = make_markets_graph(payload)
     col1, col2 = st.beta_columns([1, 1])
     with col1:
         st.markdown('<p style="text-align: center;"> Состояние графа рынков в прошлом периоде </p>', unsafe_allow_html=True)
@@ -180,6 +190,7 @@ def markets_investment_form():
     st.dataframe(investments_df.drop(['uid', 'id'], axis=1))
 
 
+@counted_callback
 def markets_investment_callback():
     investment_bids: list[InvestmentBid] = []
     bids_balance = 0
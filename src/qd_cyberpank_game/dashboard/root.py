@@ -1,14 +1,22 @@
 import pandas as pd
 import streamlit as st
-from qd_cyberpank_game.dashboard.update_state import update_game_state
+from qd_cyberpank_game.cache import SHARED_CACHE
+from qd_cyberpank_game.dashboard.history import market_history_block
+from qd_cyberpank_game.dashboard.update_state import counted_callback, update_game_state
 from qd_cyberpank_game.db import finish_cycle, make_auto_green_investment, make_next_cycle, reinit_game, make_transaction
 from qd_cyberpank_game.db import update_investment_status, update_investment_multiplier
+from qd_cyberpank_game.metrics import METRICS
 from qd_cyberpank_game.structures import Transaction
 from qd_cyberpank_game.dashboard.stocks import stocks_block
 
+# typed by root before a reinit, which wipes the whole game
+REINIT_CONFIRMATION = 'УДАЛИТЬ ИГРУ'
 
+
+@counted_callback
 def finish_cycle_callback():
-    update_game_state(uid=st.session_state.user.uid)
+    # settlement reads bids from the session, so both loads skip the version probe gate
+    update_game_state(uid=st.session_state.user.uid, force=True)
     make_auto_green_investment(
         db_conn_str=st.session_state.db_conn_str,
         investments_df=st.session_state.investments,
@@ -16,8 +24,8 @@ def finish_cycle_callback():
         cycle=st.session_state.cycle,
         investments_table=st.session_state.db_schema['investments'],
     )
-    update_game_state(uid=st.session_state.user.uid)
-    finish_cycle(
+    update_game_state(uid=st.session_state.user.uid, force=True)
+    st.session_state.settlement_report = finish_cycle(
         db_conn_str=st.session_state.db_conn_str,
         investments_df=st.session_state.investments,
         markets_df=st.session_state.markets,
@@ -27,22 +35,44 @@ def finish_cycle_callback():
         cycle=st.session_state.cycle,
         investments_table=st.session_state.db_schema['investments'],
         markets_table=st.session_state.db_schema['markets'],
+        market_links_table=st.session_state.db_schema['market_links'],
         transactions_table=st.session_state.db_schema['transactions'],
         stocks_table=st.session_state.db_schema['stocks'],
+        balances_table=st.session_state.db_schema['balances'],
+        cycle_balances_table=st.session_state.db_schema['cycle_balances'],
+        balance_snapshots_table=st.session_state.db_schema['balance_snapshots'],
+        market_snapshots_table=st.session_state.db_schema['market_snapshots'],
+        price_snapshots_table=st.session_state.db_schema['price_snapshots'],
+        unlock_snapshots_table=st.session_state.db_schema['unlock_snapshots'],
     )
     make_next_cycle(st.session_state.db_conn_str, st.session_state.cycle, st.session_state.fund_speed_change, st.session_state.db_schema['cycles'])
 
 
+@counted_callback
 def reinit_callback():
+    # the button is only shown after the confirmation, checked again in case the phrase was edited since
+    if st.session_state.reinit_confirmation != REINIT_CONFIRMATION:
+        return
+    st.session_state.reinit_confirmation = ''
     reinit_game(
         db_conn_str=st.session_state.db_conn_str,
         users_df=st.session_state.users,
         markets_table=st.session_state.db_schema['markets'],
         stocks_table=st.session_state.db_schema['stocks'],
         transactions_table=st.session_state.db_schema['transactions'],
+        balances_table=st.session_state.db_schema['balances'],
+        cycle_balances_table=st.session_state.db_schema['cycle_balances'],
+        investments_table=st.session_state.db_schema['investments'],
+        cycles_table=st.session_state.db_schema['cycles'],
+        balance_snapshots_table=st.session_state.db_schema['balance_snapshots'],
+        market_snapshots_table=st.session_state.db_schema['market_snapshots'],
+        price_snapshots_table=st.session_state.db_schema['price_snapshots'],
+        unlock_snapshots_table=st.session_state.db_schema['unlock_snapshots'],
+        replay_checkpoints_table=st.session_state.db_schema['replay_checkpoints'],
     )
 
 
+@counted_callback
 def manual_transaction_callback():
     transaction = Transaction(
         from_=st.session_state.manual_transaction_from,
@@ -50,9 +80,16 @@ def manual_transaction_callback():
         amount=st.session_state.manual_transaction_amount,
         cycle=st.session_state.cycle,
     )
-    make_transaction(st.session_state.db_conn_str, st.session_state.db_schema['transactions'], transaction)
+    make_transaction(
+        st.session_state.db_conn_str,
+        st.session_state.db_schema['transactions'],
+        transaction,
+        st.session_state.db_schema['balances'],
+        st.session_state.db_schema['cycle_balances'],
+    )
 
 
+@counted_callback
 def manual_multiplier_callback():
     uid = st.session_state.manual_multiplier_uid
     market = st.session_state.manual_multiplier_market
@@ -68,6 +105,7 @@ def manual_multiplier_callback():
         )
 
 
+@counted_callback
 def bid_check_callback():
     bid_id = st.session_state.bid_id
     status = 1 if st.session_state.bid_decision == 'Accept' else 0
@@ -80,15 +118,34 @@ def root_dashboard():
         st.button('Закончить цикл', on_click=finish_cycle_callback)
         reinit_game = st.checkbox('Разрешить реинициализацию')
         if reinit_game:
-            st.button('Реинициализация', on_click=reinit_callback)
+            st.warning('Реинициализация безвозвратно удаляет заявки, транзакции, балансы, котировки, циклы и историю игры, остаются только игроки и рынки')
+            confirmation = st.text_input(f'Для подтверждения введите «{REINIT_CONFIRMATION}»', key='reinit_confirmation')
+            if confirmation == REINIT_CONFIRMATION:
+                st.button('Реинициализация', on_click=reinit_callback)
 
     st.title('Административная панель')
     st.markdown(f'## Цикл: {st.session_state.cycle}')
     st.markdown(f'### Скорость инвестирования капитала: ${st.session_state.fund_speed / 1000000:.2f} млн. / мин')
+    settlement_report = getattr(st.session_state, 'settlement_report', None)
+    if settlement_report:
+        with st.beta_expander(label='Отчёт о закрытии прошлого цикла'):
+            st.dataframe(pd.DataFrame(settlement_report))
+    with st.beta_expander(label='Загрузка данных'):
+        st.write('Общий кэш:', SHARED_CACHE.stats())
+        load_timings = getattr(st.session_state, 'load_timings', {})
+        st.write('Время загрузки, с:', pd.Series(load_timings, name='seconds', dtype=float).sort_values(ascending=False))
+        for scope in getattr(st.session_state, 'statement_scopes', {}).values():
+            st.write('SQL-запросы:', scope.summary())
+            st.dataframe(scope.report())
+    with st.beta_expander(label='Самые медленные операции'):
+        # finish_cycle runs while the game is still at the closed cycle, so its phases are counted there
+        metrics_cycle = st.number_input('Цикл', value=max(st.session_state.cycle - 1, 0), step=1)
+        st.dataframe(METRICS.slowest(cycle=int(metrics_cycle)))
     investments_df = st.session_state.investments
     users = st.session_state.users
     uid2name = {record['uid']: record['name'] for record in users[['uid', 'name']].to_dict('records')}
     stocks_block()
+    market_history_block()
     with st.beta_expander(label='Одобрение заявок в SEC', expanded=True):
         pending_bids = investments_df[investments_df['status'] == -1].copy()
         pending_bids['corporation'] = pending_bids['uid'].map(uid2name)
@@ -1,22 +1,51 @@
+from typing import Any, Dict, Optional, Tuple
+
 import altair as alt
+import pandas as pd
 import streamlit as st
+from qd_cyberpank_game.cache import SHARED_CACHE
+from qd_cyberpank_game.charts import STOCK_WINDOW_CYCLES, downsample_stocks, stocks_pivot, stocks_window
+
+
+def make_stocks_chart(stocks_df: pd.DataFrame, domain: Tuple[float, float]) -> Dict[str, Any]:
+    nearest = alt.selection(type='single', nearest=True, on='mouseover', fields=['cycle'], empty='none')
+    x = alt.X('cycle:Q', scale=alt.Scale(domain=domain))
+    line = alt.Chart(stocks_df).mark_line(point=True).encode(x=x, y='price:Q', color='ticket:N', strokeDash='ticket')
+    selectors = alt.Chart(stocks_df).mark_point().encode(x='cycle:Q', opacity=alt.value(0)).add_selection(nearest)
+    points = line.mark_point().encode(opacity=alt.condition(nearest, alt.value(1), alt.value(0)))
+    text = line.mark_text(align='left', dx=5, dy=-5).encode(text=alt.condition(nearest, 'price:Q', alt.value(' ')))
+    rules = alt.Chart(stocks_df).mark_rule(color='gray').encode(x='cycle:Q').transform_filter(nearest)
+    layer = alt.layer(line, selectors, points, rules, text).properties(width=500, height=450).interactive()
+    # the layers share one frame, so the spec carries the (already downsampled) data once, in its datasets
+    with alt.data_transformers.enable('default', max_rows=None):
+        return layer.to_dict()
+
+
+def get_stocks_view(window_cycles: Optional[int]) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    # the pivot table and the chart spec are built once per stocks version and window, for all viewers;
+    # both are shared and must not be mutated
+    game_version = st.session_state.game_version
+
+    def load_view() -> Tuple[pd.DataFrame, Dict[str, Any]]:
+        window_df, domain = stocks_window(st.session_state.stocks, game_version.cycle, window_cycles)
+        return stocks_pivot(window_df), make_stocks_chart(downsample_stocks(window_df), domain)
+    return SHARED_CACHE.get_or_load(
+        st.session_state.db_conn_str,
+        f'stocks_view:{window_cycles}',
+        (game_version.game_started_at, game_version.cycle, game_version.max_stock_id),
+        load_view,
+    )
 
 
 def stocks_block():
-    stocks_df = st.session_state.stocks
     with st.beta_expander('Биржевые котировки', expanded=True):
+        full_history = st.checkbox(f'Вся история (по умолчанию последние {STOCK_WINDOW_CYCLES} циклов)', key='stocks_full_history')
+        pivot_df, chart_spec = get_stocks_view(None if full_history else STOCK_WINDOW_CYCLES)
         col1, col2 = st.beta_columns([2, 3])
         with col1:
             st.markdown('<p style="text-align: center;"> Выгрузка с биржи </p>', unsafe_allow_html=True)
-            st.dataframe(stocks_df.pivot(index='cycle', columns='ticket', values='price'))
+            st.dataframe(pivot_df)
         with col2:
             st.markdown('<p style="text-align: center;"> График котировок акций </p>', unsafe_allow_html=True)
-            nearest = alt.selection(type='single', nearest=True, on='mouseover', fields=['cycle'], empty='none')
-            x = alt.X('cycle:Q', scale=alt.Scale(domain=(0, st.session_state.cycle)))
-            line = alt.Chart(stocks_df).mark_line(point=True).encode(x=x, y='price:Q', color='ticket:N', strokeDash='ticket')
-            selectors = alt.Chart(stocks_df).mark_point().encode(x='cycle:Q', opacity=alt.value(0)).add_selection(nearest)
-            points = line.mark_point().encode(opacity=alt.condition(nearest, alt.value(1), alt.value(0)))
-            text = line.mark_text(align='left', dx=5, dy=-5).encode(text=alt.condition(nearest, 'price:Q', alt.value(' ')))
-            rules = alt.Chart(stocks_df).mark_rule(color='gray').encode(x='cycle:Q').transform_filter(nearest)
-            layer = alt.layer(line, selectors, points, rules, text).properties(width=500, height=450).interactive()
-            st.altair_chart(layer)
+            # streamlit pops the datasets out of the spec it is given, the cached one is shared
+            st.vega_lite_chart(spec=dict(chart_spec))
@@ -1,30 +1,173 @@
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import pandas as pd
 import streamlit as st
 import qd_cyberpank_game.db as db
+from qd_cyberpank_game.budget import StatementScope, statement_scope
+from qd_cyberpank_game.cache import SHARED_CACHE
+from qd_cyberpank_game.metrics import METRICS
+
+# shared by all sessions, bounds the number of connections a refresh wave can take from the pool
+LOAD_WORKERS = 8
+_load_executor = ThreadPoolExecutor(max_workers=LOAD_WORKERS, thread_name_prefix='game-state')
+# seconds, a session reloads at least this often; catches in-place edits the probe cannot see (e.g. multipliers)
+MAX_STATE_AGE = 60.0
+
+
+def sync_frame(
+    frame: Optional[pd.DataFrame],
+    load_full: Callable[[], pd.DataFrame],
+    load_delta: Callable[[int], pd.DataFrame],
+) -> pd.DataFrame:
+    # append rows newer than the last loaded id; frames of another game are dropped by their scope (scoped_frame)
+    if frame is None or frame.empty:
+        return load_full()
+    delta = load_delta(int(frame['id'].max()))
+    if delta.empty:
+        return frame
+    return pd.concat([frame, delta], ignore_index=True)
+
+
+def scoped_frame(state_key: str, scope: Hashable) -> Optional[pd.DataFrame]:
+    # previously loaded frame, if it was loaded for the same scope (e.g. the same user)
+    frame = getattr(st.session_state, state_key, None)
+    same_scope = getattr(st.session_state, f'{state_key}_scope', None) == scope
+    st.session_state[f'{state_key}_scope'] = scope
+    return frame if same_scope else None
+
+
+def session_cached(state_key: str, version: Hashable, loader: Callable[[], Any]) -> Any:
+    # per-user counterpart of SHARED_CACHE.get_or_load: one entry per session, so players never evict each other
+    # or the shared datasets from the process-wide LRU
+    if getattr(st.session_state, f'{state_key}_version', None) == version:
+        return st.session_state[state_key]
+    value = loader()
+    st.session_state[state_key] = value
+    st.session_state[f'{state_key}_version'] = version
+    return value
+
+
+def timed_call(loader: Callable[[], Any]) -> Tuple[Any, float]:
+    start = time.perf_counter()
+    value = loader()
+    return value, time.perf_counter() - start
 
 
-def update_game_state(uid: str) -> None:
+def mark_state_dirty() -> None:
+    # the next update_game_state of this session reloads everything whatever the probe says
+    st.session_state.state_dirty = True
+
+
+def state_is_current(loaded_state: Tuple[Any, ...]) -> bool:
+    return (
+        not getattr(st.session_state, 'state_dirty', True)
+        and getattr(st.session_state, 'loaded_state', None) == loaded_state
+        and time.monotonic() - getattr(st.session_state, 'loaded_at', 0.0) < MAX_STATE_AGE
+    )
+
+
+def update_game_state(uid: str, force: bool = False) -> None:
     db_conn_str = st.session_state.db_conn_str
     db_schema = st.session_state.db_schema
+    # everything else depends on the cycle number, so the version probe goes first; it is the only query of a rerun
+    # when neither the database nor this process has written anything since the last load
+    game_version, probe_time = timed_call(lambda: db.get_game_version(
+        db_conn_str,
+        db_schema['cycles'],
+        db_schema['transactions'],
+        db_schema['stocks'],
+        db_schema['investments'],
+    ))
+    st.session_state.game_version = game_version
+    st.session_state.cycle, st.session_state.fund_speed = game_version.cycle, game_version.fund_speed
+    cycle = game_version.cycle
+    METRICS.set_cycle(cycle)
+    loaded_state = (uid, game_version, SHARED_CACHE.generation(db_conn_str))
+    if not force and state_is_current(loaded_state):
+        return
+
+    # the progress bar advances by how long every loader took on the previous load
+    prev_load_timings = getattr(st.session_state, 'load_timings', {})
+    load_timings: Dict[str, float] = {'game_version': probe_time}
     placeholder = st.empty()
     with placeholder.beta_container():
         st.write('Загрузка актуальных данных...')
         progressbar = st.progress(0)
-        st.session_state.cycle, st.session_state.fund_speed = db.get_current_cycle(db_conn_str, db_schema['cycles'])
-        progressbar.progress(10)
-        st.session_state.users = db.get_users(db_conn_str, db_schema['users'])
-        progressbar.progress(20)
-        st.session_state.markets = db.get_markets(db_conn_str, db_schema['markets'])
-        progressbar.progress(30)
-        st.session_state.transactions = db.get_transactions(db_conn_str, uid, db_schema['transactions'])
-        progressbar.progress(40)
-        st.session_state.prev_investments = db.get_cycle_investments(db_conn_str, uid, st.session_state.cycle - 1, db_schema['investments'])
-        progressbar.progress(50)
-        st.session_state.investments = db.get_cycle_investments(db_conn_str, uid, st.session_state.cycle, db_schema['investments'])
-        progressbar.progress(60)
-        st.session_state.stocks = db.get_stocks(db_conn_str, db_schema['stocks'])
-        progressbar.progress(100)
+
+        # global datasets are shared between sessions, every session gets its own copy
+        cycle_version = (game_version.cycle, game_version.cycle_timestamp)
+        stocks = scoped_frame('stocks', game_version.game_started_at)
+        loaders: Dict[str, Callable[[], Any]] = {
+            'users': lambda: SHARED_CACHE.get_or_load(
+                db_conn_str, 'users', cycle_version, lambda: db.get_users(db_conn_str, db_schema['users']),
+            ).copy(),
+            'markets': lambda: SHARED_CACHE.get_or_load(
+                db_conn_str, 'markets', cycle_version, lambda: db.get_markets(db_conn_str, db_schema['markets']),
+            ).copy(),
+            # links only change with a new game, reinit_game invalidates the namespace
+            'market_graph': lambda: SHARED_CACHE.get_or_load(
+                db_conn_str, 'market_graph', None, lambda: db.get_market_graph(db_conn_str, db_schema['markets'], db_schema['market_links']),
+            ),
+            'market_history': lambda: SHARED_CACHE.get_or_load(
+                db_conn_str, 'market_history', cycle_version, lambda: db.get_market_history(db_conn_str, db_schema['market_snapshots']),
+            ),
+            'ledger_balance': lambda: db.get_balance(db_conn_str, uid, cycle, db_schema['balances'], db_schema['cycle_balances']),
+            'prev_investments': lambda: db.get_cycle_investments(db_conn_str, uid, cycle - 1, db_schema['investments']),
+            'investments': lambda: db.get_cycle_investments(db_conn_str, uid, cycle, db_schema['investments']),
+            'stocks': lambda: SHARED_CACHE.get_or_load(
+                db_conn_str,
+                'stocks',
+                (game_version.game_started_at, game_version.max_stock_id),
+                lambda: sync_frame(
+                    stocks,
+                    lambda: db.get_stocks(db_conn_str, db_schema['stocks']),
+                    lambda last_id: db.get_stocks_delta(db_conn_str, db_schema['stocks'], last_id),
+                ),
+            ).copy(),
+        }
+        # snapshots only change when a cycle is settled; the history is per player, so like session_cached it stays
+        # in the session instead of the shared LRU (the loaders run outside the script thread)
+        balance_history_version = (uid, cycle_version)
+        if getattr(st.session_state, 'balance_history_version', None) != balance_history_version:
+            loaders['balance_history'] = lambda: db.get_balance_history(db_conn_str, uid, db_schema['balance_snapshots'])
+        # loaders run in the context of the rerun, so their statements count into its scope
+        futures = {_load_executor.submit(copy_context().run, timed_call, loader): state_key for state_key, loader in loaders.items()}
+        weights = {state_key: prev_load_timings.get(state_key, 1.0) for state_key in ['game_version', *loaders]}
+        total_weight, done_weight = sum(weights.values()), weights['game_version']
+        progressbar.progress(int(100 * done_weight / total_weight))
+        for future in as_completed(futures):
+            state_key = futures[future]
+            st.session_state[state_key], load_timings[state_key] = future.result()
+            done_weight += weights[state_key]
+            progressbar.progress(min(int(100 * done_weight / total_weight), 100))
+    st.session_state.balance_history_version = balance_history_version
+    st.session_state.load_timings = load_timings
+    st.session_state.loaded_state = loaded_state
+    st.session_state.loaded_at = time.monotonic()
+    st.session_state.state_dirty = False
     placeholder.empty()
 
 
+def save_statement_scope(scope: StatementScope) -> None:
+    # the last finished scope of every name, shown on the root dashboard
+    st.session_state.statement_scopes = {**getattr(st.session_state, 'statement_scopes', {}), scope.name: scope}
+
+
+def counted_callback(callback: Callable[[], None]) -> Callable[[], None]:
+    # statements of a widget callback are counted against the budget named after it;
+    # callbacks write to the database, so the rerun after them reloads the game state
+    @functools.wraps(callback)
+    def counted() -> None:
+        with statement_scope(callback.__name__) as scope:
+            callback()
+        save_statement_scope(scope)
+        mark_state_dirty()
+    return counted
+
+
 def update_state_callback():
-    update_game_state(uid=st.session_state.user.uid)
+    update_game_state(uid=st.session_state.user.uid, force=True)
@@ -1,16 +1,32 @@
 import hashlib
+import threading
+import time
 from datetime import datetime, timedelta
-from typing import Dict, Optional, Tuple, Union
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple, Union
 
+import numpy as np
 import pandas as pd
-from sqlalchemy import MetaData, Table, create_engine, insert, or_, select, update
-
-from qd_cyberpank_game.engine import calculate_investments, generate_stocks
-from qd_cyberpank_game.structures import InvestmentBid, Transaction, User
+from sqlalchemy import (Column, Integer, MetaData, Table, and_, bindparam, create_engine, delete, func, insert, literal, or_, select,
+                        update)
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine, Row, make_url
+from sqlalchemy.sql import Insert, Select
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from qd_cyberpank_game.budget import track_statements
+from qd_cyberpank_game.cache import SHARED_CACHE
+from qd_cyberpank_game.engine import calculate_investments, cycle_rng, generate_stocks, get_last_prices
+from qd_cyberpank_game.graph import MarketGraph
+from qd_cyberpank_game.metrics import instrument_module
+from qd_cyberpank_game.schema import get_db_schema, verify_db_schema
+from qd_cyberpank_game.structures import GameVersion, InvestmentBid, SettlementPhase, Transaction, User
 
 DEFAULT_FUND_SPEED = 50000000.0  # 50kk / minute
 INIT_STOCK = 100.0
 START_BALANCE = 500000000.0
+# start capacity of markets missing from START_CAPATICY
+DEFAULT_CAPACITY = 250000000.0
+TRANSACTION_COLUMNS = ['from_', 'to_', 'amount', 'cycle']
 START_CAPATICY = {
     'IT': 250000000.0,
     'Медицина': 250000000.0,
@@ -29,116 +45,397 @@ START_BONUSES = {
     'ed30b6622f68b817098c577c1cd4b3da0f955be10962bdd016541a2cf79bdebf': 360000000,  # LOOP
 }
 
+# pool settings shared by every engine in the registry, see configure_engines
+ENGINE_OPTIONS: Dict[str, Any] = {
+    'pool_size': 10,
+    'max_overflow': 20,
+    'pool_timeout': 30,
+    'pool_recycle': 3600,
+    'pool_pre_ping': True,
+}
 
-def read_db_schema(db_conn_str: str) -> Dict[str, Union[MetaData, Table]]:
-    engine = create_engine(db_conn_str, future=True)
-    metadata = MetaData()
-    return {
-        'metadata': metadata,
-        'users': Table('users', metadata, autoload_with=engine),
-        'cycles': Table('cycles', metadata, autoload_with=engine),
-        'stocks': Table('stocks', metadata, autoload_with=engine),
-        'transactions': Table('transactions', metadata, autoload_with=engine),
-        'markets': Table('markets', metadata, autoload_with=engine),
-        'investments': Table('investments', metadata, autoload_with=engine),
-    }
+_engines: Dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+
+
+def _engine_options(db_conn_str: str) -> Dict[str, Any]:
+    options = dict(ENGINE_OPTIONS)
+    url = make_url(db_conn_str)
+    if url.get_backend_name() == 'sqlite':
+        # sqlite connections are shared between streamlit threads
+        options['connect_args'] = {'check_same_thread': False}
+        if url.database in (None, '', ':memory:'):
+            # in-memory database lives as long as its single connection
+            for pool_option in ('pool_size', 'max_overflow', 'pool_timeout'):
+                options.pop(pool_option, None)
+            options['poolclass'] = StaticPool
+        else:
+            options['poolclass'] = QueuePool
+    return options
+
+
+def get_engine(db_conn_str: str) -> Engine:
+    engine = _engines.get(db_conn_str)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(db_conn_str)
+            if engine is None:
+                engine = create_engine(db_conn_str, future=True, **_engine_options(db_conn_str))
+                track_statements(engine)
+                _engines[db_conn_str] = engine
+    return engine
+
+
+def dispose_engines() -> None:
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
+
+def configure_engines(**options: Any) -> None:
+    # streamlit re-runs the app script on every interaction, keep pools unless settings really change
+    if all(ENGINE_OPTIONS.get(key) == value for key, value in options.items()):
+        return
+    ENGINE_OPTIONS.update(options)
+    dispose_engines()
+
+
+def read_db_schema(db_conn_str: str, verify: bool = False) -> Dict[str, Union[MetaData, Table]]:
+    # the schema is declared in qd_cyberpank_game.schema, reflection is only used to verify it against the database
+    if verify:
+        problems = verify_db_schema(get_engine(db_conn_str))
+        if problems:
+            raise ValueError(f"Database does not match the declared schema: {'; '.join(problems)}")
+    return get_db_schema()
+
+
+def auth_stmt(login: str, password_hash: str, users_table: Table) -> Select:
+    stmt = select(users_table.c.uid, users_table.c.name, users_table.c.ticket, users_table.c.home_market)
+    return stmt.filter_by(login=login, password=password_hash)
 
 
 def auth(login: str, password: str, db_conn_str: str, users_table: Table) -> Optional[User]:
-    engine = create_engine(db_conn_str, future=True)
+    engine = get_engine(db_conn_str)
     password_hash = hashlib.sha256(password.encode()).hexdigest()
-    stmt = select(users_table.c.uid, users_table.c.name, users_table.c.ticket, users_table.c.home_market)
-    stmt = stmt.filter_by(login=login, password=password_hash)
     with engine.connect() as conn:
-        result = conn.execute(stmt).one_or_none()
+        result = conn.execute(auth_stmt(login, password_hash, users_table)).one_or_none()
     if result is not None:
         return User(*result)
     return None
 
 
-def get_users(db_conn_str: str, users_table: Table) -> pd.DataFrame:
-    engine = create_engine(db_conn_str, future=True)
+def users_stmt(users_table: Table) -> Select:
     stmt = select(users_table.c.uid, users_table.c.name, users_table.c.ticket, users_table.c.home_market)
-    stmt = stmt.where(users_table.c.uid != 'root')
-    with engine.connect() as conn:
-        result = conn.execute(stmt).fetchall()
+    return stmt.where(users_table.c.uid != 'root')
+
+
+def users_frame(result: List[Row]) -> pd.DataFrame:
     return pd.DataFrame([User(*user) for user in result])
 
 
+def get_users(db_conn_str: str, users_table: Table) -> pd.DataFrame:
+    engine = get_engine(db_conn_str)
+    with engine.connect() as conn:
+        result = conn.execute(users_stmt(users_table)).fetchall()
+    return users_frame(result)
+
+
+def current_cycle_stmt(cycles_table: Table) -> Select:
+    # a lookup of max(timestamp) instead of ORDER BY ... LIMIT 1, which both SQLite and MySQL plan as an index scan
+    latest_timestamp = select(func.max(cycles_table.c.timestamp)).scalar_subquery()
+    stmt = select(cycles_table.c.cycle, cycles_table.c.fund_speed, cycles_table.c.timestamp)
+    return stmt.where(cycles_table.c.timestamp == latest_timestamp).limit(1)
+
+
 def get_current_cycle(db_conn_str: str, cycles_table: Table) -> Tuple[int, float]:
-    engine = create_engine(db_conn_str, future=True)
-    stmt = select(cycles_table.c.cycle, cycles_table.c.fund_speed).order_by(cycles_table.c.timestamp.desc())
+    engine = get_engine(db_conn_str)
     with engine.connect() as conn:
-        result = conn.execute(stmt).first()
+        result = conn.execute(current_cycle_stmt(cycles_table)).first()
     return (result.cycle, float(result.fund_speed)) if result is not None else (1, DEFAULT_FUND_SPEED)
 
 
+def game_version_stmt(cycles_table: Table, transactions_table: Table, stocks_table: Table, investments_table: Table) -> Select:
+    # one round trip: the latest cycles row, max ids of the mutable tables and the latest approval, every part is an
+    # index lookup; rows are only deleted with the whole game (seed_world, reinit_game), which resets the cycles row too
+    latest_cycle = current_cycle_stmt(cycles_table).subquery()
+    stmt = select(
+        select(latest_cycle.c.cycle).scalar_subquery().label('cycle'),
+        select(latest_cycle.c.fund_speed).scalar_subquery().label('fund_speed'),
+        select(latest_cycle.c.timestamp).scalar_subquery().label('cycle_timestamp'),
+        select(func.min(cycles_table.c.timestamp)).scalar_subquery().label('game_started_at'),
+        select(func.max(transactions_table.c.id)).scalar_subquery().label('max_transaction_id'),
+        select(func.max(stocks_table.c.id)).scalar_subquery().label('max_stock_id'),
+        select(func.max(investments_table.c.id)).scalar_subquery().label('max_investment_id'),
+        select(func.max(investments_table.c.timestamp_approved)).scalar_subquery().label('max_approved_at'),
+    )
+    return stmt
+
+
+def get_game_version(
+    db_conn_str: str,
+    cycles_table: Table,
+    transactions_table: Table,
+    stocks_table: Table,
+    investments_table: Table,
+) -> GameVersion:
+    engine = get_engine(db_conn_str)
+    stmt = game_version_stmt(cycles_table, transactions_table, stocks_table, investments_table)
+    with engine.connect() as conn:
+        result = conn.execute(stmt).one()
+    return GameVersion(
+        cycle=result.cycle if result.cycle is not None else 1,
+        fund_speed=float(result.fund_speed) if result.fund_speed is not None else DEFAULT_FUND_SPEED,
+        cycle_timestamp=result.cycle_timestamp,
+        game_started_at=result.game_started_at,
+        max_transaction_id=result.max_transaction_id,
+        max_stock_id=result.max_stock_id,
+        max_investment_id=result.max_investment_id,
+        max_approved_at=result.max_approved_at,
+    )
+
+
 def make_next_cycle(db_conn_str, current_cycle: int, fund_speed: float, cycles_table: Table) -> None:
-    engine = create_engine(db_conn_str, future=True)
+    engine = get_engine(db_conn_str)
     stmt = insert(cycles_table).values(cycle=current_cycle + 1, timestamp=datetime.now(), fund_speed=fund_speed)
     with engine.connect() as conn:
         conn.execute(stmt)
         conn.commit()
+    SHARED_CACHE.invalidate(db_conn_str)
 
 
-def get_transactions(db_conn_str: str, uid: str, transactions_table: Table) -> pd.DataFrame:
-    engine = create_engine(db_conn_str, future=True)
+def fetch_delta(conn: Connection, stmt: Select, id_column: Column, last_id: int) -> List[Row]:
+    # rows appended after last_id; rows up to it only change with a reinit, which callers catch by game_started_at
+    return conn.execute(stmt.where(id_column > last_id).order_by(id_column)).fetchall()
+
+
+def transactions_stmt(uid: str, transactions_table: Table) -> Select:
     cols = transactions_table.c
-    stmt = select(cols.from_, cols.to_, cols.amount, cols.cycle)
+    stmt = select(cols.id, cols.from_, cols.to_, cols.amount, cols.cycle)
     if uid != 'root':
         stmt = stmt.where(or_(cols.from_ == uid, cols.to_ == uid))
-    with engine.connect() as conn:
-        result = conn.execute(stmt).fetchall()
+    return stmt
+
+
+def transactions_frame(result: List[Row]) -> pd.DataFrame:
     transactions = [Transaction(
         from_=tr.from_,
         to_=tr.to_,
         amount=float(tr.amount),
         cycle=tr.cycle,
+        id=tr.id,
     ) for tr in result]
-    return pd.DataFrame(transactions)
+    return pd.DataFrame(transactions, columns=TRANSACTION_COLUMNS + ['id'])
+
+
+def get_transactions(db_conn_str: str, uid: str, transactions_table: Table) -> pd.DataFrame:
+    engine = get_engine(db_conn_str)
+    with engine.connect() as conn:
+        result = conn.execute(transactions_stmt(uid, transactions_table)).fetchall()
+    return transactions_frame(result)
 
 
-def make_transaction(db_conn_str: str, transactions_table: Table, transaction: Transaction) -> None:
-    engine = create_engine(db_conn_str, future=True)
+def make_transaction(
+    db_conn_str: str,
+    transactions_table: Table,
+    transaction: Transaction,
+    balances_table: Optional[Table] = None,
+    cycle_balances_table: Optional[Table] = None,
+) -> None:
+    # the ledger tables default to the declared schema, so callers written before the ledger keep working
+    db_schema = get_db_schema()
+    balances_table = db_schema['balances'] if balances_table is None else balances_table
+    cycle_balances_table = db_schema['cycle_balances'] if cycle_balances_table is None else cycle_balances_table
+    engine = get_engine(db_conn_str)
     stmt = insert(transactions_table).values(
         from_=transaction.from_,
         to_=transaction.to_,
         amount=transaction.amount,
         cycle=transaction.cycle,
     )
-    with engine.connect() as conn:
+    with engine.begin() as conn:
         conn.execute(stmt)
-        conn.commit()
+        update_ledger(conn, pd.DataFrame([transaction]), balances_table, cycle_balances_table)
+
+
+def ledger_deltas(transactions_df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    # every transaction is +amount for to_ and -amount for from_
+    amounts = transactions_df['amount'].astype(float)
+    legs = pd.DataFrame({
+        'uid': pd.concat([transactions_df['to_'], transactions_df['from_']], ignore_index=True),
+        'cycle': pd.concat([transactions_df['cycle'], transactions_df['cycle']], ignore_index=True).astype(int),
+        'net': pd.concat([amounts, -amounts], ignore_index=True),
+    })
+    cycle_deltas = legs.groupby(['uid', 'cycle'], as_index=False, sort=False)['net'].sum()
+    balance_deltas = cycle_deltas.groupby('uid', as_index=False, sort=False)['net'].sum().rename(columns={'net': 'balance'})
+    return balance_deltas, cycle_deltas
+
+
+def increment_rows(conn: Connection, table: Table, key_columns: List[str], value_column: str, records: List[Dict[str, Any]]) -> None:
+    # insert the row or add the value to the existing one, in a single executemany
+    if not records:
+        return
+    dialect_name = conn.dialect.name
+    if dialect_name == 'mysql':
+        stmt = mysql.insert(table)
+        stmt = stmt.on_duplicate_key_update({value_column: table.c[value_column] + stmt.inserted[value_column]})
+    elif dialect_name in ('sqlite', 'postgresql'):
+        stmt = sqlite.insert(table) if dialect_name == 'sqlite' else postgresql.insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={value_column: table.c[value_column] + stmt.excluded[value_column]},
+        )
+    else:
+        raise NotImplementedError(f'Ledger upserts are not implemented for {dialect_name}')
+    conn.execute(stmt, records)
 
 
-def get_markets(db_conn_str: str, markets_table: Table) -> pd.DataFrame:
-    engine = create_engine(db_conn_str, future=True)
-    cols = markets_table.c
-    stmt = select(cols.id, cols.name, cols.capacity, cols.min_capacity, cols.link1, cols.link2)
+def update_ledger(conn: Connection, transactions_df: pd.DataFrame, balances_table: Table, cycle_balances_table: Table) -> int:
+    if transactions_df.empty:
+        return 0
+    balance_deltas, cycle_deltas = ledger_deltas(transactions_df)
+    increment_rows(conn, balances_table, ['uid'], 'balance', to_records(balance_deltas))
+    increment_rows(conn, cycle_balances_table, ['uid', 'cycle'], 'net', to_records(cycle_deltas))
+    return len(balance_deltas) + len(cycle_deltas)
+
+
+def balance_stmt(uid: str, cycle: int, balances_table: Table, cycle_balances_table: Table) -> Select:
+    # running balance and the net result of the previous cycle
+    cycle_net = and_(cycle_balances_table.c.uid == balances_table.c.uid, cycle_balances_table.c.cycle == cycle - 1)
+    stmt = select(balances_table.c.balance, cycle_balances_table.c.net)
+    stmt = stmt.select_from(balances_table.outerjoin(cycle_balances_table, cycle_net))
+    return stmt.where(balances_table.c.uid == uid)
+
+
+def get_balance(db_conn_str: str, uid: str, cycle: int, balances_table: Table, cycle_balances_table: Table) -> Tuple[float, float]:
+    engine = get_engine(db_conn_str)
     with engine.connect() as conn:
-        result = conn.execute(stmt).fetchall()
+        result = conn.execute(balance_stmt(uid, cycle, balances_table, cycle_balances_table)).one_or_none()
+    if result is None:
+        return 0.0, 0.0
+    return float(result.balance), float(result.net or 0)
+
+
+def balance_history_stmt(uid: str, balance_snapshots_table: Table) -> Select:
+    cols = balance_snapshots_table.c
+    return select(cols.cycle, cols.balance, cols.net).where(cols.uid == uid).order_by(cols.cycle)
+
+
+def get_balance_history(db_conn_str: str, uid: str, balance_snapshots_table: Table) -> pd.DataFrame:
+    engine = get_engine(db_conn_str)
+    with engine.connect() as conn:
+        result = conn.execute(balance_history_stmt(uid, balance_snapshots_table)).fetchall()
+    history_df = pd.DataFrame(result, columns=['cycle', 'balance', 'net'])
+    return history_df.astype({'balance': float, 'net': float})
+
+
+def market_history_stmt(market_snapshots_table: Table) -> Select:
+    cols = market_snapshots_table.c
+    return select(cols.market, cols.cycle, cols.capacity, cols.invested, cols.income, cols.bids).order_by(cols.cycle)
+
+
+def get_market_history(db_conn_str: str, market_snapshots_table: Table) -> pd.DataFrame:
+    engine = get_engine(db_conn_str)
+    with engine.connect() as conn:
+        result = conn.execute(market_history_stmt(market_snapshots_table)).fetchall()
+    history_df = pd.DataFrame(result, columns=['market', 'cycle', 'capacity', 'invested', 'income', 'bids'])
+    return history_df.astype({'capacity': float, 'invested': float, 'income': float})
+
+
+def rebuild_balances(conn: Connection, transactions_table: Table) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    cols = transactions_table.c
+    stmt = select(cols.from_, cols.to_, cols.cycle, func.sum(cols.amount).label('amount'))
+    stmt = stmt.group_by(cols.from_, cols.to_, cols.cycle)
+    result = conn.execute(stmt).fetchall()
+    transactions_df = pd.DataFrame(result, columns=['from_', 'to_', 'cycle', 'amount'])
+    if transactions_df.empty:
+        return pd.DataFrame(columns=['uid', 'balance']), pd.DataFrame(columns=['uid', 'cycle', 'net'])
+    return ledger_deltas(transactions_df)
+
+
+def check_balances(
+    db_conn_str: str,
+    transactions_table: Table,
+    balances_table: Table,
+    cycle_balances_table: Table,
+    fix: bool = False,
+    tolerance: float = 0.01,
+) -> pd.DataFrame:
+    # diff of the stored ledger against the one rebuilt from raw transactions, rows with cycle == None are running balances
+    engine = get_engine(db_conn_str)
+    with engine.begin() as conn:
+        expected_balances, expected_cycle_balances = rebuild_balances(conn, transactions_table)
+        stored_balances = pd.DataFrame(
+            conn.execute(select(balances_table.c.uid, balances_table.c.balance)).fetchall(),
+            columns=['uid', 'balance'],
+        )
+        stored_cycle_balances = pd.DataFrame(
+            conn.execute(select(cycle_balances_table.c.uid, cycle_balances_table.c.cycle, cycle_balances_table.c.net)).fetchall(),
+            columns=['uid', 'cycle', 'net'],
+        )
+        balances_diff = pd.merge(expected_balances, stored_balances, on='uid', how='outer', suffixes=('_expected', '_stored'))
+        balances_diff = balances_diff.rename(columns={'balance_expected': 'expected', 'balance_stored': 'stored'})
+        balances_diff['cycle'] = None
+        cycle_diff = pd.merge(expected_cycle_balances, stored_cycle_balances, on=['uid', 'cycle'], how='outer', suffixes=('_expected', '_stored'))
+        cycle_diff = cycle_diff.rename(columns={'net_expected': 'expected', 'net_stored': 'stored'})
+        diff = pd.concat([balances_diff, cycle_diff], ignore_index=True)[['uid', 'cycle', 'expected', 'stored']]
+        diff[['expected', 'stored']] = diff[['expected', 'stored']].astype(float).fillna(0.0)
+        diff = diff[(diff['expected'] - diff['stored']).abs() > tolerance].reset_index(drop=True)
+        if fix and not diff.empty:
+            conn.execute(delete(balances_table))
+            conn.execute(delete(cycle_balances_table))
+            bulk_insert(conn, balances_table, expected_balances)
+            bulk_insert(conn, cycle_balances_table, expected_cycle_balances)
+    return diff
+
+
+def markets_stmt(markets_table: Table) -> Select:
+    cols = markets_table.c
+    return select(cols.id, cols.name, cols.capacity, cols.min_capacity)
+
+
+def markets_frame(result: List[Row]) -> pd.DataFrame:
     dict_results = [dict(market) for market in result]
     for record in dict_results:
         record['capacity'] = float(record['capacity'])
         record['min_capacity'] = float(record['min_capacity'])
-    markets_df = pd.DataFrame(dict_results)
+    markets_df = pd.DataFrame(dict_results, columns=['id', 'name', 'capacity', 'min_capacity'])
     markets_df = markets_df.set_index('id')
-    markets_df['link1'] = markets_df.loc[markets_df.index.intersection(markets_df['link1'])].reindex(markets_df['link1'])['name'].values
-    markets_df['link2'] = markets_df.loc[markets_df.index.intersection(markets_df['link2'])].reindex(markets_df['link2'])['name'].values
     return markets_df
 
 
-def get_cycle_investments(db_conn_str: str, uid: str, cycle: int, investments_table: Table) -> pd.DataFrame:
-    engine = create_engine(db_conn_str, future=True)
+def get_markets(db_conn_str: str, markets_table: Table) -> pd.DataFrame:
+    engine = get_engine(db_conn_str)
+    with engine.connect() as conn:
+        result = conn.execute(markets_stmt(markets_table)).fetchall()
+    return markets_frame(result)
+
+
+def load_market_graph(conn: Connection, markets_table: Table, market_links_table: Table) -> MarketGraph:
+    markets = conn.execute(select(markets_table.c.id, markets_table.c.name).order_by(markets_table.c.id)).fetchall()
+    links = conn.execute(select(market_links_table.c.source, market_links_table.c.target)).fetchall()
+    markets_df = pd.DataFrame(markets, columns=['id', 'name'])
+    links_df = pd.DataFrame(links, columns=['source', 'target'])
+    return MarketGraph.from_frames(markets_df, links_df)
+
+
+def get_market_graph(db_conn_str: str, markets_table: Table, market_links_table: Table) -> MarketGraph:
+    engine = get_engine(db_conn_str)
+    with engine.connect() as conn:
+        return load_market_graph(conn, markets_table, market_links_table)
+
+
+def cycle_investments_stmt(uid: str, cycle: int, investments_table: Table) -> Select:
     c = investments_table.c
-    select_cols = [c.id, c.uid, c.market, c.amount, c.timestamp_created, c.timestamp_approved, c.status, c.cycle, c.income, c.multiplier]
-    select_cols_names = [col.name for col in select_cols]
-    stmt = select(*select_cols)
+    stmt = select(c.id, c.uid, c.market, c.amount, c.timestamp_created, c.timestamp_approved, c.status, c.cycle, c.income, c.multiplier)
     stmt = stmt.where(c.cycle == cycle)
     if uid != 'root':
         stmt = stmt.where(c.uid == uid)
-    with engine.connect() as conn:
-        result = conn.execute(stmt).fetchall()
+    return stmt
+
+
+def cycle_investments_frame(result: List[Row], stmt: Select) -> pd.DataFrame:
+    select_cols_names = [col.name for col in stmt.selected_columns]
     investment_bids = [InvestmentBid(*requirement) for requirement in result]
     for bid in investment_bids:
         bid.amount = float(bid.amount) if bid.amount else None
@@ -150,9 +447,16 @@ def get_cycle_investments(db_conn_str: str, uid: str, cycle: int, investments_ta
     )
 
 
-def make_investment(db_conn_str: str, investments_table: Table, invest_bid: InvestmentBid) -> None:
-    engine = create_engine(db_conn_str, future=True)
-    stmt = insert(investments_table).values(
+def get_cycle_investments(db_conn_str: str, uid: str, cycle: int, investments_table: Table) -> pd.DataFrame:
+    engine = get_engine(db_conn_str)
+    stmt = cycle_investments_stmt(uid, cycle, investments_table)
+    with engine.connect() as conn:
+        result = conn.execute(stmt).fetchall()
+    return cycle_investments_frame(result, stmt)
+
+
+def investment_stmt(investments_table: Table, invest_bid: InvestmentBid) -> Insert:
+    return insert(investments_table).values(
         uid=invest_bid.uid,
         market=invest_bid.market,
         amount=invest_bid.amount,
@@ -160,13 +464,17 @@ def make_investment(db_conn_str: str, investments_table: Table, invest_bid: Inve
         status=invest_bid.status,
         cycle=invest_bid.cycle,
     )
+
+
+def make_investment(db_conn_str: str, investments_table: Table, invest_bid: InvestmentBid) -> None:
+    engine = get_engine(db_conn_str)
     with engine.connect() as conn:
-        conn.execute(stmt)
+        conn.execute(investment_stmt(investments_table, invest_bid))
         conn.commit()
 
 
 def update_investment_status(db_conn_str: str, investments_table: Table, bid_id: int, status: int) -> None:
-    engine = create_engine(db_conn_str, future=True)
+    engine = get_engine(db_conn_str)
     stmt = update(investments_table).where(investments_table.c.id == bid_id)
     stmt = stmt.values(status=status, timestamp_approved=datetime.now())
     with engine.connect() as conn:
@@ -175,7 +483,7 @@ def update_investment_status(db_conn_str: str, investments_table: Table, bid_id:
 
 
 def update_investment_income(db_conn_str: str, investments_table: Table, bid_id: int, income: float) -> None:
-    engine = create_engine(db_conn_str, future=True)
+    engine = get_engine(db_conn_str)
     stmt = update(investments_table).where(investments_table.c.id == bid_id)
     stmt = stmt.values(income=income)
     with engine.connect() as conn:
@@ -184,7 +492,7 @@ def update_investment_income(db_conn_str: str, investments_table: Table, bid_id:
 
 
 def update_investment_multiplier(db_conn_str: str, investments_table: Table, bid_id: int, multiplier: float) -> None:
-    engine = create_engine(db_conn_str, future=True)
+    engine = get_engine(db_conn_str)
     stmt = update(investments_table).where(investments_table.c.id == bid_id)
     stmt = stmt.values(multiplier=multiplier)
     with engine.connect() as conn:
@@ -192,34 +500,79 @@ def update_investment_multiplier(db_conn_str: str, investments_table: Table, bid
         conn.commit()
 
 
-def get_stocks(db_conn_str: str, stocks_table: Table) -> pd.DataFrame:
-    engine = create_engine(db_conn_str, future=True)
-    stmt = select(stocks_table.c.price, stocks_table.c.ticket, stocks_table.c.cycle)
-    with engine.connect() as conn:
-        result = conn.execute(stmt).fetchall()
+def stocks_stmt(stocks_table: Table) -> Select:
+    return select(stocks_table.c.price, stocks_table.c.ticket, stocks_table.c.cycle, stocks_table.c.id)
+
+
+def stocks_frame(result: List[Row], stocks_table: Table) -> pd.DataFrame:
     dict_results = [dict(record) for record in result]
     for record in dict_results:
         record['price'] = float(record['price'])
         record['cycle'] = float(record['cycle'])
-    return pd.DataFrame(dict_results, columns=[stocks_table.c.price.name, stocks_table.c.ticket.name, stocks_table.c.cycle.name])
+    columns = [stocks_table.c.price.name, stocks_table.c.ticket.name, stocks_table.c.cycle.name, stocks_table.c.id.name]
+    return pd.DataFrame(dict_results, columns=columns)
+
+
+def get_stocks(db_conn_str: str, stocks_table: Table) -> pd.DataFrame:
+    engine = get_engine(db_conn_str)
+    with engine.connect() as conn:
+        result = conn.execute(stocks_stmt(stocks_table)).fetchall()
+    return stocks_frame(result, stocks_table)
 
 
-def make_stocks(db_conn_str: str, stocks_table: Table, stocks_df: pd.DataFrame):
-    engine = create_engine(db_conn_str, future=True)
-    for stocks_row in stocks_df.to_dict('records'):
-        stmt = insert(stocks_table).values(**stocks_row)
-        with engine.connect() as conn:
-            conn.execute(stmt)
-            conn.commit()    
+def get_stocks_delta(db_conn_str: str, stocks_table: Table, last_id: int) -> pd.DataFrame:
+    engine = get_engine(db_conn_str)
+    with engine.connect() as conn:
+        result = fetch_delta(conn, stocks_stmt(stocks_table), stocks_table.c.id, last_id)
+    return stocks_frame(result, stocks_table)
+
+
+def to_records(data: Union[pd.DataFrame, Mapping[str, Sequence[Any]]]) -> List[Dict[str, Any]]:
+    # tolist() converts numpy scalars to python ones, DB drivers do not accept np.int64 & co
+    if isinstance(data, pd.DataFrame):
+        columns = {name: data[name].tolist() for name in data.columns}
+    else:
+        columns = {name: np.asarray(values).tolist() for name, values in data.items()}
+    names = list(columns)
+    return [dict(zip(names, row)) for row in zip(*columns.values())]
+
+
+def bulk_insert(conn: Connection, table: Table, data: Union[pd.DataFrame, Mapping[str, Sequence[Any]]]) -> int:
+    # executemany of a single cached INSERT: pymysql rewrites it into multi-row INSERTs bounded by packet size,
+    # sqlite runs it in-process; a literal multi-row .values() would be recompiled by SQLAlchemy on every call
+    records = to_records(data)
+    if records:
+        conn.execute(insert(table), records)
+    return len(records)
+
+
+def make_stocks(db_conn_str: str, stocks_table: Table, stocks_df: pd.DataFrame) -> int:
+    engine = get_engine(db_conn_str)
+    with engine.begin() as conn:
+        inserted_rows = bulk_insert(conn, stocks_table, stocks_df)
+    SHARED_CACHE.invalidate(db_conn_str)
+    return inserted_rows
 
 
 def update_market_capacity(db_conn_str: str, markets_table: Table, market: str, capacity: float) -> None:
-    engine = create_engine(db_conn_str, future=True)
+    engine = get_engine(db_conn_str)
     stmt = update(markets_table).where(markets_table.c.name == market)
     stmt = stmt.values(capacity=capacity)
     with engine.connect() as conn:
         conn.execute(stmt)
         conn.commit()
+    SHARED_CACHE.invalidate(db_conn_str)
+
+
+def update_market_capacities(conn: Connection, markets_table: Table, market_capacities: Mapping[str, float]) -> int:
+    capacity_params = [{'b_market': market, 'b_capacity': float(capacity)} for market, capacity in market_capacities.items()]
+    if capacity_params:
+        stmt = update(markets_table).where(markets_table.c.name == bindparam('b_market'))
+        conn.execute(stmt.values(capacity=bindparam('b_capacity')), capacity_params)
+    return len(capacity_params)
+
+
+AUTO_GREEN_AMOUNT = 1000000
 
 
 def make_auto_green_investment(
@@ -228,33 +581,240 @@ def make_auto_green_investment(
     prev_investments_df: pd.DataFrame,
     cycle: int,
     investments_table: Table,
-):
-    engine = create_engine(db_conn_str, future=True)
-    last_green_markets = prev_investments_df[prev_investments_df['income'] > 0].groupby('uid')['market'].apply(set).reset_index()
-    current_investments = investments_df[investments_df['status'] == 1].groupby('uid')['market'].apply(set).reset_index()
-    if current_investments.empty:
-        merged_info = last_green_markets.copy()
-        merged_info['market_prev'] = merged_info['market']
-        merged_info['market'] = [set()] * len(merged_info)
+    dry_run: bool = False,
+) -> pd.DataFrame:
+    # last cycle's green (uid, market) pairs without an approved bid this cycle get a minimal approved bid
+    green_pairs = prev_investments_df.loc[prev_investments_df['income'] > 0, ['uid', 'market']].drop_duplicates()
+    current_pairs = investments_df.loc[investments_df['status'] == 1, ['uid', 'market']].drop_duplicates()
+    lost_pairs = green_pairs.merge(current_pairs, on=['uid', 'market'], how='left', indicator=True)
+    lost_pairs = lost_pairs.loc[lost_pairs['_merge'] == 'left_only', ['uid', 'market']].reset_index(drop=True)
+    timestamp = datetime.now() - timedelta(minutes=1)
+    auto_bids = lost_pairs.assign(
+        amount=float(AUTO_GREEN_AMOUNT),
+        timestamp_created=timestamp,
+        timestamp_approved=timestamp,
+        status=1,
+        cycle=cycle,
+    )
+    if not dry_run and not auto_bids.empty:
+        engine = get_engine(db_conn_str)
+        with engine.begin() as conn:
+            bulk_insert(conn, investments_table, auto_bids)
+    return auto_bids
+
+
+def income_transaction(uid: str, market: str, income: float, cycle: int) -> Transaction:
+    if income >= 0:
+        return Transaction(from_=market, to_=uid, amount=abs(income), cycle=cycle)
+    return Transaction(from_=uid, to_=market, amount=abs(income), cycle=cycle)
+
+
+def settle_cycle(
+    conn: Connection,
+    market_incomes: pd.DataFrame,
+    market_capacities: Mapping[str, float],
+    cycle: int,
+    investments_table: Table,
+    markets_table: Table,
+    transactions_table: Table,
+    balances_table: Table,
+    cycle_balances_table: Table,
+) -> List[SettlementPhase]:
+    # every phase is a single executemany, the caller owns the transaction
+    phases = []
+
+    start = time.perf_counter()
+    capacity_rows = update_market_capacities(conn, markets_table, market_capacities)
+    phases.append(SettlementPhase(name='capacities', rows=capacity_rows, elapsed=time.perf_counter() - start))
+
+    start = time.perf_counter()
+    income_params = to_records({
+        'b_id': market_incomes['bid_id'],
+        'b_income': market_incomes['income'],
+        'b_funded': market_incomes['funded_amount'],
+    })
+    if income_params:
+        stmt = update(investments_table).where(investments_table.c.id == bindparam('b_id'))
+        conn.execute(stmt.values(income=bindparam('b_income'), funded_amount=bindparam('b_funded')), income_params)
+    phases.append(SettlementPhase(name='incomes', rows=len(income_params), elapsed=time.perf_counter() - start))
+
+    start = time.perf_counter()
+    transactions_df = pd.DataFrame([
+        income_transaction(invest_income['uid'], invest_income['market'], invest_income['income'], cycle)
+        for invest_income in to_records(market_incomes[['uid', 'market', 'income']])
+    ], columns=TRANSACTION_COLUMNS)
+    if not transactions_df.empty:
+        conn.execute(insert(transactions_table), to_records(transactions_df))
+    phases.append(SettlementPhase(name='transactions', rows=len(transactions_df), elapsed=time.perf_counter() - start))
+
+    start = time.perf_counter()
+    ledger_rows = update_ledger(conn, transactions_df, balances_table, cycle_balances_table)
+    phases.append(SettlementPhase(name='ledger', rows=ledger_rows, elapsed=time.perf_counter() - start))
+    return phases
+
+
+def calculate_cycle(
+    investments_df: pd.DataFrame,
+    markets_df: pd.DataFrame,
+    stocks_df: pd.DataFrame,
+    users_df: pd.DataFrame,
+    fund_speed: float,
+    cycle: int,
+    seed: Optional[int] = None,
+    now: Optional[datetime] = None,
+    last_prices: Optional[pd.Series] = None,
+) -> Tuple[pd.DataFrame, Mapping[str, float], pd.DataFrame, pd.Series, SettlementPhase]:
+    # the CPU part of finish_cycle, no database access; last_prices (e.g. the previous price snapshot)
+    # spares the groupby over the whole stocks history
+    start = time.perf_counter()
+    tickets = pd.unique(users_df['ticket'])
+    if last_prices is None or last_prices.reindex(tickets).isnull().any():
+        last_prices = get_last_prices(stocks_df)
+    cycle_investments_calculation = calculate_investments(investments_df, markets_df, fund_speed, now=now)
+    if cycle_investments_calculation is not None:
+        market_incomes, market_capacities = cycle_investments_calculation
     else:
-        merged_info = pd.merge(last_green_markets, current_investments, on='uid', suffixes=('_prev', ''))
-    uids = merged_info['uid'].tolist()
-    for uid in uids:
-        lost_green_markets = merged_info.loc[merged_info['uid'] == uid, 'market_prev'].item() - merged_info.loc[merged_info['uid'] == uid, 'market'].item()
-        lost_green_markets = list(lost_green_markets)
-        for lost_market in lost_green_markets:
-            stmt = insert(investments_table).values(
-                uid=uid,
-                market=lost_market,
-                amount=1000000,
-                timestamp_created=datetime.now() - timedelta(minutes=1),
-                timestamp_approved=datetime.now() - timedelta(minutes=1),
-                status=1,
-                cycle=cycle,
-            )
-            with engine.connect() as conn:
-                conn.execute(stmt)
-                conn.commit()
+        market_incomes, market_capacities = None, {}
+    new_stocks = generate_stocks(market_incomes, stocks_df, users_df, cycle, rng=cycle_rng(cycle, seed), last_prices=last_prices)
+    # tickets without incomes get no quotes this cycle and keep their last price
+    closing_prices = get_last_prices(new_stocks).combine_first(last_prices.reindex(tickets)).rename('price')
+    if market_incomes is None:
+        market_incomes = pd.DataFrame(columns=['bid_id', 'uid', 'market', 'income', 'funded_amount'])
+    phase = SettlementPhase(name='calculation', rows=len(market_incomes), elapsed=time.perf_counter() - start)
+    return market_incomes, market_capacities, new_stocks, closing_prices, phase
+
+
+def closing_prices_stmt(cycle: int, price_snapshots_table: Table) -> Select:
+    cols = price_snapshots_table.c
+    return select(cols.ticket, cols.price).where(cols.cycle == cycle)
+
+
+def load_closing_prices(conn: Connection, cycle: int, price_snapshots_table: Table) -> pd.Series:
+    result = conn.execute(closing_prices_stmt(cycle, price_snapshots_table)).fetchall()
+    return pd.Series([float(row.price) for row in result], index=[row.ticket for row in result], name='price', dtype=float)
+
+
+def write_snapshots(
+    conn: Connection,
+    market_incomes: pd.DataFrame,
+    closing_prices: pd.Series,
+    users_df: pd.DataFrame,
+    cycle: int,
+    markets_table: Table,
+    market_links_table: Table,
+    balances_table: Table,
+    cycle_balances_table: Table,
+    balance_snapshots_table: Table,
+    market_snapshots_table: Table,
+    price_snapshots_table: Table,
+    unlock_snapshots_table: Table,
+) -> int:
+    # runs after the ledger and capacities of the cycle are written, rewriting a cycle replaces its snapshot
+    for table in (balance_snapshots_table, market_snapshots_table, price_snapshots_table, unlock_snapshots_table):
+        conn.execute(delete(table).where(table.c.cycle == cycle))
+
+    cycle_net = and_(cycle_balances_table.c.uid == balances_table.c.uid, cycle_balances_table.c.cycle == cycle)
+    balances = select(
+        balances_table.c.uid,
+        literal(cycle, Integer).label('cycle'),
+        balances_table.c.balance,
+        func.coalesce(cycle_balances_table.c.net, 0).label('net'),
+    ).select_from(balances_table.outerjoin(cycle_balances_table, cycle_net))
+    balance_rows = conn.execute(
+        insert(balance_snapshots_table).from_select(['uid', 'cycle', 'balance', 'net'], balances),
+    ).rowcount
+
+    market_totals = market_incomes.groupby('market').agg(
+        invested=('funded_amount', 'sum'),
+        income=('income', 'sum'),
+        max_income=('income', 'max'),
+        bids=('bid_id', 'size'),
+    )
+    capacities = conn.execute(select(markets_table.c.name, markets_table.c.capacity)).fetchall()
+    market_snapshots = pd.DataFrame(capacities, columns=['market', 'capacity']).join(market_totals, on='market')
+    market_snapshots = market_snapshots.fillna({'invested': 0.0, 'income': 0.0, 'bids': 0})
+    market_snapshots['capacity'] = market_snapshots['capacity'].astype(float)
+    market_snapshots['bids'] = market_snapshots['bids'].astype(int)
+    market_snapshots['max_income'] = market_snapshots['max_income'].astype(object).where(market_snapshots['max_income'].notna(), None)
+    market_rows = bulk_insert(conn, market_snapshots_table, market_snapshots.assign(cycle=cycle))
+
+    price_rows = bulk_insert(conn, price_snapshots_table, {
+        'ticket': closing_prices.index.values,
+        'cycle': np.full(len(closing_prices), cycle),
+        'price': closing_prices.values,
+    })
+
+    # same rule as the markets graph: the first bid of a player on a market decides whether it is green
+    market_graph = load_market_graph(conn, markets_table, market_links_table)
+    first_bids = market_incomes.drop_duplicates(['uid', 'market'])
+    green_markets = first_bids[first_bids['income'] > 0].groupby('uid')['market'].apply(list)
+    unlocks = [
+        (uid, market)
+        for uid, home_market in zip(users_df['uid'], users_df['home_market'])
+        for market in market_graph.unlocked_markets(green_markets.get(uid, []), home_market)
+    ]
+    unlock_rows = bulk_insert(conn, unlock_snapshots_table, {
+        'uid': [uid for uid, _ in unlocks],
+        'cycle': [cycle] * len(unlocks),
+        'market': [market for _, market in unlocks],
+    })
+    return balance_rows + market_rows + price_rows + unlock_rows
+
+
+def write_cycle(
+    conn: Connection,
+    market_incomes: pd.DataFrame,
+    market_capacities: Mapping[str, float],
+    new_stocks: pd.DataFrame,
+    closing_prices: pd.Series,
+    users_df: pd.DataFrame,
+    cycle: int,
+    investments_table: Table,
+    markets_table: Table,
+    market_links_table: Table,
+    transactions_table: Table,
+    stocks_table: Table,
+    balances_table: Table,
+    cycle_balances_table: Table,
+    balance_snapshots_table: Table,
+    market_snapshots_table: Table,
+    price_snapshots_table: Table,
+    unlock_snapshots_table: Table,
+) -> List[SettlementPhase]:
+    # the whole cycle is settled or nothing is, the caller owns the transaction
+    phases = settle_cycle(
+        conn,
+        market_incomes,
+        market_capacities,
+        cycle,
+        investments_table,
+        markets_table,
+        transactions_table,
+        balances_table,
+        cycle_balances_table,
+    )
+    start = time.perf_counter()
+    stocks_rows = bulk_insert(conn, stocks_table, new_stocks)
+    phases.append(SettlementPhase(name='stocks', rows=stocks_rows, elapsed=time.perf_counter() - start))
+
+    start = time.perf_counter()
+    snapshot_rows = write_snapshots(
+        conn,
+        market_incomes,
+        closing_prices,
+        users_df,
+        cycle,
+        markets_table,
+        market_links_table,
+        balances_table,
+        cycle_balances_table,
+        balance_snapshots_table,
+        market_snapshots_table,
+        price_snapshots_table,
+        unlock_snapshots_table,
+    )
+    phases.append(SettlementPhase(name='snapshots', rows=snapshot_rows, elapsed=time.perf_counter() - start))
+    return phases
 
 
 def finish_cycle(
@@ -267,29 +827,47 @@ def finish_cycle(
     cycle: int,
     investments_table: Table,
     markets_table: Table,
+    market_links_table: Table,
     transactions_table: Table,
     stocks_table: Table,
-):
-    cycle_investments_calculation = calculate_investments(investments_df, markets_df, fund_speed)
-    if cycle_investments_calculation is not None:
-        market_incomes, market_capacities = cycle_investments_calculation
-        for market, capacity in market_capacities.items():
-            update_market_capacity(db_conn_str, markets_table, market, capacity)
-
-        for invest_income in market_incomes:
-            update_investment_income(db_conn_str, investments_table, bid_id=invest_income['bid_id'], income=invest_income['income'])
-            if invest_income['income'] >= 0:
-                from_ = invest_income['market']
-                to_ = invest_income['uid']
-            else:
-                from_ = invest_income['uid']
-                to_ = invest_income['market']
-            transaction = Transaction(from_=from_, to_=to_, amount=abs(invest_income['income']), cycle=cycle)
-            make_transaction(db_conn_str, transactions_table, transaction)
-    else:
-        market_incomes = None
-    new_stocks = generate_stocks(market_incomes, stocks_df, users_df, cycle)
-    make_stocks(db_conn_str, stocks_table, new_stocks)
+    balances_table: Table,
+    cycle_balances_table: Table,
+    balance_snapshots_table: Table,
+    market_snapshots_table: Table,
+    price_snapshots_table: Table,
+    unlock_snapshots_table: Table,
+    seed: Optional[int] = None,
+    now: Optional[datetime] = None,
+) -> List[SettlementPhase]:
+    engine = get_engine(db_conn_str)
+    with engine.connect() as conn:
+        last_prices = load_closing_prices(conn, cycle - 1, price_snapshots_table)
+    market_incomes, market_capacities, new_stocks, closing_prices, calculation_phase = calculate_cycle(
+        investments_df, markets_df, stocks_df, users_df, fund_speed, cycle, seed=seed, now=now, last_prices=last_prices,
+    )
+    with engine.begin() as conn:
+        phases = write_cycle(
+            conn,
+            market_incomes,
+            market_capacities,
+            new_stocks,
+            closing_prices,
+            users_df,
+            cycle,
+            investments_table,
+            markets_table,
+            market_links_table,
+            transactions_table,
+            stocks_table,
+            balances_table,
+            cycle_balances_table,
+            balance_snapshots_table,
+            market_snapshots_table,
+            price_snapshots_table,
+            unlock_snapshots_table,
+        )
+    SHARED_CACHE.invalidate(db_conn_str)
+    return [calculation_phase] + phases
 
 
 def reinit_game(
@@ -298,22 +876,91 @@ def reinit_game(
     markets_table: Table,
     stocks_table: Table,
     transactions_table: Table,
+    balances_table: Table,
+    cycle_balances_table: Table,
+    investments_table: Table,
+    cycles_table: Table,
+    balance_snapshots_table: Table,
+    market_snapshots_table: Table,
+    price_snapshots_table: Table,
+    unlock_snapshots_table: Table,
+    replay_checkpoints_table: Table,
+    seed: Optional[int] = None,
+    start_bonuses: Optional[Dict[str, float]] = None,
 ):
-    for market, start_capacity in START_CAPATICY.items():
-        update_market_capacity(db_conn_str, markets_table, market, start_capacity)
-
-    for uid in users_df['uid'].tolist():
-        make_transaction(
-            db_conn_str,
-            transactions_table,
-            Transaction(from_='root', to_=uid, amount=START_BALANCE, cycle=-1),
-        )
-
-    start_incomes = []
-    for uid, start_bonus in START_BONUSES.items():
-        start_incomes.append({'uid': uid, 'income': start_bonus})
-        if start_bonus > 0:
-            make_transaction(db_conn_str, transactions_table, Transaction(from_='root', to_=uid, amount=start_bonus, cycle=0))
+    start_bonuses = START_BONUSES if start_bonuses is None else start_bonuses
+    uids = users_df['uid'].tolist()
+    balance_transactions = pd.DataFrame({
+        'from_': 'root',
+        'to_': uids,
+        'amount': START_BALANCE,
+        'cycle': -1,
+    })
+    bonus_uids = [uid for uid, start_bonus in start_bonuses.items() if start_bonus > 0]
+    bonus_transactions = pd.DataFrame({
+        'from_': 'root',
+        'to_': bonus_uids,
+        'amount': [float(start_bonuses[uid]) for uid in bonus_uids],
+        'cycle': 0,
+    })
+    start_transactions = pd.concat([balance_transactions, bonus_transactions], ignore_index=True)
+    start_incomes = pd.DataFrame({'uid': list(start_bonuses), 'income': list(start_bonuses.values())}, columns=['uid', 'income'])
     stocks_df = pd.DataFrame({'ticket': users_df['ticket'], 'price': INIT_STOCK, 'cycle': 0})
-    new_stocks = generate_stocks(start_incomes, stocks_df, users_df, cycle=0)
-    make_stocks(db_conn_str, stocks_table, pd.concat([stocks_df, new_stocks]))
+    new_stocks = generate_stocks(start_incomes, stocks_df, users_df, cycle=0, rng=cycle_rng(0, seed))
+
+    engine = get_engine(db_conn_str)
+    with engine.begin() as conn:
+        # the ledgers are incremented, so everything of the previous game goes first; users, markets and links stay
+        for table in (
+            replay_checkpoints_table,
+            balance_snapshots_table,
+            market_snapshots_table,
+            price_snapshots_table,
+            unlock_snapshots_table,
+            investments_table,
+            transactions_table,
+            balances_table,
+            cycle_balances_table,
+            stocks_table,
+            cycles_table,
+        ):
+            conn.execute(delete(table))
+        # the first cycles row marks the new game, see GameVersion.game_started_at
+        conn.execute(insert(cycles_table).values(cycle=1, timestamp=datetime.now(), fund_speed=DEFAULT_FUND_SPEED))
+        update_market_capacities(conn, markets_table, START_CAPATICY)
+        bulk_insert(conn, transactions_table, start_transactions)
+        update_ledger(conn, start_transactions, balances_table, cycle_balances_table)
+        bulk_insert(conn, stocks_table, pd.concat([stocks_df, new_stocks]))
+    SHARED_CACHE.invalidate(db_conn_str)
+
+
+instrument_module(globals(), 'db', [
+    'read_db_schema',
+    'auth',
+    'get_users',
+    'get_current_cycle',
+    'get_game_version',
+    'make_next_cycle',
+    'get_transactions',
+    'make_transaction',
+    'get_balance',
+    'get_balance_history',
+    'get_market_history',
+    'check_balances',
+    'get_markets',
+    'get_market_graph',
+    'get_cycle_investments',
+    'make_investment',
+    'update_investment_status',
+    'update_investment_income',
+    'update_investment_multiplier',
+    'get_stocks',
+    'get_stocks_delta',
+    'make_stocks',
+    'update_market_capacity',
+    'make_auto_green_investment',
+    'calculate_cycle',
+    'write_cycle',
+    'finish_cycle',
+    'reinit_game',
+])
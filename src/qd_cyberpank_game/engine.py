@@ -1,75 +1,155 @@
 from datetime import datetime
-from typing import Any, Dict, Optional, Tuple
+from typing import Optional, Tuple
 
 import numpy as np
 import pandas as pd
 
+from qd_cyberpank_game.metrics import instrument_module
 
-def calculate_investments(investments_df: pd.DataFrame, markets_df: pd.DataFrame, fund_speed: float):
+# intra-cycle quote times
+QUOTE_POINTS = np.array([0.2, 0.4, 0.6, 0.8, 1.0])
+# share of the invested money that is left in the market capacity as a jackpot: invested / JACKPOT_DIVISOR
+JACKPOT_DIVISOR = 2.0
+
+
+def calculate_investments(
+    investments_df: pd.DataFrame,
+    markets_df: pd.DataFrame,
+    fund_speed: float,
+    now: Optional[datetime] = None,
+    jackpot_divisor: float = JACKPOT_DIVISOR,
+):
     approved_invest_bids = investments_df[(investments_df['status'] == 1) & investments_df['income'].isnull()].copy()
     if approved_invest_bids.empty:
         return None
 
-    approved_invest_bids['duration'] = datetime.now() - approved_invest_bids['timestamp_approved']
+    # bids are funded from approval until settlement time, which simulations can move forward
+    approved_invest_bids['duration'] = (now or datetime.now()) - approved_invest_bids['timestamp_approved']
     approved_invest_bids['funded_amount'] = fund_speed * approved_invest_bids['duration'].dt.seconds / 60
     approved_invest_bids['funded_amount'] = approved_invest_bids['multiplier'] * approved_invest_bids[['funded_amount', 'amount']].min(axis=1)
 
-    markets = approved_invest_bids['market'].unique().tolist()
-    market_incomes = []
-    new_market_capacities = {}
-    for market in markets:
-        market_bids = approved_invest_bids[approved_invest_bids['market'] == market]
-        bid_ids = market_bids['id'].tolist()
-        uids = market_bids['uid'].tolist()
-        funded_amounts = market_bids['funded_amount'].values
-        market_capacity = markets_df.loc[markets_df['name'] == market, 'capacity'].item()
-        min_market_capacity = markets_df.loc[markets_df['name'] == market, 'min_capacity'].item()
-        incomes, new_market_capacity = calculate_market(funded_amounts, market_capacity, min_market_capacity)
-        for bid_id, uid, income in zip(bid_ids, uids, incomes):
-            market_incomes.append({
-                'bid_id': bid_id,
-                'uid': uid,
-                'market': market,
-                'income': income,
-            })
-        new_market_capacities[market] = new_market_capacity
-    return market_incomes, new_market_capacities
-
-
-def calculate_market(x: np.ndarray, capacity: float, min_capacity: float) -> Tuple[np.ndarray, float]:
+    # markets are numbered in order of appearance, every array below is indexed by these codes
+    market_codes, markets = pd.factorize(approved_invest_bids['market'])
+    market_info = markets_df.set_index('name').reindex(markets)
+    unknown_markets = markets[market_info['capacity'].isnull().values]
+    if len(unknown_markets) > 0:
+        raise ValueError(f"Unknown markets in investment bids: {', '.join(unknown_markets)}")
+    incomes, new_capacities = calculate_markets(
+        approved_invest_bids['funded_amount'].values.astype(float),
+        market_codes,
+        market_info['capacity'].values.astype(float),
+        market_info['min_capacity'].values.astype(float),
+        jackpot_divisor,
+    )
+    market_incomes = pd.DataFrame({
+        'bid_id': approved_invest_bids['id'].values,
+        'uid': approved_invest_bids['uid'].values,
+        'market': approved_invest_bids['market'].values,
+        'income': incomes,
+        'funded_amount': approved_invest_bids['funded_amount'].values.astype(float),
+    })
+    return market_incomes, pd.Series(new_capacities, index=markets, name='capacity')
+
+
+def calculate_market(
+    x: np.ndarray,
+    capacity: float,
+    min_capacity: float,
+    jackpot_divisor: float = JACKPOT_DIVISOR,
+) -> Tuple[np.ndarray, float]:
     p = x / x.sum()
     p[p == 1] -= 1e-12
     y = (1 - np.square(p).sum()) / (1 - p) * x
     incomes = np.minimum(y - x, capacity)
-    jackpot = x.sum() / 2
+    jackpot = x.sum() / jackpot_divisor
     new_capacity = np.maximum(capacity + jackpot - incomes.max(), min_capacity)
     return incomes, new_capacity
 
 
-def generate_stocks(market_incomes: Optional[list[Dict[str, Any]]], stocks_df: pd.DataFrame, users_df: pd.DataFrame, cycle: int) -> pd.DataFrame:
-    xs = np.array([0.2, 0.4, 0.6, 0.8, 1.0])
-    ticket_incomes = {}
+def calculate_markets(
+    x: np.ndarray,
+    market_codes: np.ndarray,
+    capacities: np.ndarray,
+    min_capacities: np.ndarray,
+    jackpot_divisor: float = JACKPOT_DIVISOR,
+) -> Tuple[np.ndarray, np.ndarray]:
+    # calculate_market for all markets at once: per-market sums are segment sums over market codes
+    n_markets = len(capacities)
+    totals = np.bincount(market_codes, weights=x, minlength=n_markets)
+    p = x / totals[market_codes]
+    p[p == 1] -= 1e-12
+    squares = np.bincount(market_codes, weights=np.square(p), minlength=n_markets)
+    y = (1 - squares[market_codes]) / (1 - p) * x
+    incomes = np.minimum(y - x, capacities[market_codes])
+    jackpots = totals / jackpot_divisor
+    max_incomes = np.full(n_markets, -np.inf)
+    np.maximum.at(max_incomes, market_codes, incomes)
+    new_capacities = np.maximum(capacities + jackpots - max_incomes, min_capacities)
+    return incomes, new_capacities
+
+
+def calculate_market_batch(
+    x: np.ndarray,
+    mask: np.ndarray,
+    capacities: np.ndarray,
+    min_capacities: np.ndarray,
+    jackpot_divisor: float = JACKPOT_DIVISOR,
+) -> Tuple[np.ndarray, np.ndarray]:
+    # calculate_markets for independent scenarios: one row per market, players padded to the widest row;
+    # the real cells are flattened with their row as the market code, padded cells (mask == False) get zero income
+    rows, columns = np.nonzero(mask)
+    market_incomes, new_capacities = calculate_markets(x[rows, columns], rows, capacities, min_capacities, jackpot_divisor)
+    incomes = np.zeros(mask.shape)
+    incomes[rows, columns] = market_incomes
+    return incomes, new_capacities
+
+
+def cycle_rng(cycle: int, seed: Optional[int] = None) -> np.random.Generator:
+    # the same (seed, cycle) pair always replays the same quotes, no seed means fresh OS entropy
+    return np.random.default_rng(None if seed is None else [seed, cycle])
+
+
+def get_last_prices(stocks_df: pd.DataFrame) -> pd.Series:
+    last_rows = stocks_df.loc[stocks_df.groupby('ticket', sort=False)['cycle'].idxmax()]
+    return pd.Series(last_rows['price'].values, index=last_rows['ticket'].values, name='price')
+
+
+def generate_stocks(
+    market_incomes: Optional[pd.DataFrame],
+    stocks_df: pd.DataFrame,
+    users_df: pd.DataFrame,
+    cycle: int,
+    rng: Optional[np.random.Generator] = None,
+    last_prices: Optional[pd.Series] = None,
+) -> pd.DataFrame:
+    rng = rng if rng is not None else np.random.default_rng()
+    last_prices = last_prices if last_prices is not None else get_last_prices(stocks_df)
     if market_incomes is None:
-        ticket_incomes = {ticket: 0 for ticket in users_df['ticket']}
+        ticket_incomes = pd.Series(0.0, index=pd.unique(users_df['ticket']))
     else:
-        for market_income in market_incomes:
-            ticket = users_df.loc[users_df['uid'] == market_income['uid'], 'ticket'].item()
-            if ticket not in ticket_incomes:
-                ticket_incomes[ticket] = market_income['income']
-            else:
-                ticket_incomes[ticket] += market_income['income']
-    stocks_df = stocks_df.sort_values('cycle')
-    last_price = stocks_df.groupby('ticket')['price'].last().to_dict()
-    partial_stocks_df = []
-    for ticket, income in ticket_incomes.items():
-        inner_points = np.sort(np.random.rand(4))
-        inner_points = np.insert(inner_points, 0, 0)
-        inner_points = np.insert(inner_points, 5, 1)
-        deltas = np.diff(inner_points)
-        income_rel = income / 5000000
-        stocks_points = 5 * (income_rel * deltas + np.random.normal(0, 1, size=5))
-        partial_stock_df = pd.DataFrame({'cycle': xs + cycle})
-        partial_stock_df['ticket'] = ticket
-        partial_stock_df['price'] = stocks_points + last_price[ticket]
-        partial_stocks_df.append(partial_stock_df)
-    return pd.concat(partial_stocks_df)
+        uid_tickets = users_df.set_index('uid')['ticket']
+        income_tickets = uid_tickets.reindex(market_incomes['uid'].values)
+        if income_tickets.isnull().any():
+            unknown_uids = income_tickets.index[income_tickets.isnull()].unique()
+            raise ValueError(f"Unknown uids in market incomes: {', '.join(unknown_uids)}")
+        ticket_incomes = pd.Series(market_incomes['income'].values, dtype=float).groupby(income_tickets.values, sort=False).sum()
+    tickets = ticket_incomes.index.values
+    ticket_last_prices = last_prices.reindex(tickets)
+    if ticket_last_prices.isnull().any():
+        raise ValueError(f"No previous quotes for tickets: {', '.join(tickets[ticket_last_prices.isnull().values])}")
+
+    # one row per ticket: 4 sorted random cuts of the cycle split its income into 5 quote deltas
+    n_points = len(QUOTE_POINTS)
+    inner_points = np.sort(rng.random((len(tickets), n_points - 1)), axis=1)
+    deltas = np.diff(inner_points, prepend=0, append=1, axis=1)
+    income_rel = ticket_incomes.values / 5000000
+    stocks_points = 5 * (income_rel[:, np.newaxis] * deltas + rng.normal(0, 1, size=(len(tickets), n_points)))
+    prices = stocks_points + ticket_last_prices.values[:, np.newaxis]
+    return pd.DataFrame({
+        'cycle': np.tile(QUOTE_POINTS + cycle, len(tickets)),
+        'ticket': np.repeat(tickets, n_points),
+        'price': prices.ravel(),
+    })
+
+
+instrument_module(globals(), 'engine', ['calculate_investments', 'generate_stocks'])
@@ -0,0 +1,72 @@
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class MarketGraph:
+    # markets get compact ids 0..V-1 in load order; links are undirected for unlocking, so the CSR adjacency
+    # (indptr/indices) stores every link in both directions; loaded once per game and shared read-only
+    def __init__(self, names: Sequence[str], sources: Sequence[int], targets: Sequence[int]):
+        self.names = np.asarray(names, dtype=object)
+        self.index = {name: market_id for market_id, name in enumerate(self.names)}
+        self.sources = np.asarray(sources, dtype=np.int64)
+        self.targets = np.asarray(targets, dtype=np.int64)
+        n_markets = len(self.names)
+        heads = np.concatenate([self.sources, self.targets])
+        tails = np.concatenate([self.targets, self.sources])
+        order = np.argsort(heads, kind='stable')
+        self.indices = tails[order]
+        self.indptr = np.zeros(n_markets + 1, dtype=np.int64)
+        np.cumsum(np.bincount(heads, minlength=n_markets), out=self.indptr[1:])
+        # head of every adjacency entry, saves a repeat() on each unlock query
+        self.heads = heads[order]
+
+    @classmethod
+    def from_frames(cls, markets_df: pd.DataFrame, links_df: pd.DataFrame) -> 'MarketGraph':
+        # markets_df has database ids in 'id' and names in 'name', links_df has database ids in 'source'/'target';
+        # links to unknown markets are dropped
+        market_ids = pd.Index(markets_df['id'])
+        sources = market_ids.get_indexer(links_df['source'])
+        targets = market_ids.get_indexer(links_df['target'])
+        known = (sources >= 0) & (targets >= 0)
+        return cls(markets_df['name'].tolist(), sources[known], targets[known])
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def n_links(self) -> int:
+        return len(self.sources)
+
+    def ids(self, markets: Iterable[str]) -> np.ndarray:
+        return np.array([self.index[market] for market in markets if market in self.index], dtype=np.int64)
+
+    def neighbours(self, market: str) -> List[str]:
+        market_id = self.index[market]
+        return self.names[self.indices[self.indptr[market_id]:self.indptr[market_id + 1]]].tolist()
+
+    def links(self) -> List[Tuple[str, str]]:
+        return list(zip(self.names[self.sources].tolist(), self.names[self.targets].tolist()))
+
+    def unlocked_mask(self, green: np.ndarray) -> np.ndarray:
+        # both ends of every link touching a green market, O(V + E) over the adjacency arrays
+        unlocked = np.zeros(len(self.names), dtype=bool)
+        touching_green = green[self.heads]
+        unlocked[self.heads[touching_green]] = True
+        unlocked[self.indices[touching_green]] = True
+        return unlocked
+
+    def unlocked_markets(self, green_markets: Iterable[str], home_market: Optional[str] = None) -> List[str]:
+        green = np.zeros(len(self.names), dtype=bool)
+        green[self.ids(green_markets)] = True
+        unlocked_markets = set(self.names[self.unlocked_mask(green)].tolist())
+        if home_market is not None:
+            unlocked_markets.add(home_market)
+        return sorted(unlocked_markets)
+
+
+def get_green_markets(investments_df: pd.DataFrame) -> List[str]:
+    # the first approved bid of a market decides its color on the graph
+    approved = investments_df[investments_df['status'] == 1].drop_duplicates('market')
+    return approved.loc[approved['income'] > 0, 'market'].tolist()
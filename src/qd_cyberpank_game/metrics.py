@@ -0,0 +1,203 @@
+import bisect
+import functools
+import inspect
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from qd_cyberpank_game.structures import SettlementPhase
+
+# seconds, upper bounds of the Prometheus buckets; most db.py reads take milliseconds, settlement takes seconds
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# game cycles whose per-operation totals are kept for the slowest operations panel
+KEPT_CYCLES = 3
+PROMETHEUS_PREFIX = 'qd_game_operation'
+
+
+def result_size(value: Any) -> Tuple[Optional[int], Optional[int]]:
+    # rows and bytes of a returned frame, array or list, tuples are summed; ints and settlement phases returned by write
+    # paths count written rows. Bytes are the shallow memory usage, deep=True would scan every string of object columns
+    if isinstance(value, pd.DataFrame):
+        return len(value), int(value.memory_usage(index=True, deep=False).sum())
+    if isinstance(value, pd.Series):
+        return len(value), int(value.memory_usage(index=True, deep=False))
+    if isinstance(value, np.ndarray):
+        return (len(value) if value.ndim else 1), value.nbytes
+    if isinstance(value, list) and value and all(isinstance(item, SettlementPhase) for item in value):
+        return sum(phase.rows for phase in value), None
+    if isinstance(value, list):
+        return len(value), None
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value, None
+    if isinstance(value, tuple):
+        sizes = [result_size(item) for item in value if isinstance(item, (pd.DataFrame, pd.Series, np.ndarray, list))]
+        rows = [size[0] for size in sizes if size[0] is not None]
+        nbytes = [size[1] for size in sizes if size[1] is not None]
+        return (sum(rows) if rows else None), (sum(nbytes) if nbytes else None)
+    return None, None
+
+
+class OperationMetrics:
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.buckets = buckets
+        # per bucket, not cumulative; the last slot counts calls slower than every bucket
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+
+    def observe(self, seconds: float, rows: Optional[int], nbytes: Optional[int], error: bool) -> None:
+        self.bucket_counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.errors += error
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.rows += rows or 0
+        self.bytes += nbytes or 0
+
+    def cumulative_buckets(self) -> List[Tuple[str, int]]:
+        counts = np.cumsum(self.bucket_counts).tolist()
+        return [(repr(bound), count) for bound, count in zip(self.buckets, counts)] + [('+Inf', counts[-1])]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'seconds': self.seconds,
+            'max_seconds': self.max_seconds,
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'buckets': dict(self.cumulative_buckets()),
+        }
+
+
+class MetricsRegistry:
+    # process-wide like SHARED_CACHE: every streamlit session and the loader threads record into one registry
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS, kept_cycles: int = KEPT_CYCLES):
+        self.buckets = buckets
+        self.kept_cycles = kept_cycles
+        self.enabled = True
+        self.cycle: Optional[int] = None
+        self._operations: Dict[str, OperationMetrics] = {}
+        self._cycles: 'OrderedDict[Optional[int], Dict[str, OperationMetrics]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_cycle(self, cycle: int) -> None:
+        # the game cycle the following calls are attributed to, set by the version probe of update_game_state
+        with self._lock:
+            self.cycle = cycle
+
+    def observe(self, operation: str, seconds: float, rows: Optional[int] = None, nbytes: Optional[int] = None, error: bool = False) -> None:
+        with self._lock:
+            if self.cycle not in self._cycles:
+                self._cycles[self.cycle] = {}
+                while len(self._cycles) > self.kept_cycles:
+                    self._cycles.popitem(last=False)
+            for operations in (self._operations, self._cycles[self.cycle]):
+                if operation not in operations:
+                    operations[operation] = OperationMetrics(self.buckets)
+                operations[operation].observe(seconds, rows, nbytes, error)
+
+    def instrument(self, func: Callable, operation: str) -> Callable:
+        @functools.wraps(func)
+        def instrumented(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                self.observe(operation, time.perf_counter() - start, error=True)
+                raise
+            elapsed = time.perf_counter() - start
+            rows, nbytes = result_size(result)
+            self.observe(operation, elapsed, rows, nbytes)
+            return result
+        return instrumented
+
+    def slowest(self, cycle: Optional[int] = None, limit: int = 15) -> pd.DataFrame:
+        # operations of one cycle (all cycles by default) by total time
+        with self._lock:
+            operations = self._operations if cycle is None else self._cycles.get(cycle, {})
+            rows = [
+                {
+                    'operation': operation,
+                    'calls': metrics.count,
+                    'total_s': metrics.seconds,
+                    'mean_ms': metrics.seconds / metrics.count * 1000,
+                    'max_ms': metrics.max_seconds * 1000,
+                    'rows': metrics.rows,
+                    'bytes': metrics.bytes,
+                    'errors': metrics.errors,
+                }
+                for operation, metrics in operations.items()
+            ]
+        columns = ['operation', 'calls', 'total_s', 'mean_ms', 'max_ms', 'rows', 'bytes', 'errors']
+        return pd.DataFrame(rows, columns=columns).sort_values('total_s', ascending=False).head(limit).reset_index(drop=True)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'buckets': list(self.buckets),
+                'operations': {operation: metrics.to_dict() for operation, metrics in self._operations.items()},
+                'cycles': {
+                    str(cycle): {operation: metrics.to_dict() for operation, metrics in operations.items()}
+                    for cycle, operations in self._cycles.items()
+                },
+            }
+
+    def dump_json(self, path: str) -> None:
+        with open(path, 'w') as json_file:
+            json.dump(self.to_dict(), json_file, indent=2)
+
+    def to_prometheus(self) -> str:
+        # text exposition format: one duration histogram and row/byte/error counters per operation
+        with self._lock:
+            operations = sorted(self._operations.items())
+            lines = [
+                f'# HELP {PROMETHEUS_PREFIX}_seconds Duration of instrumented db.py and engine.py calls.',
+                f'# TYPE {PROMETHEUS_PREFIX}_seconds histogram',
+            ]
+            for operation, metrics in operations:
+                for bound, count in metrics.cumulative_buckets():
+                    lines.append(f'{PROMETHEUS_PREFIX}_seconds_bucket{{operation="{operation}",le="{bound}"}} {count}')
+                lines.append(f'{PROMETHEUS_PREFIX}_seconds_sum{{operation="{operation}"}} {metrics.seconds!r}')
+                lines.append(f'{PROMETHEUS_PREFIX}_seconds_count{{operation="{operation}"}} {metrics.count}')
+            for counter, help_text in (
+                ('rows', 'Rows returned or written by instrumented calls.'),
+                ('bytes', 'Shallow size of frames and arrays returned by instrumented calls.'),
+                ('errors', 'Instrumented calls that raised.'),
+            ):
+                lines.append(f'# HELP {PROMETHEUS_PREFIX}_{counter}_total {help_text}')
+                lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{counter}_total counter')
+                for operation, metrics in operations:
+                    lines.append(f'{PROMETHEUS_PREFIX}_{counter}_total{{operation="{operation}"}} {getattr(metrics, counter)}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self) -> None:
+        with self._lock:
+            self._operations.clear()
+            self._cycles.clear()
+
+
+METRICS = MetricsRegistry()
+
+
+def instrument_module(namespace: Dict[str, Any], prefix: str, names: Sequence[str], registry: MetricsRegistry = METRICS) -> None:
+    # wraps the listed functions of the module owning namespace (called as instrument_module(globals(), ...)), meant
+    # for I/O and settlement entry points: statement builders and per-row helpers would only add overhead and noise.
+    # Calls inside the module go through the wrappers as well
+    module_name = namespace['__name__']
+    for name in names:
+        value = namespace.get(name)
+        if not inspect.isfunction(value) or value.__module__ != module_name:
+            raise ValueError(f'{module_name} defines no function {name} to instrument')
+        namespace[name] = registry.instrument(value, f'{prefix}.{name}')
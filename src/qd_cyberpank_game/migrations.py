@@ -0,0 +1,203 @@
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import Column, Index, MetaData, Table, and_, delete, func, insert, inspect, select, union, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.sql import ClauseElement
+
+from qd_cyberpank_game.db import (auth_stmt, balance_stmt, bulk_insert, closing_prices_stmt, current_cycle_stmt, cycle_investments_stmt,
+                                  game_version_stmt, market_history_stmt, rebuild_balances, stocks_stmt, transactions_stmt)
+from qd_cyberpank_game.replay import (CHUNK_CYCLES, bids_chunk_stmt, checkpoint_cycle_stmt, checkpoint_stmt, cycles_chunk_stmt,
+                                      ledger_chunk_stmt, quotes_chunk_stmt, snapshots_chunk_stmt)
+from qd_cyberpank_game.schema import (HOT_PATH_INDEXES, balance_snapshots_table, balances_table, cycle_balances_table, cycles_table,
+                                      investments_table, market_links_table, market_snapshots_table, markets_table, metadata,
+                                      price_snapshots_table, replay_checkpoints_table, schema_migrations_table, stocks_table, transactions_table,
+                                      unlock_snapshots_table, users_table)
+from qd_cyberpank_game.structures import IndexSpec, Migration, QueryPlan
+
+# sqlite prints "SCAN t" (or "SCAN TABLE t" before 3.36), index scans carry a USING clause
+SQLITE_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)(.*)$')
+# an index used with search terms, e.g. USING INDEX ix_cycles_timestamp (timestamp=?); without terms it is scanned whole
+SQLITE_INDEX_LOOKUP_RE = re.compile(r'USING .*INDEX \w+ \(.+\)')
+# full table and full index scans
+MYSQL_SCAN_TYPES = ('ALL', 'index')
+# hot queries reading a whole table by design, their scans of it are shown in the plan but do not fail the check
+FULL_READS = {'get_market_history': {'market_snapshots'}}
+
+# every migration creates the indexes listed here as of its version, later schema changes get a migration of their own
+INDEXES_V2 = [
+    IndexSpec('users', 'ix_users_login', ('login',), unique=True),
+    IndexSpec('cycles', 'ix_cycles_timestamp', ('timestamp',)),
+    IndexSpec('stocks', 'ix_stocks_cycle', ('cycle',)),
+    IndexSpec('stocks', 'ix_stocks_ticket_cycle', ('ticket', 'cycle')),
+    IndexSpec('transactions', 'ix_transactions_from', ('from_',)),
+    IndexSpec('transactions', 'ix_transactions_to', ('to_',)),
+    IndexSpec('markets', 'ix_markets_name', ('name',), unique=True),
+    IndexSpec('investments', 'ix_investments_cycle_uid', ('cycle', 'uid')),
+]
+INDEXES_V5 = [IndexSpec('transactions', 'ix_transactions_cycle', ('cycle',))]
+INDEXES_V6 = [IndexSpec('investments', 'ix_investments_timestamp_approved', ('timestamp_approved',))]
+INDEXES_V7 = [
+    IndexSpec('balance_snapshots', 'ix_balance_snapshots_cycle', ('cycle',)),
+    IndexSpec('market_snapshots', 'ix_market_snapshots_cycle', ('cycle',)),
+    IndexSpec('price_snapshots', 'ix_price_snapshots_cycle', ('cycle',)),
+    IndexSpec('unlock_snapshots', 'ix_unlock_snapshots_cycle', ('cycle',)),
+]
+
+
+def create_ledger_tables(conn: Connection) -> None:
+    metadata.create_all(conn, tables=[balances_table, cycle_balances_table])
+    if conn.execute(select(func.count()).select_from(balances_table)).scalar() == 0:
+        balances_df, cycle_balances_df = rebuild_balances(conn, transactions_table)
+        bulk_insert(conn, balances_table, balances_df)
+        bulk_insert(conn, cycle_balances_table, cycle_balances_df)
+
+
+def create_indexes(conn: Connection, index_specs: List[IndexSpec]) -> None:
+    # built on bare tables, so the declared schema is neither consulted nor extended
+    inspector = inspect(conn)
+    for spec in index_specs:
+        if spec.name not in {existing_index['name'] for existing_index in inspector.get_indexes(spec.table)}:
+            table = Table(spec.table, MetaData(), *[Column(column) for column in spec.columns])
+            Index(spec.name, *[table.c[column] for column in spec.columns], unique=spec.unique).create(conn)
+
+
+def create_market_links(conn: Connection) -> None:
+    metadata.create_all(conn, tables=[market_links_table])
+    if conn.execute(select(func.count()).select_from(market_links_table)).scalar() == 0:
+        # links pointing to missing markets are dropped, duplicates of link1/link2 collapse in the union
+        targets = markets_table.alias('targets')
+        links = union(*[
+            select(markets_table.c.id.label('source'), targets.c.id.label('target')).select_from(
+                markets_table.join(targets, and_(link_column == targets.c.id, link_column != markets_table.c.id)),
+            )
+            for link_column in (markets_table.c.link1, markets_table.c.link2)
+        ])
+        conn.execute(insert(market_links_table).from_select(['source', 'target'], links))
+
+
+def create_snapshot_tables(conn: Connection) -> None:
+    # history starts with the first cycle settled after the upgrade
+    metadata.create_all(conn, tables=[balance_snapshots_table, market_snapshots_table, price_snapshots_table, unlock_snapshots_table])
+
+
+def create_replay_support(conn: Connection) -> None:
+    existing_columns = {column['name'] for column in inspect(conn).get_columns(investments_table.name)}
+    if investments_table.c.funded_amount.name not in existing_columns:
+        column_type = investments_table.c.funded_amount.type.compile(dialect=conn.dialect)
+        conn.exec_driver_sql(f'ALTER TABLE {investments_table.name} ADD COLUMN {investments_table.c.funded_amount.name} {column_type}')
+    metadata.create_all(conn, tables=[replay_checkpoints_table])
+    # the replay streams transactions by cycle
+    create_indexes(conn, INDEXES_V5)
+
+
+MIGRATIONS = [
+    Migration(version=1, description='ledger tables filled from transactions', upgrade=create_ledger_tables),
+    Migration(version=2, description='indexes for hot query patterns', upgrade=lambda conn: create_indexes(conn, INDEXES_V2)),
+    Migration(version=3, description='market_links filled from markets.link1/link2', upgrade=create_market_links),
+    Migration(version=4, description='per-cycle snapshot tables', upgrade=create_snapshot_tables),
+    Migration(version=5, description='funded amounts of bids, replay checkpoints, transactions cycle index', upgrade=create_replay_support),
+    Migration(version=6, description='investments approval time index for the version probe', upgrade=lambda conn: create_indexes(conn, INDEXES_V6)),
+    Migration(version=7, description='snapshot cycle indexes for settlement rewrites and the replay', upgrade=lambda conn: create_indexes(conn, INDEXES_V7)),
+]
+
+
+def get_schema_version(engine: Engine) -> int:
+    schema_migrations_table.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        version = conn.execute(select(func.max(schema_migrations_table.c.version))).scalar()
+    return version or 0
+
+
+def migrate(engine: Engine, target_version: Optional[int] = None) -> List[Migration]:
+    # every migration and its version row are committed together
+    current_version = get_schema_version(engine)
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= current_version or (target_version is not None and migration.version > target_version):
+            continue
+        with engine.begin() as conn:
+            migration.upgrade(conn)
+            conn.execute(insert(schema_migrations_table).values(
+                version=migration.version,
+                description=migration.description,
+                applied_at=datetime.now(),
+            ))
+        applied.append(migration)
+    return applied
+
+
+def missing_indexes(engine: Engine) -> List[str]:
+    inspector = inspect(engine)
+    missing = []
+    for index in HOT_PATH_INDEXES:
+        if index.name not in {existing_index['name'] for existing_index in inspector.get_indexes(index.table.name)}:
+            missing.append(f'{index.table.name}.{index.name}')
+    return missing
+
+
+def hot_queries(conn: Connection) -> List[Tuple[str, ClauseElement]]:
+    # the filtered statements of db.py, parametrized with real values from the database
+    sample_user = conn.execute(select(users_table.c.uid, users_table.c.login).where(users_table.c.uid != 'root').limit(1)).first()
+    uid, login = sample_user if sample_user is not None else ('uid', 'login')
+    cycle = conn.execute(select(func.max(cycles_table.c.cycle))).scalar() or 1
+    last_stock_id = conn.execute(select(func.max(stocks_table.c.id))).scalar() or 0
+    market = conn.execute(select(markets_table.c.name).limit(1)).scalar() or 'market'
+    # the replay reads a chunk of cycles at a time, the last one of them is checked
+    first_cycle = max(cycle - CHUNK_CYCLES + 1, 0)
+    snapshot_tables = [balance_snapshots_table, market_snapshots_table, price_snapshots_table, unlock_snapshots_table]
+    replayed_snapshots = [(balance_snapshots_table, 'uid', 'balance'), (market_snapshots_table, 'market', 'capacity'), (price_snapshots_table, 'ticket', 'price')]
+    return [
+        ('auth', auth_stmt(login, 'password-hash', users_table)),
+        ('get_current_cycle', current_cycle_stmt(cycles_table)),
+        ('get_game_version', game_version_stmt(cycles_table, transactions_table, stocks_table, investments_table)),
+        ('get_transactions', transactions_stmt(uid, transactions_table)),
+        ('get_stocks_delta', stocks_stmt(stocks_table).where(stocks_table.c.id > last_stock_id // 2)),
+        ('get_cycle_investments', cycle_investments_stmt(uid, cycle, investments_table)),
+        ('get_cycle_investments_root', cycle_investments_stmt('root', cycle, investments_table)),
+        ('get_balance', balance_stmt(uid, cycle, balances_table, cycle_balances_table)),
+        ('update_market_capacity', update(markets_table).where(markets_table.c.name == market).values(capacity=0)),
+        ('update_investment_status', update(investments_table).where(investments_table.c.id == 1).values(status=1)),
+        ('closing_prices', closing_prices_stmt(cycle, price_snapshots_table)),
+        ('get_market_history', market_history_stmt(market_snapshots_table)),
+        *[(f'write_snapshots_{table.name}', delete(table).where(table.c.cycle == cycle)) for table in snapshot_tables],
+        ('replay_ledger_chunk', ledger_chunk_stmt(first_cycle, cycle, transactions_table)),
+        ('replay_bids_chunk', bids_chunk_stmt(first_cycle, cycle, investments_table)),
+        ('replay_quotes_chunk', quotes_chunk_stmt(first_cycle, cycle, stocks_table)),
+        ('replay_cycles_chunk', cycles_chunk_stmt(first_cycle, cycle, cycles_table)),
+        *[
+            (f'replay_{table.name}_chunk', snapshots_chunk_stmt(first_cycle, cycle, table, key_column, value_column))
+            for table, key_column, value_column in replayed_snapshots
+        ],
+        ('replay_checkpoint_cycle', checkpoint_cycle_stmt(cycle, replay_checkpoints_table)),
+        ('replay_checkpoint', checkpoint_stmt(cycle, replay_checkpoints_table)),
+    ]
+
+
+def explain(conn: Connection, name: str, stmt: ClauseElement) -> QueryPlan:
+    sql = str(stmt.compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True}))
+    table_names = set(metadata.tables)
+    if conn.dialect.name == 'sqlite':
+        plan = [row[-1] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}').fetchall()]
+        full_scans = []
+        for step in plan:
+            match = SQLITE_SCAN_RE.match(step)
+            if match and match.group(1) in table_names and not SQLITE_INDEX_LOOKUP_RE.search(match.group(2)):
+                full_scans.append(match.group(1))
+    elif conn.dialect.name == 'mysql':
+        rows = [dict(row._mapping) for row in conn.exec_driver_sql(f'EXPLAIN {sql}').fetchall()]
+        plan = [f"{row['table']}: type={row['type']} key={row['key']} rows={row['rows']}" for row in rows]
+        full_scans = [row['table'] for row in rows if row['type'] in MYSQL_SCAN_TYPES and row['table'] in table_names]
+    else:
+        raise NotImplementedError(f'EXPLAIN checks are not implemented for {conn.dialect.name}')
+    full_reads = FULL_READS.get(name, set())
+    return QueryPlan(name=name, sql=sql, plan=plan, full_scans=[table for table in full_scans if table not in full_reads])
+
+
+def explain_hot_queries(engine: Engine) -> List[QueryPlan]:
+    with engine.connect() as conn:
+        if conn.dialect.name == 'sqlite':
+            # planner statistics, as a long running MySQL instance would have them
+            conn.exec_driver_sql('ANALYZE')
+        return [explain(conn, name, stmt) for name, stmt in hot_queries(conn)]
@@ -0,0 +1,247 @@
+from typing import Any, Dict, List, Mapping, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import MetaData, Table, delete, func, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql import Select
+
+from qd_cyberpank_game.db import DEFAULT_CAPACITY, START_CAPATICY, bulk_insert, get_engine, ledger_deltas
+from qd_cyberpank_game.engine import calculate_markets
+from qd_cyberpank_game.structures import ReplayState
+
+# cycles replayed per round of range queries, bounds the memory of a replay whatever the length of the game
+CHUNK_CYCLES = 50
+CHECKPOINT_EVERY = 10
+# reinit_game writes cycles -1 and 0, a replay without checkpoints folds both into cycle 0
+FIRST_CYCLE = 0
+MISMATCH_COLUMNS = ['cycle', 'kind', 'name', 'replayed', 'stored']
+
+
+def ledger_chunk_stmt(first_cycle: Optional[int], last_cycle: int, transactions_table: Table) -> Select:
+    # summed per (from_, to_, cycle) like rebuild_balances, the raw transactions never leave the database
+    cols = transactions_table.c
+    stmt = select(cols.from_, cols.to_, cols.cycle, func.sum(cols.amount).label('amount')).where(cols.cycle <= last_cycle)
+    if first_cycle is not None:
+        stmt = stmt.where(cols.cycle >= first_cycle)
+    return stmt.group_by(cols.from_, cols.to_, cols.cycle)
+
+
+def bids_chunk_stmt(first_cycle: int, last_cycle: int, investments_table: Table) -> Select:
+    # settled bids only: approved and paid out
+    cols = investments_table.c
+    stmt = select(
+        cols.id, cols.market, cols.amount, cols.timestamp_approved, cols.cycle, cols.income, cols.multiplier, cols.funded_amount,
+    )
+    stmt = stmt.where(cols.cycle.between(first_cycle, last_cycle), cols.status == 1, cols.income.isnot(None))
+    return stmt.order_by(cols.cycle, cols.id)
+
+
+def quotes_chunk_stmt(first_cycle: Optional[int], last_cycle: int, stocks_table: Table) -> Select:
+    # quotes of cycle c are stamped c + QUOTE_POINTS, the one at c + 1 closes it
+    cols = stocks_table.c
+    stmt = select(cols.ticket, cols.cycle, cols.price).where(cols.cycle <= last_cycle + 1)
+    if first_cycle is not None:
+        stmt = stmt.where(cols.cycle > first_cycle)
+    return stmt.order_by(cols.cycle, cols.id)
+
+
+def cycles_chunk_stmt(first_cycle: int, last_cycle: int, cycles_table: Table) -> Select:
+    cols = cycles_table.c
+    return select(cols.cycle, cols.timestamp, cols.fund_speed).where(cols.cycle.between(first_cycle, last_cycle + 1))
+
+
+def snapshots_chunk_stmt(first_cycle: int, last_cycle: int, snapshots_table: Table, key_column: str, value_column: str) -> Select:
+    cols = snapshots_table.c
+    stmt = select(cols.cycle, cols[key_column].label('name'), cols[value_column].label('value'))
+    return stmt.where(cols.cycle.between(first_cycle, last_cycle))
+
+
+def read_frame(conn: Connection, stmt: Select, float_columns: List[str]) -> pd.DataFrame:
+    frame = pd.DataFrame(conn.execute(stmt).fetchall(), columns=[col.name for col in stmt.selected_columns])
+    return frame.astype({column: float for column in float_columns})
+
+
+def last_settled_cycle(conn: Connection, cycles_table: Table) -> int:
+    # the current cycle is still open
+    current_cycle = conn.execute(select(func.max(cycles_table.c.cycle))).scalar()
+    return current_cycle - 1 if current_cycle is not None else FIRST_CYCLE
+
+
+def checkpoint_cycle_stmt(to_cycle: int, replay_checkpoints_table: Table) -> Select:
+    cols = replay_checkpoints_table.c
+    return select(func.max(cols.cycle)).where(cols.cycle <= to_cycle)
+
+
+def checkpoint_stmt(cycle: int, replay_checkpoints_table: Table) -> Select:
+    cols = replay_checkpoints_table.c
+    return select(cols.kind, cols.name, cols.value).where(cols.cycle == cycle)
+
+
+def load_checkpoint(conn: Connection, to_cycle: int, replay_checkpoints_table: Table) -> Optional[ReplayState]:
+    cycle = conn.execute(checkpoint_cycle_stmt(to_cycle, replay_checkpoints_table)).scalar()
+    if cycle is None:
+        return None
+    state = ReplayState(cycle=cycle, balances={}, capacities={}, prices={}, checkpoint=cycle)
+    kinds = {'balance': state.balances, 'capacity': state.capacities, 'price': state.prices}
+    for row in conn.execute(checkpoint_stmt(cycle, replay_checkpoints_table)):
+        kinds[row.kind][row.name] = float(row.value)
+    return state
+
+
+def write_checkpoint(conn: Connection, state: ReplayState, replay_checkpoints_table: Table) -> int:
+    conn.execute(delete(replay_checkpoints_table).where(replay_checkpoints_table.c.cycle == state.cycle))
+    rows = [
+        (kind, name, value)
+        for kind, values in (('balance', state.balances), ('capacity', state.capacities), ('price', state.prices))
+        for name, value in values.items()
+    ]
+    return bulk_insert(conn, replay_checkpoints_table, {
+        'cycle': [state.cycle] * len(rows),
+        'kind': [kind for kind, _, _ in rows],
+        'name': [name for _, name, _ in rows],
+        'value': [value for _, _, value in rows],
+    })
+
+
+def start_capacities(markets_df: pd.DataFrame) -> Dict[str, float]:
+    # what seed_world and reinit_game leave in the markets table
+    return {name: float(START_CAPATICY.get(name, DEFAULT_CAPACITY)) for name in markets_df['name']}
+
+
+def funded_amounts(bids_df: pd.DataFrame, cycles_df: pd.DataFrame) -> pd.Series:
+    # bids settled before funded_amount was stored are estimated like calculate_investments does,
+    # with the start of the next cycle as the settlement time
+    cycles = cycles_df.set_index('cycle')
+    settled_at = cycles['timestamp'].reindex(bids_df['cycle'].values + 1).values
+    fund_speed = cycles['fund_speed'].reindex(bids_df['cycle'].values).values
+    duration = pd.Series(pd.to_datetime(settled_at) - pd.to_datetime(bids_df['timestamp_approved']).values)
+    estimated = pd.DataFrame({'funded': fund_speed * duration.dt.seconds.values / 60, 'amount': bids_df['amount'].values})
+    estimated = bids_df['multiplier'].fillna(1.0).values * estimated.min(axis=1).values
+    return bids_df['funded_amount'].fillna(pd.Series(estimated, index=bids_df.index))
+
+
+def compare(
+    cycle: int,
+    kind: str,
+    replayed: Union[Mapping[str, float], pd.Series],
+    stored: pd.Series,
+    tolerance: float,
+    fill_value: float = np.nan,
+) -> List[Dict[str, Any]]:
+    if stored.empty:
+        return []
+    replayed = pd.Series(replayed, dtype=float)
+    names = stored.index.union(replayed.index)
+    diff = pd.DataFrame({'replayed': replayed.reindex(names, fill_value=fill_value), 'stored': stored.reindex(names, fill_value=fill_value)})
+    bad = diff['replayed'].isnull() | diff['stored'].isnull() | ((diff['replayed'] - diff['stored']).abs() > tolerance)
+    diff = diff[bad]
+    return [
+        {'cycle': cycle, 'kind': kind, 'name': str(name), 'replayed': row.replayed, 'stored': row.stored}
+        for name, row in zip(diff.index, diff.itertuples())
+    ]
+
+
+def replay_chunk(
+    conn: Connection,
+    state: ReplayState,
+    last_cycle: int,
+    markets_df: pd.DataFrame,
+    db_schema: Mapping[str, Union[MetaData, Table]],
+    tolerance: float,
+    checkpoint_every: int,
+) -> List[Dict[str, Any]]:
+    # advances state to last_cycle: one range query per log, then cycle by cycle in memory
+    fresh = state.cycle < FIRST_CYCLE
+    first_cycle = max(state.cycle + 1, FIRST_CYCLE)
+    ledger_df = read_frame(conn, ledger_chunk_stmt(None if fresh else first_cycle, last_cycle, db_schema['transactions']), ['amount'])
+    bids_df = read_frame(conn, bids_chunk_stmt(first_cycle, last_cycle, db_schema['investments']), ['amount', 'income', 'multiplier', 'funded_amount'])
+    quotes_df = read_frame(conn, quotes_chunk_stmt(None if fresh else state.cycle + 1, last_cycle, db_schema['stocks']), ['cycle', 'price'])
+    cycles_df = read_frame(conn, cycles_chunk_stmt(first_cycle, last_cycle, db_schema['cycles']), ['fund_speed'])
+    snapshots = {
+        kind: read_frame(conn, snapshots_chunk_stmt(first_cycle, last_cycle, db_schema[table], key, value), ['value'])
+        for kind, table, key, value in (
+            ('balance', 'balance_snapshots', 'uid', 'balance'),
+            ('net', 'balance_snapshots', 'uid', 'net'),
+            ('capacity', 'market_snapshots', 'market', 'capacity'),
+            ('price', 'price_snapshots', 'ticket', 'price'),
+        )
+    }
+
+    # everything before the first replayed cycle belongs to it
+    cycle_deltas = ledger_deltas(ledger_df)[1] if not ledger_df.empty else pd.DataFrame(columns=['uid', 'cycle', 'net'])
+    cycle_deltas['cycle'] = cycle_deltas['cycle'].clip(lower=first_cycle)
+    quotes_df['close_of'] = np.maximum(np.ceil(quotes_df['cycle'] - 1e-6) - 1, first_cycle).astype(int)
+    if not bids_df.empty:
+        bids_df['funded_amount'] = funded_amounts(bids_df, cycles_df)
+    min_capacities = markets_df.set_index('name')['min_capacity']
+
+    mismatches = []
+    for cycle in range(first_cycle, last_cycle + 1):
+        nets = cycle_deltas[cycle_deltas['cycle'] == cycle].groupby('uid')['net'].sum()
+        for uid, net in nets.items():
+            state.balances[uid] = state.balances.get(uid, 0.0) + net
+
+        cycle_bids = bids_df[bids_df['cycle'] == cycle]
+        if not cycle_bids.empty:
+            market_codes, markets = pd.factorize(cycle_bids['market'])
+            unknown_markets = [market for market in markets if market not in state.capacities]
+            if unknown_markets:
+                raise ValueError(f"Unknown markets in investment bids: {', '.join(unknown_markets)}")
+            incomes, new_capacities = calculate_markets(
+                cycle_bids['funded_amount'].values.astype(float),
+                market_codes,
+                np.array([state.capacities[market] for market in markets]),
+                min_capacities.reindex(markets).values.astype(float),
+            )
+            # a market funded with nothing (e.g. estimated amounts of bids approved at settlement) has no payout formula,
+            # its incomes show up as mismatches and its capacity stays as it was
+            state.capacities.update(
+                (market, capacity) for market, capacity in zip(markets, new_capacities.tolist()) if np.isfinite(capacity)
+            )
+            mismatches += compare(
+                cycle, 'income', pd.Series(incomes, index=cycle_bids['id'].values), cycle_bids.set_index('id')['income'], tolerance,
+            )
+
+        closes = quotes_df[quotes_df['close_of'] == cycle].groupby('ticket', sort=False)['price'].last()
+        state.prices.update(closes.items())
+        state.cycle = cycle
+
+        stored = {kind: frame[frame['cycle'] == cycle].set_index('name')['value'] for kind, frame in snapshots.items()}
+        mismatches += compare(cycle, 'balance', state.balances, stored['balance'], tolerance, fill_value=0.0)
+        mismatches += compare(cycle, 'net', nets, stored['net'], tolerance, fill_value=0.0)
+        mismatches += compare(cycle, 'capacity', state.capacities, stored['capacity'], tolerance)
+        mismatches += compare(cycle, 'price', state.prices, stored['price'], tolerance)
+
+        if checkpoint_every and cycle % checkpoint_every == 0:
+            write_checkpoint(conn, state, db_schema['replay_checkpoints'])
+            conn.commit()
+    return mismatches
+
+
+def replay_game(
+    db_conn_str: str,
+    db_schema: Mapping[str, Union[MetaData, Table]],
+    to_cycle: Optional[int] = None,
+    checkpoint_every: int = CHECKPOINT_EVERY,
+    chunk_cycles: int = CHUNK_CYCLES,
+    tolerance: float = 0.01,
+    use_checkpoints: bool = True,
+) -> Tuple[ReplayState, pd.DataFrame]:
+    # rebuilds balances, capacities and closing prices from the raw logs up to to_cycle (the last settled cycle by default),
+    # starting from the nearest checkpoint; mismatches list every replayed value that differs from the stored results
+    engine = get_engine(db_conn_str)
+    mismatches = []
+    with engine.connect() as conn:
+        to_cycle = to_cycle if to_cycle is not None else last_settled_cycle(conn, db_schema['cycles'])
+        if to_cycle < FIRST_CYCLE:
+            raise ValueError(f'Nothing to replay before cycle {FIRST_CYCLE}')
+        markets_stmt = select(db_schema['markets'].c.name, db_schema['markets'].c.min_capacity)
+        markets_df = read_frame(conn, markets_stmt, ['min_capacity'])
+        state = load_checkpoint(conn, to_cycle, db_schema['replay_checkpoints']) if use_checkpoints else None
+        if state is None:
+            state = ReplayState(cycle=FIRST_CYCLE - 1, balances={}, capacities=start_capacities(markets_df), prices={})
+        while state.cycle < to_cycle:
+            last_cycle = min(max(state.cycle, FIRST_CYCLE - 1) + chunk_cycles, to_cycle)
+            mismatches += replay_chunk(conn, state, last_cycle, markets_df, db_schema, tolerance, checkpoint_every)
+    return state, pd.DataFrame(mismatches, columns=MISMATCH_COLUMNS)
@@ -0,0 +1,222 @@
+from typing import Dict, List, Union
+
+from sqlalchemy import Column, DateTime, Float, Index, Integer, MetaData, Numeric, String, Table, inspect, text
+from sqlalchemy.engine import Engine
+
+# decimals on MySQL, plain floats on SQLite which has no decimal type
+MONEY = Numeric(20, 4).with_variant(Float(), 'sqlite')
+PRICE = Numeric(12, 4).with_variant(Float(), 'sqlite')
+CYCLE_POINT = Numeric(8, 2).with_variant(Float(), 'sqlite')
+
+metadata = MetaData()
+
+users_table = Table(
+    'users',
+    metadata,
+    Column('uid', String(64), primary_key=True),
+    Column('login', String(64), nullable=False),
+    Column('password', String(64), nullable=False),
+    Column('name', String(64), nullable=False),
+    Column('ticket', String(16), nullable=False),
+    Column('home_market', String(64), nullable=False),
+    Index('ix_users_login', 'login', unique=True),
+)
+
+cycles_table = Table(
+    'cycles',
+    metadata,
+    Column('cycle', Integer, primary_key=True, autoincrement=False),
+    Column('timestamp', DateTime, nullable=False),
+    Column('fund_speed', MONEY, nullable=False),
+    Index('ix_cycles_timestamp', 'timestamp'),
+)
+
+stocks_table = Table(
+    'stocks',
+    metadata,
+    Column('id', Integer, primary_key=True),
+    Column('price', PRICE, nullable=False),
+    Column('ticket', String(16), nullable=False),
+    Column('cycle', CYCLE_POINT, nullable=False),
+    Index('ix_stocks_ticket_cycle', 'ticket', 'cycle'),
+    Index('ix_stocks_cycle', 'cycle'),
+)
+
+transactions_table = Table(
+    'transactions',
+    metadata,
+    Column('id', Integer, primary_key=True),
+    Column('from_', String(64), nullable=False),
+    Column('to_', String(64), nullable=False),
+    Column('amount', MONEY, nullable=False),
+    Column('cycle', Integer, nullable=False),
+    Index('ix_transactions_from', 'from_'),
+    Index('ix_transactions_to', 'to_'),
+    Index('ix_transactions_cycle', 'cycle'),
+)
+
+markets_table = Table(
+    'markets',
+    metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(64), nullable=False),
+    Column('capacity', MONEY, nullable=False),
+    Column('min_capacity', MONEY, nullable=False),
+    # legacy fixed links, superseded by market_links and only read by the migration filling it
+    Column('link1', Integer),
+    Column('link2', Integer),
+    Index('ix_markets_name', 'name', unique=True),
+)
+
+# any number of links per market, market ids on both ends
+market_links_table = Table(
+    'market_links',
+    metadata,
+    Column('source', Integer, primary_key=True, autoincrement=False),
+    Column('target', Integer, primary_key=True, autoincrement=False),
+)
+
+investments_table = Table(
+    'investments',
+    metadata,
+    Column('id', Integer, primary_key=True),
+    Column('uid', String(64), nullable=False),
+    Column('market', String(64), nullable=False),
+    Column('amount', MONEY, nullable=False),
+    Column('timestamp_created', DateTime, nullable=False),
+    Column('timestamp_approved', DateTime),
+    Column('status', Integer),
+    Column('cycle', Integer, nullable=False),
+    Column('income', MONEY),
+    # make_investment never sets it, settlement multiplies funded amounts by it
+    Column('multiplier', MONEY, server_default=text('1')),
+    # amount actually funded by settlement time, multiplier applied; lets a replay recompute incomes exactly
+    Column('funded_amount', MONEY),
+    Index('ix_investments_cycle_uid', 'cycle', 'uid'),
+    # max(timestamp_approved) of the version probe is read from the end of the index
+    Index('ix_investments_timestamp_approved', 'timestamp_approved'),
+)
+
+balances_table = Table(
+    'balances',
+    metadata,
+    Column('uid', String(64), primary_key=True),
+    Column('balance', MONEY, nullable=False),
+)
+
+cycle_balances_table = Table(
+    'cycle_balances',
+    metadata,
+    Column('uid', String(64), primary_key=True),
+    Column('cycle', Integer, primary_key=True, autoincrement=False),
+    Column('net', MONEY, nullable=False),
+)
+
+# per-cycle snapshots written by finish_cycle in the settlement transaction, history views read them
+# instead of recomputing from the raw logs; cycle is the settled cycle. Settlement rewrites and the replay reads
+# them by cycle, which is not the leading key column, hence the cycle indexes
+balance_snapshots_table = Table(
+    'balance_snapshots',
+    metadata,
+    Column('uid', String(64), primary_key=True),
+    Column('cycle', Integer, primary_key=True, autoincrement=False),
+    Column('balance', MONEY, nullable=False),
+    Column('net', MONEY, nullable=False),
+    Index('ix_balance_snapshots_cycle', 'cycle'),
+)
+
+market_snapshots_table = Table(
+    'market_snapshots',
+    metadata,
+    Column('market', String(64), primary_key=True),
+    Column('cycle', Integer, primary_key=True, autoincrement=False),
+    Column('capacity', MONEY, nullable=False),
+    Column('invested', MONEY, nullable=False),
+    Column('income', MONEY, nullable=False),
+    Column('max_income', MONEY),
+    Column('bids', Integer, nullable=False),
+    Index('ix_market_snapshots_cycle', 'cycle'),
+)
+
+price_snapshots_table = Table(
+    'price_snapshots',
+    metadata,
+    Column('ticket', String(16), primary_key=True),
+    Column('cycle', Integer, primary_key=True, autoincrement=False),
+    Column('price', PRICE, nullable=False),
+    Index('ix_price_snapshots_cycle', 'cycle'),
+)
+
+# markets unlocked for the next cycle by the results of this one
+unlock_snapshots_table = Table(
+    'unlock_snapshots',
+    metadata,
+    Column('uid', String(64), primary_key=True),
+    Column('cycle', Integer, primary_key=True, autoincrement=False),
+    Column('market', String(64), primary_key=True),
+    Index('ix_unlock_snapshots_cycle', 'cycle'),
+)
+
+# replayed state every N cycles, kind is balance / capacity / price and name the uid, market or ticket
+replay_checkpoints_table = Table(
+    'replay_checkpoints',
+    metadata,
+    Column('cycle', Integer, primary_key=True, autoincrement=False),
+    Column('kind', String(16), primary_key=True),
+    Column('name', String(64), primary_key=True),
+    Column('value', MONEY, nullable=False),
+)
+
+schema_migrations_table = Table(
+    'schema_migrations',
+    metadata,
+    Column('version', Integer, primary_key=True, autoincrement=False),
+    Column('description', String(128), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+# indexes serving the filtered queries of db.py, created on existing databases by the migrations
+HOT_PATH_INDEXES = [
+    index
+    for table in (
+        users_table,
+        cycles_table,
+        stocks_table,
+        transactions_table,
+        markets_table,
+        investments_table,
+        balance_snapshots_table,
+        market_snapshots_table,
+        price_snapshots_table,
+        unlock_snapshots_table,
+    )
+    for index in sorted(table.indexes, key=lambda index: index.name)
+]
+
+
+def get_db_schema() -> Dict[str, Union[MetaData, Table]]:
+    return {
+        'metadata': metadata,
+        **metadata.tables,
+    }
+
+
+def create_db_schema(engine: Engine) -> None:
+    # creates only missing tables, existing ones are left as they are
+    metadata.create_all(engine)
+
+
+def verify_db_schema(engine: Engine) -> List[str]:
+    # reflects the live database and lists every table or column the declared schema expects but does not find
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    problems = []
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            problems.append(f'missing table {table.name}')
+            continue
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                problems.append(f'missing column {table.name}.{column.name}')
+    return problems
@@ -0,0 +1,142 @@
+import hashlib
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import delete
+from sqlalchemy.engine import Connection
+
+from qd_cyberpank_game.db import DEFAULT_CAPACITY, START_CAPATICY, TRANSACTION_COLUMNS, bulk_insert, income_transaction, update_ledger
+from qd_cyberpank_game.engine import QUOTE_POINTS
+from qd_cyberpank_game.schema import (balance_snapshots_table, balances_table, cycle_balances_table, cycles_table, investments_table,
+                                      market_links_table, market_snapshots_table, markets_table, price_snapshots_table,
+                                      replay_checkpoints_table, stocks_table, transactions_table, unlock_snapshots_table, users_table)
+
+SEED_PASSWORD = 'password'
+MIN_CAPACITY = 20000.0
+
+
+def make_users(n_users: int, market_names: np.ndarray, rng: np.random.Generator) -> pd.DataFrame:
+    logins = [f'corp{i}' for i in range(n_users)]
+    password_hash = hashlib.sha256(SEED_PASSWORD.encode()).hexdigest()
+    users_df = pd.DataFrame({
+        'uid': [hashlib.sha256(login.encode()).hexdigest() for login in logins],
+        'login': logins,
+        'password': password_hash,
+        'name': [f'Corp{i}' for i in range(n_users)],
+        'ticket': [f'C{i:03d}' for i in range(n_users)],
+        'home_market': rng.choice(market_names, size=n_users),
+    })
+    root = pd.DataFrame([{
+        'uid': 'root',
+        'login': 'root',
+        'password': password_hash,
+        'name': 'root',
+        'ticket': 'ROOT',
+        'home_market': market_names[0],
+    }])
+    return pd.concat([users_df, root], ignore_index=True)
+
+
+def make_markets(n_markets: int, rng: np.random.Generator) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    # the real markets first, then generated ones; every market links to the next one and to a random one
+    names = list(START_CAPATICY)[:n_markets] + [f'Рынок {i}' for i in range(len(START_CAPATICY), n_markets)]
+    capacities = [START_CAPATICY.get(name, DEFAULT_CAPACITY) for name in names]
+    ids = np.arange(1, n_markets + 1)
+    random_ids = rng.integers(1, n_markets + 1, size=n_markets)
+    markets_df = pd.DataFrame({
+        'id': ids,
+        'name': names,
+        'capacity': capacities,
+        'min_capacity': MIN_CAPACITY,
+    })
+    links_df = pd.DataFrame({
+        'source': np.concatenate([ids[:-1], ids]),
+        'target': np.concatenate([ids[1:], random_ids]),
+    })
+    links_df = links_df[links_df['source'] != links_df['target']].drop_duplicates().reset_index(drop=True)
+    return markets_df, links_df
+
+
+def seed_world(conn: Connection, n_users: int, n_markets: int, rng: np.random.Generator) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    # users and markets of a new game, everything else starts from reinit_game
+    markets_df, links_df = make_markets(n_markets, rng)
+    users_df = make_users(n_users, markets_df['name'].values, rng)
+    for table in (
+        replay_checkpoints_table,
+        balance_snapshots_table,
+        market_snapshots_table,
+        price_snapshots_table,
+        unlock_snapshots_table,
+        investments_table,
+        transactions_table,
+        balances_table,
+        cycle_balances_table,
+        stocks_table,
+        cycles_table,
+        users_table,
+        market_links_table,
+        markets_table,
+    ):
+        conn.execute(delete(table))
+    bulk_insert(conn, markets_table, markets_df)
+    bulk_insert(conn, market_links_table, links_df)
+    bulk_insert(conn, users_table, users_df)
+    return users_df[users_df['uid'] != 'root'].reset_index(drop=True), markets_df
+
+
+def seed_history(
+    conn: Connection,
+    users_df: pd.DataFrame,
+    markets_df: pd.DataFrame,
+    n_cycles: int,
+    rng: np.random.Generator,
+    bids_per_user: int = 3,
+) -> None:
+    # synthetic finished cycles, written straight into the tables (no game logic), for query plan and load checks
+    n_users = len(users_df)
+    start = datetime.now() - timedelta(hours=n_cycles)
+    bids_per_user = min(bids_per_user, len(markets_df))
+    for cycle in range(1, n_cycles + 1):
+        cycle_start = start + timedelta(hours=cycle)
+        bulk_insert(conn, cycles_table, {'cycle': [cycle], 'timestamp': [cycle_start], 'fund_speed': [50000000.0]})
+        markets = np.concatenate([rng.choice(markets_df['name'].values, size=bids_per_user, replace=False) for _ in range(n_users)])
+        uids = np.repeat(users_df['uid'].values, bids_per_user)
+        amounts = rng.uniform(1, 100, size=len(uids)).round() * 1000000
+        incomes = amounts * rng.normal(0, 0.2, size=len(uids))
+        bulk_insert(conn, investments_table, {
+            'uid': uids,
+            'market': markets,
+            'amount': amounts,
+            'timestamp_created': [cycle_start] * len(uids),
+            'timestamp_approved': [cycle_start + timedelta(minutes=1)] * len(uids),
+            'status': np.ones(len(uids), dtype=int),
+            'cycle': np.full(len(uids), cycle),
+            'income': incomes,
+            'multiplier': np.ones(len(uids)),
+        })
+        transactions_df = pd.DataFrame([
+            income_transaction(uid, market, income, cycle) for uid, market, income in zip(uids, markets, incomes.tolist())
+        ], columns=TRANSACTION_COLUMNS)
+        bulk_insert(conn, transactions_table, transactions_df)
+        update_ledger(conn, transactions_df, balances_table, cycle_balances_table)
+        prices = 100 + rng.normal(0, 5, size=(n_users, len(QUOTE_POINTS))).cumsum(axis=1)
+        bulk_insert(conn, stocks_table, {
+            'ticket': np.repeat(users_df['ticket'].values, len(QUOTE_POINTS)),
+            'cycle': np.tile(QUOTE_POINTS + cycle - 1, n_users),
+            'price': prices.ravel(),
+        })
+
+
+def seed_game(
+    conn: Connection,
+    n_users: int,
+    n_markets: int,
+    n_cycles: int,
+    seed: Optional[int] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    rng = np.random.default_rng(seed)
+    users_df, markets_df = seed_world(conn, n_users, n_markets, rng)
+    seed_history(conn, users_df, markets_df, n_cycles, rng)
+    return users_df, markets_df
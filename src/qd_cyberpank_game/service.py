@@ -0,0 +1,227 @@
+import base64
+import binascii
+import hashlib
+import json
+import re
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+import qd_cyberpank_game.db as db
+from qd_cyberpank_game.cache import SharedCache
+from qd_cyberpank_game.metrics import METRICS
+from qd_cyberpank_game.schema import get_db_schema
+from qd_cyberpank_game.structures import GameVersion
+
+# viewers polling within this window share one version probe
+VERSION_TTL = 1.0
+# encoded payloads, a few global datasets plus the balance and bids of every player
+PAYLOAD_CACHE_SIZE = 256
+USER_PATH_RE = re.compile(r'^/users/(?P<uid>[^/]+)/(?P<dataset>investments|balance)$')
+# the game master account sees every bid, it is never served
+ROOT_UID = 'root'
+
+# encoded body and its ETag
+Payload = Tuple[bytes, str]
+
+
+def columnar(frame: pd.DataFrame) -> Dict[str, Any]:
+    # one list per column instead of one object per row, NaN/NaT become null and timestamps ISO strings
+    data = {}
+    for column in frame.columns:
+        values = frame[column]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            values = values.dt.strftime('%Y-%m-%dT%H:%M:%S.%f')
+        data[str(column)] = values.astype(object).where(values.notna(), None).tolist()
+    return {'columns': [str(column) for column in frame.columns], 'rows': len(frame), 'data': data}
+
+
+def encode(body: Any, tag: Optional[Hashable] = None) -> Payload:
+    # version-keyed ETags need no hashing of the body, everything else is tagged by its content
+    encoded = json.dumps(body, ensure_ascii=False, separators=(',', ':'), default=str).encode()
+    digest = hashlib.sha1(repr(tag).encode() if tag is not None else encoded).hexdigest()[:16]
+    return encoded, f'"{digest}"'
+
+
+class VersionProbe:
+    def __init__(self, db_conn_str: str, ttl: float = VERSION_TTL):
+        self.db_conn_str = db_conn_str
+        self.ttl = ttl
+        self._version: Optional[GameVersion] = None
+        self._probed_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> GameVersion:
+        with self._lock:
+            if self._version is None or time.monotonic() - self._probed_at > self.ttl:
+                schema = get_db_schema()
+                self._version = db.get_game_version(
+                    self.db_conn_str, schema['cycles'], schema['transactions'], schema['stocks'], schema['investments'],
+                )
+                self._probed_at = time.monotonic()
+            return self._version
+
+
+class GameStateService:
+    # the read side of update_game_state: every payload is encoded once per game version and shared by all viewers;
+    # the service usually runs in its own process, so payloads have their own cache keyed by versions only
+    def __init__(self, db_conn_str: str, version_ttl: float = VERSION_TTL):
+        self.db_conn_str = db_conn_str
+        self.schema = get_db_schema()
+        self.probe = VersionProbe(db_conn_str, version_ttl)
+        self.cache = SharedCache(maxsize=PAYLOAD_CACHE_SIZE)
+
+    def cached(self, dataset: str, version: Hashable, loader: Callable[[], Any]) -> Payload:
+        return self.cache.get_or_load(self.db_conn_str, dataset, version, lambda: encode(loader(), (dataset, version)))
+
+    def version(self) -> Payload:
+        version = self.probe.get()
+        return self.cached('version', version, lambda: {
+            'cycle': version.cycle,
+            'fund_speed': version.fund_speed,
+            'cycle_timestamp': version.cycle_timestamp.isoformat() if version.cycle_timestamp is not None else None,
+            'game_started_at': version.game_started_at.isoformat() if version.game_started_at is not None else None,
+            'max_transaction_id': version.max_transaction_id,
+            'max_stock_id': version.max_stock_id,
+            'max_investment_id': version.max_investment_id,
+            'max_approved_at': version.max_approved_at.isoformat() if version.max_approved_at is not None else None,
+        })
+
+    def users(self) -> Payload:
+        version = self.probe.get()
+        return self.cached('users', (version.cycle, version.cycle_timestamp), lambda: columnar(
+            db.get_users(self.db_conn_str, self.schema['users']),
+        ))
+
+    def markets(self) -> Payload:
+        version = self.probe.get()
+        return self.cached('markets', (version.cycle, version.cycle_timestamp, version.max_stock_id), lambda: columnar(
+            db.get_markets(self.db_conn_str, self.schema['markets']).reset_index(),
+        ))
+
+    def stocks(self) -> Payload:
+        version = self.probe.get()
+        return self.cached('stocks', (version.game_started_at, version.max_stock_id), lambda: columnar(
+            db.get_stocks(self.db_conn_str, self.schema['stocks']),
+        ))
+
+    def balance(self, uid: str) -> Payload:
+        version = self.probe.get()
+
+        def load_balance() -> Dict[str, Any]:
+            balance, prev_cycle_net = db.get_balance(
+                self.db_conn_str, uid, version.cycle, self.schema['balances'], self.schema['cycle_balances'],
+            )
+            return {'uid': uid, 'cycle': version.cycle, 'balance': balance, 'prev_cycle_net': prev_cycle_net}
+        return self.cached(f'balance:{uid}', (version.cycle, version.max_transaction_id), load_balance)
+
+    def investments(self, uid: str, cycle: Optional[int] = None) -> Payload:
+        # multiplier edits move no part of the game version, so the bids are read on every request
+        # and tagged by their content: an unchanged list is still answered with 304
+        cycle = cycle if cycle is not None else self.probe.get().cycle
+        return encode(columnar(db.get_cycle_investments(self.db_conn_str, uid, cycle, self.schema['investments'])))
+
+    def authenticate(self, login: str, password: str) -> Optional[str]:
+        # uid of a player with these credentials, None for unknown ones and the root account
+        user = db.auth(login, password, self.db_conn_str, self.schema['users'])
+        if user is None or user.uid == ROOT_UID:
+            return None
+        return user.uid
+
+
+class GameStateHandler(BaseHTTPRequestHandler):
+    service: GameStateService
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/metrics':
+            self.send_metrics()
+            return
+        # everything else is game state and needs the credentials of a player, who sees only their own bids and balance
+        uid = self.authenticated_uid()
+        if uid is None:
+            self.send_unauthorized()
+            return
+        routes: Dict[str, Callable[[], Payload]] = {
+            '/version': self.service.version,
+            '/users': self.service.users,
+            '/markets': self.service.markets,
+            '/stocks': self.service.stocks,
+        }
+        user_match = USER_PATH_RE.match(url.path)
+        if user_match and user_match['uid'] != uid:
+            self.send_error(HTTPStatus.FORBIDDEN)
+            return
+        try:
+            if url.path in routes:
+                payload = routes[url.path]()
+            elif user_match and user_match['dataset'] == 'balance':
+                payload = self.service.balance(user_match['uid'])
+            elif user_match:
+                cycle = int(query['cycle'][0]) if 'cycle' in query else None
+                payload = self.service.investments(user_match['uid'], cycle)
+            else:
+                self.send_error(HTTPStatus.NOT_FOUND)
+                return
+        except ValueError as error:
+            self.send_error(HTTPStatus.BAD_REQUEST, str(error))
+            return
+        self.send_payload(payload)
+
+    def authenticated_uid(self) -> Optional[str]:
+        # HTTP Basic credentials, the login and password of the game dashboard
+        scheme, _, encoded = self.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'basic':
+            return None
+        try:
+            login, separator, password = base64.b64decode(encoded.strip(), validate=True).decode().partition(':')
+        except (binascii.Error, UnicodeDecodeError):
+            return None
+        if not separator:
+            return None
+        return self.service.authenticate(login, password)
+
+    def send_unauthorized(self) -> None:
+        self.send_response(HTTPStatus.UNAUTHORIZED)
+        self.send_header('WWW-Authenticate', 'Basic realm="qd-game", charset="UTF-8"')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_payload(self, payload: Payload) -> None:
+        body, etag = payload
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        # clients keep the body but revalidate it on every poll
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_metrics(self) -> None:
+        # timings of the db.py calls made by this process, for a Prometheus scraper
+        body = METRICS.to_prometheus().encode()
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def make_server(db_conn_str: str, host: str = '127.0.0.1', port: int = 8502, version_ttl: float = VERSION_TTL) -> ThreadingHTTPServer:
+    handler = type('BoundGameStateHandler', (GameStateHandler,), {'service': GameStateService(db_conn_str, version_ttl)})
+    return ThreadingHTTPServer((host, port), handler)
@@ -0,0 +1,272 @@
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Table
+
+import qd_cyberpank_game.db as db
+from qd_cyberpank_game.budget import StatementScope, statement_scope
+from qd_cyberpank_game.graph import get_green_markets
+from qd_cyberpank_game.metrics import METRICS
+from qd_cyberpank_game.schema import create_db_schema, get_db_schema
+from qd_cyberpank_game.seed import seed_world
+from qd_cyberpank_game.structures import InvestmentBid
+
+# strategy(rng, balance, unlocked markets, markets_df, previous cycle bids of the player) -> {market: amount}
+Strategy = Callable[[np.random.Generator, float, List[str], pd.DataFrame, pd.DataFrame], Dict[str, float]]
+
+
+def random_strategy(
+    rng: np.random.Generator,
+    balance: float,
+    unlocked_markets: List[str],
+    markets_df: pd.DataFrame,
+    prev_investments_df: pd.DataFrame,
+) -> Dict[str, float]:
+    n_bids = rng.integers(1, len(unlocked_markets) + 1)
+    markets = rng.choice(unlocked_markets, size=n_bids, replace=False)
+    budget = balance * rng.uniform(0.1, 0.6)
+    return dict(zip(markets, budget * rng.dirichlet(np.ones(n_bids))))
+
+
+def greedy_strategy(
+    rng: np.random.Generator,
+    balance: float,
+    unlocked_markets: List[str],
+    markets_df: pd.DataFrame,
+    prev_investments_df: pd.DataFrame,
+) -> Dict[str, float]:
+    # everything into the unlocked market with the largest capacity
+    capacities = markets_df.set_index('name')['capacity'].reindex(unlocked_markets)
+    return {capacities.idxmax(): balance * 0.8}
+
+
+def conservative_strategy(
+    rng: np.random.Generator,
+    balance: float,
+    unlocked_markets: List[str],
+    markets_df: pd.DataFrame,
+    prev_investments_df: pd.DataFrame,
+) -> Dict[str, float]:
+    # small bids on last cycle's profitable markets, or on a random unlocked one
+    green_markets = prev_investments_df.loc[prev_investments_df['income'] > 0, 'market'].tolist()
+    markets = [market for market in green_markets if market in unlocked_markets] or [rng.choice(unlocked_markets)]
+    return {market: balance * 0.05 for market in markets}
+
+
+STRATEGIES: Dict[str, Strategy] = {
+    'random': random_strategy,
+    'greedy': greedy_strategy,
+    'conservative': conservative_strategy,
+}
+
+
+class PhaseTimer:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+
+    def measure(self, phase: str, func: Callable, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.latencies[phase].append(time.perf_counter() - start)
+        return result
+
+    def report(self) -> pd.DataFrame:
+        rows = []
+        for phase, latencies in self.latencies.items():
+            latencies_ms = np.array(latencies) * 1000
+            rows.append({
+                'phase': phase,
+                'calls': len(latencies),
+                'total_s': latencies_ms.sum() / 1000,
+                'p50_ms': np.percentile(latencies_ms, 50),
+                'p90_ms': np.percentile(latencies_ms, 90),
+                'p99_ms': np.percentile(latencies_ms, 99),
+                'max_ms': latencies_ms.max(),
+            })
+        return pd.DataFrame(rows)
+
+
+class StatementLog:
+    # SQL statements of every simulated rerun or callback, named like the dashboard scopes they mirror
+    def __init__(self):
+        self.summaries: List[Dict[str, object]] = []
+
+    @contextmanager
+    def scope(self, name: str) -> Iterator[StatementScope]:
+        with statement_scope(name) as scope:
+            yield scope
+        self.summaries.append(scope.summary())
+
+    def report(self) -> pd.DataFrame:
+        summaries = pd.DataFrame(self.summaries, columns=['scope', 'statements', 'round_trips', 'rows', 'budget'])
+        report = summaries.groupby('scope', sort=False).agg(
+            runs=('statements', 'size'),
+            mean_statements=('statements', 'mean'),
+            max_statements=('statements', 'max'),
+            max_round_trips=('round_trips', 'max'),
+            rows=('rows', 'sum'),
+            budget=('budget', 'first'),
+        )
+        return report.reset_index()
+
+
+def submit_bids(
+    db_conn_str: str,
+    db_schema: Dict[str, Table],
+    timer: PhaseTimer,
+    uid: str,
+    cycle: int,
+    bids: Dict[str, float],
+    balance: float,
+    frozen_markets: List[str],
+) -> int:
+    # mirrors markets_investment_callback: amounts in 0.5 mln steps, frozen markets skipped, bids over balance rejected
+    bids_balance = 0
+    submitted = 0
+    for market, amount in bids.items():
+        inv_amount = np.floor(amount / 500000) * 500000
+        if inv_amount <= 0 or market in frozen_markets:
+            continue
+        bids_balance += inv_amount
+        if bids_balance > balance:
+            continue
+        investment_bid = InvestmentBid(
+            id=None,
+            uid=uid,
+            market=market,
+            amount=float(inv_amount),
+            timestamp_created=datetime.now(),
+            timestamp_approved=None,
+            status=-1,
+            cycle=cycle,
+            income=None,
+            multiplier=None,
+        )
+        timer.measure('submit_bid', db.make_investment, db_conn_str, db_schema['investments'], investment_bid)
+        submitted += 1
+    return submitted
+
+
+def run_simulation(
+    db_conn_str: str,
+    n_users: int,
+    n_markets: int,
+    n_cycles: int,
+    strategy: str = 'random',
+    approve_rate: float = 0.9,
+    cycle_minutes: float = 10.0,
+    seed: Optional[int] = None,
+) -> Dict[str, object]:
+    rng = np.random.default_rng(seed)
+    choose_bids = STRATEGIES[strategy]
+    db_schema = get_db_schema()
+    engine = db.get_engine(db_conn_str)
+    create_db_schema(engine)
+    with engine.begin() as conn:
+        users_df, _ = seed_world(conn, n_users, n_markets, rng)
+    db.reinit_game(
+        db_conn_str,
+        users_df,
+        db_schema['markets'],
+        db_schema['stocks'],
+        db_schema['transactions'],
+        db_schema['balances'],
+        db_schema['cycle_balances'],
+        db_schema['investments'],
+        db_schema['cycles'],
+        db_schema['balance_snapshots'],
+        db_schema['market_snapshots'],
+        db_schema['price_snapshots'],
+        db_schema['unlock_snapshots'],
+        db_schema['replay_checkpoints'],
+        seed=seed,
+        start_bonuses={},
+    )
+
+    market_graph = db.get_market_graph(db_conn_str, db_schema['markets'], db_schema['market_links'])
+
+    timer = PhaseTimer()
+    statements = StatementLog()
+    total_bids = 0
+    started = time.perf_counter()
+    for _ in range(n_cycles):
+        with statements.scope('root_refresh'):
+            cycle, fund_speed = timer.measure('root_refresh', db.get_current_cycle, db_conn_str, db_schema['cycles'])
+            METRICS.set_cycle(cycle)
+            markets_df = timer.measure('root_refresh', db.get_markets, db_conn_str, db_schema['markets'])
+
+        # players refresh their dashboards and submit bids
+        for user in users_df.itertuples():
+            with statements.scope('player_refresh'):
+                balance, _ = timer.measure(
+                    'player_refresh', db.get_balance, db_conn_str, user.uid, cycle, db_schema['balances'], db_schema['cycle_balances'],
+                )
+                prev_investments_df = timer.measure(
+                    'player_refresh', db.get_cycle_investments, db_conn_str, user.uid, cycle - 1, db_schema['investments'],
+                )
+                investments_df = timer.measure(
+                    'player_refresh', db.get_cycle_investments, db_conn_str, user.uid, cycle, db_schema['investments'],
+                )
+            frozen_markets = investments_df.loc[investments_df['status'].isin([-1, 1]), 'market'].tolist()
+            balance -= investments_df.loc[investments_df['status'].isin([-1, 1]), 'amount'].sum()
+            unlocked_markets = market_graph.unlocked_markets(get_green_markets(prev_investments_df), user.home_market)
+            bids = choose_bids(rng, balance, unlocked_markets, markets_df, prev_investments_df)
+            with statements.scope('markets_investment_callback'):
+                total_bids += submit_bids(db_conn_str, db_schema, timer, user.uid, cycle, bids, balance, frozen_markets)
+
+        # root approves pending bids one by one, like bid_check_callback
+        with statements.scope('root_refresh'):
+            investments_df = timer.measure('root_refresh', db.get_cycle_investments, db_conn_str, 'root', cycle, db_schema['investments'])
+        for bid_id in investments_df.loc[investments_df['status'] == -1, 'id'].tolist():
+            status = int(rng.random() < approve_rate)
+            with statements.scope('bid_check_callback'):
+                timer.measure('approve_bid', db.update_investment_status, db_conn_str, db_schema['investments'], bid_id=bid_id, status=status)
+
+        # finish_cycle_callback
+        with statements.scope('finish_cycle_callback'):
+            investments_df = db.get_cycle_investments(db_conn_str, 'root', cycle, db_schema['investments'])
+            prev_investments_df = db.get_cycle_investments(db_conn_str, 'root', cycle - 1, db_schema['investments'])
+            timer.measure(
+                'auto_green_investment', db.make_auto_green_investment,
+                db_conn_str, investments_df, prev_investments_df, cycle, db_schema['investments'],
+            )
+            investments_df = db.get_cycle_investments(db_conn_str, 'root', cycle, db_schema['investments'])
+            timer.measure(
+                'finish_cycle', db.finish_cycle,
+                db_conn_str=db_conn_str,
+                investments_df=investments_df,
+                markets_df=db.get_markets(db_conn_str, db_schema['markets']),
+                stocks_df=db.get_stocks(db_conn_str, db_schema['stocks']),
+                users_df=users_df,
+                fund_speed=fund_speed,
+                cycle=cycle,
+                investments_table=db_schema['investments'],
+                markets_table=db_schema['markets'],
+                market_links_table=db_schema['market_links'],
+                transactions_table=db_schema['transactions'],
+                stocks_table=db_schema['stocks'],
+                balances_table=db_schema['balances'],
+                cycle_balances_table=db_schema['cycle_balances'],
+                balance_snapshots_table=db_schema['balance_snapshots'],
+                market_snapshots_table=db_schema['market_snapshots'],
+                price_snapshots_table=db_schema['price_snapshots'],
+                unlock_snapshots_table=db_schema['unlock_snapshots'],
+                seed=seed,
+                now=datetime.now() + timedelta(minutes=cycle_minutes),
+            )
+            timer.measure('next_cycle', db.make_next_cycle, db_conn_str, cycle, fund_speed, db_schema['cycles'])
+    elapsed = time.perf_counter() - started
+    return {
+        'cycles': n_cycles,
+        'bids': total_bids,
+        'elapsed_s': elapsed,
+        'cycles_per_s': n_cycles / elapsed,
+        'bids_per_s': total_bids / elapsed,
+        'phases': timer.report(),
+        'statements': statements.report(),
+    }
@@ -1,7 +1,9 @@
 from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.engine import Connection
 
 
 class ThemeColors(Enum):
@@ -25,6 +27,7 @@ class Transaction:
     to_: str
     amount: float
     cycle: int
+    id: Optional[int] = None
 
 
 @dataclass
@@ -39,3 +42,81 @@ class InvestmentBid:
     cycle: int
     income: Optional[float]
     multiplier: Optional[float]
+
+
+@dataclass
+class SettlementPhase:
+    name: str
+    rows: int
+    elapsed: float
+
+
+@dataclass(frozen=True)
+class GameVersion:
+    cycle: int
+    fund_speed: float
+    cycle_timestamp: Optional[datetime]
+    # the first cycles row, rewritten only by reinit_game: rows loaded before it moved belong to another game
+    game_started_at: Optional[datetime]
+    max_transaction_id: Optional[int]
+    max_stock_id: Optional[int]
+    max_investment_id: Optional[int]
+    # approvals update bids in place, so max ids alone miss them
+    max_approved_at: Optional[datetime]
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    table: str
+    name: str
+    columns: Tuple[str, ...]
+    unique: bool = False
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+@dataclass
+class QueryPlan:
+    name: str
+    sql: str
+    plan: List[str]
+    full_scans: List[str]
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    size: str
+    seconds: float
+    baseline: Optional[float] = None
+
+    @property
+    def key(self) -> str:
+        return f'{self.name}[{self.size}]'
+
+
+@dataclass(frozen=True)
+class SweepParams:
+    capacity: float = 250000000.0
+    min_capacity: float = 20000.0
+    jackpot_divisor: float = 2.0
+    fund_speed: float = 50000000.0
+    cycle_minutes: float = 15.0
+    min_players: int = 2
+    max_players: int = 4
+    n_cycles: int = 20
+
+
+@dataclass
+class ReplayState:
+    # ledger balances by uid, market capacities and closing prices by ticket after the replayed cycle
+    cycle: int
+    balances: Dict[str, float]
+    capacities: Dict[str, float]
+    prices: Dict[str, float]
+    checkpoint: Optional[int] = None
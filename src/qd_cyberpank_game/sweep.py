@@ -0,0 +1,156 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from qd_cyberpank_game.engine import calculate_market_batch
+from qd_cyberpank_game.structures import SweepParams
+
+CHUNK_TRAJECTORIES = 20000
+N_BINS = 20
+
+
+class SweepAggregate:
+    # running sums only, so chunks from different workers merge in any order without keeping scenarios
+    def __init__(self, n_cycles: int, n_bins: int = N_BINS):
+        self.n_bins = n_bins
+        self.share_count = np.zeros(n_bins)
+        self.leader_profit = np.zeros(n_bins)
+        self.rest_profit = np.zeros(n_bins)
+        self.rest_count = np.zeros(n_bins)
+        self.share_variance = np.zeros(n_bins)
+        self.capacity_sum = np.zeros(n_cycles)
+        self.capacity_sq_sum = np.zeros(n_cycles)
+        self.capacity_min = np.full(n_cycles, np.inf)
+        self.capacity_max = np.full(n_cycles, -np.inf)
+        self.capacity_floored = np.zeros(n_cycles)
+        self.trajectories = 0
+
+    @property
+    def scenarios(self) -> int:
+        return int(self.share_count.sum())
+
+    def add_cycle(
+        self,
+        cycle: int,
+        x: np.ndarray,
+        mask: np.ndarray,
+        incomes: np.ndarray,
+        capacities: np.ndarray,
+        min_capacity: float,
+    ) -> None:
+        shares = x / x.sum(axis=1, keepdims=True)
+        n_players = mask.sum(axis=1)
+        leader = shares.argmax(axis=1)
+        rows = np.arange(len(x))
+        max_shares = shares[rows, leader]
+        bins = np.minimum((max_shares * self.n_bins).astype(int), self.n_bins - 1)
+        profit_ratios = np.where(mask, incomes / np.where(mask, x, 1.0), 0.0)
+        leader_profit = profit_ratios[rows, leader]
+        rest_profit = profit_ratios.sum(axis=1) - leader_profit
+        # population variance over the real players of every row
+        means = 1 / n_players
+        variances = (np.where(mask, np.square(shares - means[:, None]), 0.0)).sum(axis=1) / n_players
+
+        self.share_count += np.bincount(bins, minlength=self.n_bins)
+        self.leader_profit += np.bincount(bins, weights=leader_profit, minlength=self.n_bins)
+        self.rest_profit += np.bincount(bins, weights=rest_profit, minlength=self.n_bins)
+        self.rest_count += np.bincount(bins, weights=n_players - 1, minlength=self.n_bins)
+        self.share_variance += np.bincount(bins, weights=variances, minlength=self.n_bins)
+
+        self.capacity_sum[cycle] += capacities.sum()
+        self.capacity_sq_sum[cycle] += np.square(capacities).sum()
+        self.capacity_min[cycle] = min(self.capacity_min[cycle], capacities.min())
+        self.capacity_max[cycle] = max(self.capacity_max[cycle], capacities.max())
+        self.capacity_floored[cycle] += (capacities <= min_capacity).sum()
+
+    def merge(self, other: 'SweepAggregate') -> None:
+        for name in ('share_count', 'leader_profit', 'rest_profit', 'rest_count', 'share_variance',
+                     'capacity_sum', 'capacity_sq_sum', 'capacity_floored'):
+            getattr(self, name).__iadd__(getattr(other, name))
+        self.capacity_min = np.minimum(self.capacity_min, other.capacity_min)
+        self.capacity_max = np.maximum(self.capacity_max, other.capacity_max)
+        self.trajectories += other.trajectories
+
+    def profit_curve(self) -> pd.DataFrame:
+        # mean profit per invested unit of the largest bidder and of everyone else, by the largest share
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return pd.DataFrame({
+                'max_share': (np.arange(self.n_bins) + 0.5) / self.n_bins,
+                'scenarios': self.share_count.astype(int),
+                'leader_profit': self.leader_profit / self.share_count,
+                'rest_profit': self.rest_profit / self.rest_count,
+                'share_variance': self.share_variance / self.share_count,
+            })
+
+    def capacity_trajectory(self) -> pd.DataFrame:
+        mean = self.capacity_sum / self.trajectories
+        std = np.sqrt(np.maximum(self.capacity_sq_sum / self.trajectories - np.square(mean), 0))
+        return pd.DataFrame({
+            'cycle': np.arange(len(mean)) + 1,
+            'mean': mean,
+            'std': std,
+            'min': self.capacity_min,
+            'max': self.capacity_max,
+            'floored': self.capacity_floored / self.trajectories,
+        })
+
+
+def sample_bids(rng: np.random.Generator, n_rows: int, params: SweepParams) -> Tuple[np.ndarray, np.ndarray]:
+    # every player funds fund_speed per minute for a random part of the cycle, rows padded to max_players
+    n_players = rng.integers(params.min_players, params.max_players + 1, size=n_rows)
+    mask = np.arange(params.max_players) < n_players[:, None]
+    minutes = rng.uniform(1, params.cycle_minutes, size=(n_rows, params.max_players))
+    return np.where(mask, params.fund_speed * minutes, 0.0), mask
+
+
+def sweep_chunk(params: SweepParams, n_trajectories: int, seed: np.random.SeedSequence, n_bins: int = N_BINS) -> SweepAggregate:
+    rng = np.random.default_rng(seed)
+    aggregate = SweepAggregate(params.n_cycles, n_bins)
+    aggregate.trajectories = n_trajectories
+    capacities = np.full(n_trajectories, params.capacity)
+    min_capacities = np.full(n_trajectories, params.min_capacity)
+    for cycle in range(params.n_cycles):
+        x, mask = sample_bids(rng, n_trajectories, params)
+        incomes, capacities = calculate_market_batch(x, mask, capacities, min_capacities, params.jackpot_divisor)
+        aggregate.add_cycle(cycle, x, mask, incomes, capacities, params.min_capacity)
+    return aggregate
+
+
+def iter_sweep(
+    params: SweepParams,
+    n_scenarios: int,
+    workers: Optional[int] = None,
+    seed: Optional[int] = None,
+    chunk_trajectories: int = CHUNK_TRAJECTORIES,
+    n_bins: int = N_BINS,
+) -> Iterator[SweepAggregate]:
+    # a scenario is one market cycle, a trajectory is n_cycles scenarios of the same market;
+    # yields the merged aggregate after every finished chunk so callers can report progress
+    if n_scenarios < 1:
+        raise ValueError(f'n_scenarios must be at least 1, got {n_scenarios}')
+    if params.n_cycles < 1:
+        raise ValueError(f'n_cycles must be at least 1, got {params.n_cycles}')
+    if not 1 <= params.min_players <= params.max_players:
+        raise ValueError(f'players must satisfy 1 <= min_players <= max_players, got {params.min_players}..{params.max_players}')
+    n_trajectories = -(-n_scenarios // params.n_cycles)
+    chunks = [min(chunk_trajectories, n_trajectories - start) for start in range(0, n_trajectories, chunk_trajectories)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    total = SweepAggregate(params.n_cycles, n_bins)
+    if workers == 1:
+        for size, chunk_seed in zip(chunks, seeds):
+            total.merge(sweep_chunk(params, size, chunk_seed, n_bins))
+            yield total
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(sweep_chunk, params, size, chunk_seed, n_bins) for size, chunk_seed in zip(chunks, seeds)]
+        for future in as_completed(futures):
+            total.merge(future.result())
+            yield total
+
+
+def run_sweep(params: SweepParams, n_scenarios: int, **kwargs) -> Dict[str, pd.DataFrame]:
+    for aggregate in iter_sweep(params, n_scenarios, **kwargs):
+        pass
+    return {'profit_curve': aggregate.profit_curve(), 'capacity': aggregate.capacity_trajectory()}
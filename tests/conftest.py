@@ -0,0 +1,36 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+import qd_cyberpank_game.db as db
+from qd_cyberpank_game.schema import get_db_schema
+from qd_cyberpank_game.simulator import run_simulation
+
+SEED = 7
+N_USERS = 6
+N_MARKETS = 8
+N_CYCLES = 6
+
+
+@pytest.fixture(scope='session')
+def simulated_game_path(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    # one seeded game for the whole session, tests that write get a copy of it
+    path = tmp_path_factory.mktemp('game') / 'simulated.db'
+    db_conn_str = f'sqlite:///{path}'
+    run_simulation(db_conn_str, N_USERS, N_MARKETS, N_CYCLES, strategy='random', seed=SEED)
+    db.get_engine(db_conn_str).dispose()
+    return path
+
+
+@pytest.fixture
+def game_db(simulated_game_path: Path, tmp_path: Path) -> str:
+    path = tmp_path / 'game.db'
+    shutil.copy(simulated_game_path, path)
+    yield f'sqlite:///{path}'
+    db.dispose_engines()
+
+
+@pytest.fixture
+def db_schema():
+    return get_db_schema()
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from qd_cyberpank_game.charts import downsample_stocks, lttb
+
+
+def test_lttb_keeps_endpoints_and_point_count():
+    rng = np.random.default_rng(0)
+    x = np.sort(rng.uniform(0, 100, size=5000))
+    y = np.cumsum(rng.normal(size=5000))
+    kept = lttb(x, y, 300)
+    assert len(kept) == 300
+    assert kept[0] == 0 and kept[-1] == len(x) - 1
+    assert np.all(np.diff(kept) > 0)
+
+
+def test_lttb_keeps_spikes():
+    x = np.arange(1000, dtype=float)
+    y = np.zeros(1000)
+    y[500] = 100.0
+    assert 500 in lttb(x, y, 50)
+
+
+def test_lttb_short_series_untouched():
+    x = np.arange(10, dtype=float)
+    np.testing.assert_array_equal(lttb(x, x, 20), np.arange(10))
+    np.testing.assert_array_equal(lttb(x, x, 2), np.arange(10))
+
+
+def test_downsample_stocks_per_ticket():
+    cycles = np.arange(0, 200, 0.2)
+    stocks_df = pd.DataFrame({
+        'cycle': np.concatenate([cycles, cycles[:50]]),
+        'ticket': ['AAA'] * len(cycles) + ['BBB'] * 50,
+        'price': np.sin(np.concatenate([cycles, cycles[:50]])),
+    })
+    downsampled = downsample_stocks(stocks_df, max_points=100)
+    assert downsampled.groupby('ticket').size().to_dict() == {'AAA': 100, 'BBB': 50}
+    aaa = downsampled[downsampled['ticket'] == 'AAA']['cycle']
+    assert aaa.min() == cycles[0] and aaa.max() == cycles[-1]
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from qd_cyberpank_game.engine import calculate_investments, calculate_market, calculate_markets, generate_stocks
+
+
+def baseline_markets(x, market_codes, capacities, min_capacities):
+    # the per-market loop calculate_markets replaced
+    incomes = np.zeros(len(x))
+    new_capacities = np.zeros(len(capacities))
+    for code in range(len(capacities)):
+        in_market = market_codes == code
+        if not in_market.any():
+            new_capacities[code] = np.nan
+            continue
+        incomes[in_market], new_capacities[code] = calculate_market(x[in_market].copy(), capacities[code], min_capacities[code])
+    return incomes, new_capacities
+
+
+def test_calculate_markets_matches_per_market_loop():
+    rng = np.random.default_rng(0)
+    n_markets = 30
+    market_codes = rng.integers(0, n_markets, size=400)
+    # a market with a single bid hits the p == 1 guard
+    market_codes[0] = n_markets
+    x = rng.uniform(1e5, 5e7, size=len(market_codes))
+    capacities = rng.uniform(1e7, 3e8, size=n_markets + 1)
+    min_capacities = capacities * 0.1
+    incomes, new_capacities = calculate_markets(x, market_codes, capacities, min_capacities)
+    expected_incomes, expected_capacities = baseline_markets(x, market_codes, capacities, min_capacities)
+    has_bids = np.bincount(market_codes, minlength=n_markets + 1) > 0
+    np.testing.assert_allclose(incomes, expected_incomes, rtol=1e-7)
+    np.testing.assert_allclose(new_capacities[has_bids], expected_capacities[has_bids], rtol=1e-7)
+
+
+def test_calculate_investments_matches_per_market_loop():
+    rng = np.random.default_rng(1)
+    now = datetime(2021, 11, 20, 12, 0)
+    n_bids = 60
+    markets_df = pd.DataFrame({
+        'name': [f'market{i}' for i in range(5)],
+        'capacity': rng.uniform(1e7, 1e8, size=5),
+        'min_capacity': np.full(5, 1e6),
+    })
+    investments_df = pd.DataFrame({
+        'id': np.arange(n_bids),
+        'uid': [f'uid{i % 7}' for i in range(n_bids)],
+        'market': rng.choice(markets_df['name'], size=n_bids),
+        'amount': rng.uniform(1e5, 1e7, size=n_bids),
+        'timestamp_approved': [now - timedelta(minutes=int(minutes)) for minutes in rng.integers(1, 30, size=n_bids)],
+        'status': rng.choice([-1, 0, 1, 1, 1], size=n_bids),
+        'income': np.nan,
+        'multiplier': rng.choice([1.0, 1.5], size=n_bids),
+    })
+    market_incomes, capacities = calculate_investments(investments_df, markets_df, fund_speed=1e6, now=now)
+
+    approved = investments_df[investments_df['status'] == 1]
+    funded = approved['multiplier'] * np.minimum(1e6 * (now - approved['timestamp_approved']).dt.seconds / 60, approved['amount'])
+    for market, market_bids in approved.groupby('market'):
+        market_row = markets_df.set_index('name').loc[market]
+        incomes, capacity = calculate_market(funded[market_bids.index].values, market_row['capacity'], market_row['min_capacity'])
+        actual = market_incomes.set_index('bid_id').loc[market_bids['id'], 'income'].values
+        np.testing.assert_allclose(actual, incomes, rtol=1e-7)
+        assert capacities[market] == pytest.approx(capacity, rel=1e-7)
+    assert sorted(market_incomes['bid_id']) == sorted(approved['id'])
+
+
+def test_calculate_investments_without_approved_bids():
+    investments_df = pd.DataFrame({'status': [-1, 0], 'income': [np.nan, np.nan]})
+    assert calculate_investments(investments_df, pd.DataFrame(columns=['name']), fund_speed=1e6) is None
+
+
+@pytest.fixture
+def stocks_inputs():
+    users_df = pd.DataFrame({'uid': ['a', 'b', 'c'], 'ticket': ['AAA', 'BBB', 'AAA']})
+    stocks_df = pd.DataFrame({'cycle': [0.0, 0.0, 1.0], 'ticket': ['AAA', 'BBB', 'AAA'], 'price': [100.0, 50.0, 110.0]})
+    market_incomes = pd.DataFrame({'uid': ['a', 'b', 'c'], 'income': [1e6, -2e5, 3e5]})
+    return market_incomes, stocks_df, users_df
+
+
+def test_generate_stocks_is_deterministic(stocks_inputs):
+    market_incomes, stocks_df, users_df = stocks_inputs
+    first = generate_stocks(market_incomes, stocks_df, users_df, 2, rng=np.random.default_rng([3, 2]))
+    second = generate_stocks(market_incomes, stocks_df, users_df, 2, rng=np.random.default_rng([3, 2]))
+    pd.testing.assert_frame_equal(first, second)
+    assert sorted(first['ticket'].unique()) == ['AAA', 'BBB']
+    assert first.groupby('ticket').size().tolist() == [5, 5]
+    assert first['cycle'].between(2, 3).all()
+
+
+def test_generate_stocks_rejects_unknown_tickets(stocks_inputs):
+    market_incomes, stocks_df, users_df = stocks_inputs
+    with pytest.raises(ValueError, match='No previous quotes for tickets: BBB'):
+        generate_stocks(market_incomes, stocks_df[stocks_df['ticket'] != 'BBB'], users_df, 2)
+    with pytest.raises(ValueError, match='Unknown uids in market incomes: d'):
+        generate_stocks(pd.DataFrame({'uid': ['d'], 'income': [1.0]}), stocks_df, users_df, 2)
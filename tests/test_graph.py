@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from qd_cyberpank_game.graph import MarketGraph, get_green_markets
+
+
+def baseline_unlocked_markets(links, green_markets, home_market):
+    # the link loop of the original markets dashboard: both ends of a link touching a green market are unlocked
+    unlocked_markets = [home_market]
+    for source, target in links:
+        if source in green_markets or target in green_markets:
+            unlocked_markets.append(source)
+            unlocked_markets.append(target)
+    return np.unique(unlocked_markets).tolist()
+
+
+def test_unlocked_markets_matches_baseline():
+    rng = np.random.default_rng(0)
+    names = [f'market{i}' for i in range(40)]
+    markets_df = pd.DataFrame({'id': np.arange(100, 140), 'name': names})
+    links_df = pd.DataFrame({'source': rng.integers(100, 140, size=80), 'target': rng.integers(100, 140, size=80)})
+    links_df = links_df[links_df['source'] != links_df['target']]
+    graph = MarketGraph.from_frames(markets_df, links_df)
+    links = [(names[source - 100], names[target - 100]) for source, target in zip(links_df['source'], links_df['target'])]
+    assert graph.links() == links
+    for _ in range(20):
+        green_markets = rng.choice(names, size=rng.integers(0, 6), replace=False).tolist()
+        home_market = str(rng.choice(names))
+        assert graph.unlocked_markets(green_markets, home_market) == baseline_unlocked_markets(links, green_markets, home_market)
+
+
+def test_links_to_unknown_markets_are_dropped():
+    markets_df = pd.DataFrame({'id': [1, 2, 3], 'name': ['a', 'b', 'c']})
+    links_df = pd.DataFrame({'source': [1, 2, 9], 'target': [2, 7, 3]})
+    graph = MarketGraph.from_frames(markets_df, links_df)
+    assert graph.links() == [('a', 'b')]
+    assert graph.unlocked_markets(['a'], 'c') == ['a', 'b', 'c']
+    assert graph.neighbours('b') == ['a']
+
+
+def test_green_markets_follow_the_first_approved_bid():
+    investments_df = pd.DataFrame({
+        'market': ['a', 'a', 'b', 'c', 'c'],
+        'status': [1, 1, 1, 0, 1],
+        'income': [10.0, -5.0, -1.0, 3.0, 2.0],
+    })
+    assert get_green_markets(investments_df) == ['a', 'c']
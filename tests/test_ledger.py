@@ -0,0 +1,43 @@
+import pytest
+from sqlalchemy import select, update
+
+import qd_cyberpank_game.db as db
+from qd_cyberpank_game.structures import Transaction
+
+
+def stored_ledger(db_conn_str, db_schema):
+    with db.get_engine(db_conn_str).connect() as conn:
+        balances = dict(conn.execute(select(db_schema['balances'].c.uid, db_schema['balances'].c.balance)).fetchall())
+        cycle_balances = conn.execute(select(db_schema['cycle_balances'])).fetchall()
+    return {uid: float(balance) for uid, balance in balances.items()}, len(cycle_balances)
+
+
+def test_stored_ledger_matches_rebuilt_one(game_db, db_schema):
+    with db.get_engine(game_db).connect() as conn:
+        expected_balances, expected_cycle_balances = db.rebuild_balances(conn, db_schema['transactions'])
+    balances, n_cycle_balances = stored_ledger(game_db, db_schema)
+    assert n_cycle_balances == len(expected_cycle_balances)
+    for row in expected_balances.itertuples():
+        assert abs(balances[row.uid] - row.balance) < 0.01
+    diff = db.check_balances(game_db, db_schema['transactions'], db_schema['balances'], db_schema['cycle_balances'])
+    assert diff.empty
+
+
+def test_make_transaction_keeps_the_ledger(game_db, db_schema):
+    uid = db.get_users(game_db, db_schema['users'])['uid'].iloc[0]
+    balance_before, _ = db.get_balance(game_db, uid, 6, db_schema['balances'], db_schema['cycle_balances'])
+    db.make_transaction(game_db, db_schema['transactions'], Transaction(from_='root', to_=uid, amount=1000.0, cycle=6))
+    balance_after, _ = db.get_balance(game_db, uid, 6, db_schema['balances'], db_schema['cycle_balances'])
+    assert balance_after - balance_before == 1000.0
+    assert db.check_balances(game_db, db_schema['transactions'], db_schema['balances'], db_schema['cycle_balances']).empty
+
+
+def test_check_balances_reports_and_fixes_drift(game_db, db_schema):
+    uid = db.get_users(game_db, db_schema['users'])['uid'].iloc[0]
+    with db.get_engine(game_db).begin() as conn:
+        conn.execute(update(db_schema['balances']).where(db_schema['balances'].c.uid == uid).values(balance=db_schema['balances'].c.balance + 5))
+    diff = db.check_balances(game_db, db_schema['transactions'], db_schema['balances'], db_schema['cycle_balances'])
+    assert diff[['uid', 'cycle']].values.tolist() == [[uid, None]]
+    assert diff['stored'].iloc[0] - diff['expected'].iloc[0] == pytest.approx(5)
+    db.check_balances(game_db, db_schema['transactions'], db_schema['balances'], db_schema['cycle_balances'], fix=True)
+    assert db.check_balances(game_db, db_schema['transactions'], db_schema['balances'], db_schema['cycle_balances']).empty
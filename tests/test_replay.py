@@ -0,0 +1,47 @@
+import pytest
+from sqlalchemy import func, select
+
+import qd_cyberpank_game.db as db
+from qd_cyberpank_game.replay import replay_game
+
+
+def settled_cycle(db_conn_str, db_schema):
+    cycle, _ = db.get_current_cycle(db_conn_str, db_schema['cycles'])
+    return cycle - 1
+
+
+def test_replay_matches_simulation(game_db, db_schema):
+    state, mismatches = replay_game(game_db, db_schema, use_checkpoints=False)
+    assert mismatches.empty
+    assert state.cycle == settled_cycle(game_db, db_schema)
+    for uid in db.get_users(game_db, db_schema['users'])['uid']:
+        balance, _ = db.get_balance(game_db, uid, state.cycle + 1, db_schema['balances'], db_schema['cycle_balances'])
+        assert state.balances[uid] == pytest.approx(balance, abs=0.01)
+    markets_df = db.get_markets(game_db, db_schema['markets']).set_index('name')
+    for market, capacity in state.capacities.items():
+        assert capacity == pytest.approx(markets_df.loc[market, 'capacity'], rel=1e-6)
+
+
+def test_replay_from_checkpoint(game_db, db_schema):
+    # small chunks and checkpoints, then a replay to an earlier cycle that starts from one of them
+    full_state, mismatches = replay_game(game_db, db_schema, checkpoint_every=2, chunk_cycles=3)
+    assert mismatches.empty
+    with db.get_engine(game_db).connect() as conn:
+        checkpoints = conn.execute(select(func.count(func.distinct(db_schema['replay_checkpoints'].c.cycle)))).scalar()
+    assert checkpoints > 0
+    to_cycle = full_state.cycle - 1
+    state, mismatches = replay_game(game_db, db_schema, to_cycle=to_cycle)
+    assert mismatches.empty
+    assert state.checkpoint is not None and state.checkpoint <= to_cycle
+    fresh_state, _ = replay_game(game_db, db_schema, to_cycle=to_cycle, use_checkpoints=False)
+    assert state.balances == pytest.approx(fresh_state.balances, abs=0.01)
+    assert state.prices == pytest.approx(fresh_state.prices)
+
+
+def test_replay_detects_tampered_incomes(game_db, db_schema):
+    investments = db_schema['investments']
+    with db.get_engine(game_db).begin() as conn:
+        bid_id = conn.execute(select(func.min(investments.c.id)).where(investments.c.income.isnot(None))).scalar()
+        conn.execute(investments.update().where(investments.c.id == bid_id).values(income=investments.c.income + 1000))
+    _, mismatches = replay_game(game_db, db_schema, use_checkpoints=False)
+    assert not mismatches.empty
@@ -0,0 +1,77 @@
+import base64
+import hashlib
+import threading
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+import qd_cyberpank_game.db as db
+from qd_cyberpank_game.seed import SEED_PASSWORD
+from qd_cyberpank_game.service import make_server
+
+
+@pytest.fixture
+def service(game_db):
+    # version probes are not reused, every request sees the latest writes
+    server = make_server(game_db, port=0, version_ttl=0.0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+def get(url, login=None, password=SEED_PASSWORD, etag=None):
+    request = Request(url)
+    if login is not None:
+        request.add_header('Authorization', 'Basic ' + base64.b64encode(f'{login}:{password}'.encode()).decode())
+    if etag is not None:
+        request.add_header('If-None-Match', etag)
+    try:
+        with urlopen(request) as response:
+            return response.status, response.headers.get('ETag'), response.read()
+    except HTTPError as error:
+        return error.code, error.headers.get('ETag'), b''
+
+
+def uid(login):
+    return hashlib.sha256(login.encode()).hexdigest()
+
+
+def test_etag_and_not_modified(service, game_db, db_schema):
+    status, etag, body = get(f'{service}/stocks', 'corp0')
+    assert status == 200 and etag and body
+    assert get(f'{service}/stocks', 'corp0', etag=etag)[:2] == (304, etag)
+    # new quotes move the stocks version
+    db.make_stocks(game_db, db_schema['stocks'], db.get_stocks(game_db, db_schema['stocks']).tail(1).drop(columns='id'))
+    status, new_etag, _ = get(f'{service}/stocks', 'corp0', etag=etag)
+    assert status == 200 and new_etag != etag
+
+
+def test_investments_see_multiplier_edits(service, game_db, db_schema):
+    url = f'{service}/users/{uid("corp0")}/investments?cycle=3'
+    status, etag, _ = get(url, 'corp0')
+    assert status == 200
+    assert get(url, 'corp0', etag=etag)[0] == 304
+    bids = db.get_cycle_investments(game_db, uid('corp0'), 3, db_schema['investments'])
+    if bids.empty:
+        pytest.skip('corp0 placed no bids in cycle 3')
+    db.update_investment_multiplier(game_db, db_schema['investments'], int(bids['id'].iloc[0]), 2.5)
+    assert get(url, 'corp0', etag=etag)[0] == 200
+
+
+def test_credentials_are_required(service):
+    assert get(f'{service}/version')[0] == 401
+    assert get(f'{service}/users', 'corp0', password='wrong')[0] == 401
+    assert get(f'{service}/users', 'root')[0] == 401
+    assert get(f'{service}/users', 'corp0')[0] == 200
+    assert get(f'{service}/metrics')[0] == 200
+
+
+def test_players_see_only_their_own_data(service):
+    assert get(f'{service}/users/{uid("corp0")}/balance', 'corp0')[0] == 200
+    assert get(f'{service}/users/{uid("corp1")}/balance', 'corp0')[0] == 403
+    assert get(f'{service}/users/root/investments', 'corp0')[0] == 403
+    assert get(f'{service}/users/{uid("corp0")}/investments?cycle=x', 'corp0')[0] == 400
+    assert get(f'{service}/unknown', 'corp0')[0] == 404